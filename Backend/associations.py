@@ -0,0 +1,212 @@
+"""
+Frequently-bought-together analysis (batch job).
+
+For each store, baskets from the last ASSOCIATION_WINDOW_DAYS are streamed
+from transaction_items (ordered by transaction) and turned into product
+pairs with NumPy. Pairs are counted as a sparse product x product
+co-occurrence matrix in coordinate form: one int64 key per pair
+(row * n_products + column), reduced with np.unique, so memory grows with
+the number of distinct pairs rather than products squared.
+
+From the pair counts and per-product basket counts it derives, for A -> B:
+    support    = baskets with A and B / all baskets
+    confidence = baskets with A and B / baskets with A
+    lift       = confidence / (baskets with B / all baskets)
+and stores the top ASSOCIATION_TOP_K products per product by lift, so the
+lookup endpoint reads a handful of rows from one index.
+
+Usage:
+    python associations.py              # all stores
+    python associations.py --tenant 12  # one store
+"""
+import argparse
+import time
+from datetime import timedelta
+import numpy as np
+from sqlalchemy import delete, insert, select
+import database
+import models
+from config import settings
+from database import utcnow
+
+CHUNK_SIZE = 200_000
+# Merge the per-chunk pair counts once this many keys are pending
+MERGE_THRESHOLD = 5_000_000
+
+def _merge(keys, counts):
+    """Sum counts of equal keys (sparse matrix in coordinate form)"""
+    keys, counts = np.concatenate(keys), np.concatenate(counts)
+    unique, inverse = np.unique(keys, return_inverse=True)
+    return unique, np.bincount(inverse, weights=counts).astype(np.int64)
+
+class CoOccurrence:
+    """Accumulates basket and pair counts over streamed (transaction, product index) rows"""
+
+    def __init__(self, n_products: int):
+        self.n = n_products
+        self.baskets = 0
+        self.item_counts = np.zeros(n_products, dtype=np.int64)
+        self._keys, self._counts, self._pending = [], [], 0
+
+    def add_baskets(self, transaction_ids, products):
+        """
+        Add complete baskets. Rows must be sorted by transaction and, within a
+        transaction, by product index without duplicates.
+        """
+        if not len(products):
+            return
+        starts = np.flatnonzero(np.r_[True, transaction_ids[1:] != transaction_ids[:-1]])
+        sizes = np.diff(np.r_[starts, len(products)])
+        self.baskets += len(starts)
+        self.item_counts += np.bincount(products, minlength=self.n)
+
+        # Very large baskets (stock-ups, business buyers) would dominate the pair counts
+        keep = np.repeat(sizes <= settings.ASSOCIATION_MAX_BASKET, sizes)
+        sizes = sizes[sizes <= settings.ASSOCIATION_MAX_BASKET]
+        products = products[keep]
+        if not len(products):
+            return
+        starts = np.r_[0, np.cumsum(sizes)[:-1]]
+
+        # Pair every item with each later item of its basket
+        basket = np.repeat(np.arange(len(sizes)), sizes)
+        position = np.arange(len(products)) - starts[basket]
+        partners = sizes[basket] - position - 1
+        left = np.repeat(np.arange(len(products)), partners)
+        offset = np.arange(len(left)) - np.repeat(np.cumsum(partners) - partners, partners)
+        keys = products[left] * self.n + products[left + 1 + offset]
+
+        keys, counts = np.unique(keys, return_counts=True)
+        self._keys.append(keys)
+        self._counts.append(counts)
+        self._pending += len(keys)
+        if self._pending > MERGE_THRESHOLD:
+            keys, counts = _merge(self._keys, self._counts)
+            self._keys, self._counts, self._pending = [keys], [counts], len(keys)
+
+    def pairs(self):
+        """(first, second, count) arrays for every pair seen together, first < second"""
+        if not self._keys:
+            empty = np.array([], dtype=np.int64)
+            return empty, empty, empty
+        keys, counts = _merge(self._keys, self._counts)
+        return keys // self.n, keys % self.n, counts
+
+def top_associations(co, min_count: int, top_k: int):
+    """
+    Directed rules A -> B ranked by lift (then pair count) per A, at most
+    top_k per product. Returns parallel arrays: a, b, rank, count, support,
+    confidence, lift.
+    """
+    first, second, counts = co.pairs()
+    frequent = counts >= min_count
+    first, second, counts = first[frequent], second[frequent], counts[frequent]
+    a, b = np.r_[first, second], np.r_[second, first]
+    counts = np.r_[counts, counts]
+
+    support = counts / co.baskets
+    confidence = counts / co.item_counts[a]
+    lift = confidence / (co.item_counts[b] / co.baskets)
+
+    order = np.lexsort((-counts, -lift, a))
+    a, b, counts, support, confidence, lift = (
+        values[order] for values in (a, b, counts, support, confidence, lift)
+    )
+    group_start = np.r_[True, a[1:] != a[:-1]] if len(a) else np.array([], dtype=bool)
+    positions = np.arange(len(a))
+    rank = positions - np.maximum.accumulate(np.where(group_start, positions, 0))
+    keep = rank < top_k
+    return a[keep], b[keep], rank[keep], counts[keep], support[keep], confidence[keep], lift[keep]
+
+def analyse_tenant(conn, tenant_id: int, since):
+    """Count baskets and pairs for one store; returns (product ids, CoOccurrence)"""
+    P, T, I = models.Product, models.Transaction, models.TransactionItem
+    product_ids = np.array(conn.execute(
+        select(P.id).where(P.tenant_id == tenant_id).order_by(P.id)
+    ).scalars().all(), dtype=np.int64)
+    co = CoOccurrence(len(product_ids))
+    if not len(product_ids):
+        return product_ids, co
+
+    query = select(I.transaction_id, I.product_id).join(T, T.id == I.transaction_id).where(
+        T.tenant_id == tenant_id,
+        T.created_at >= since,
+        I.created_at >= since,  # Prunes transaction_items partitions
+        I.product_id.isnot(None)
+    ).distinct().order_by(I.transaction_id, I.product_id)
+    result = conn.execute(query, execution_options={"stream_results": True, "yield_per": CHUNK_SIZE})
+
+    carry_transactions = np.array([], dtype=np.int64)
+    carry_products = np.array([], dtype=np.int64)
+    for chunk in result.partitions(CHUNK_SIZE):
+        transaction_ids, ids = (np.array(column, dtype=np.int64) for column in zip(*chunk))
+        index = np.minimum(np.searchsorted(product_ids, ids), len(product_ids) - 1)
+        # Products deleted since the sale drop out of the baskets
+        known = product_ids[index] == ids
+        transaction_ids = np.r_[carry_transactions, transaction_ids[known]]
+        products = np.r_[carry_products, index[known]]
+        # The last basket may continue in the next chunk
+        complete = transaction_ids != transaction_ids[-1] if len(transaction_ids) else transaction_ids
+        co.add_baskets(transaction_ids[complete], products[complete])
+        carry_transactions, carry_products = transaction_ids[~complete], products[~complete]
+    co.add_baskets(carry_transactions, carry_products)
+    return product_ids, co
+
+def refresh_associations(tenant_id: int = None, engine=None):
+    """Recompute and replace stored associations for every store (or one); returns stats"""
+    engine = engine or database.engine
+    started = time.perf_counter()
+    since = utcnow() - timedelta(days=settings.ASSOCIATION_WINDOW_DAYS)
+    A = models.ProductAssociation
+    now = utcnow()
+
+    with engine.connect() as conn:
+        query = select(models.Tenant.id).order_by(models.Tenant.id)
+        if tenant_id is not None:
+            query = query.where(models.Tenant.id == tenant_id)
+        tenant_ids = conn.execute(query).scalars().all()
+
+    baskets = stored = 0
+    for tenant in tenant_ids:
+        # One transaction per store: the lookup sees either the old or the new rules
+        with engine.begin() as conn:
+            product_ids, co = analyse_tenant(conn, tenant, since)
+            a, b, rank, counts, support, confidence, lift = top_associations(
+                co, settings.ASSOCIATION_MIN_COUNT, settings.ASSOCIATION_TOP_K
+            )
+            conn.execute(delete(A).where(A.tenant_id == tenant))
+            rows = [{
+                "tenant_id": tenant,
+                "product_id": int(product_ids[first]),
+                "related_product_id": int(product_ids[second]),
+                "rank": int(position),
+                "pair_count": int(count),
+                "support": round(float(pair_support), 6),
+                "confidence": round(float(pair_confidence), 4),
+                "lift": round(float(pair_lift), 3),
+                "updated_at": now
+            } for first, second, position, count, pair_support, pair_confidence, pair_lift in zip(
+                a, b, rank, counts, support, confidence, lift
+            )]
+            if rows:
+                conn.execute(insert(A), rows)
+        baskets += co.baskets
+        stored += len(rows)
+
+    return {
+        "stores": len(tenant_ids),
+        "baskets": baskets,
+        "associations": stored,
+        "seconds": round(time.perf_counter() - started, 2)
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recompute frequently-bought-together associations")
+    parser.add_argument("--tenant", type=int, default=None, help="Only this tenant id")
+    args = parser.parse_args()
+
+    stats = refresh_associations(args.tenant)
+    print(
+        f"✅ Stored {stats['associations']} associations from {stats['baskets']} baskets "
+        f"in {stats['stores']} stores in {stats['seconds']}s"
+    )
@@ -1,11 +1,12 @@
+import hmac
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 from jose import JWTError, jwt
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, Header, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
-import models
 import database
+import statements
 
 # Import settings
 from config import settings
@@ -14,9 +15,11 @@ from config import settings
 SECRET_KEY = settings.SECRET_KEY
 ALGORITHM = settings.ALGORITHM
 ACCESS_TOKEN_EXPIRE_MINUTES = settings.ACCESS_TOKEN_EXPIRE_MINUTES
+STREAM_TICKET_PURPOSE = "stream"
 
 # This tells FastAPI that the token comes from the /login endpoint
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/v1/auth/login")
+oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl="api/v1/auth/login", auto_error=False)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -35,23 +38,61 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
     Validates the JWT token and retrieves the user from the database.
     Used to protect routes (like adding products).
     """
+    return get_user_for_token(token, db)
+
+def get_current_user_for_stream(
+    token: Optional[str] = Depends(oauth2_scheme_optional),
+    ticket: Optional[str] = None,
+    db: Session = Depends(database.get_db)
+):
+    """
+    Same as get_current_user, but browsers may pass ?ticket= instead because
+    EventSource connections cannot send headers. Tickets come from
+    create_stream_ticket: they expire within STREAM_TICKET_SECONDS and only
+    open streams, so a URL that ends up in a proxy log is not a login.
+    """
+    if token:
+        return get_user_for_token(token, db)
+    return get_user_for_token(ticket, db, purpose=STREAM_TICKET_PURPOSE)
+
+def create_stream_ticket(email: str):
+    """Short-lived token accepted only by get_current_user_for_stream"""
+    return create_access_token(
+        data={"sub": email, "purpose": STREAM_TICKET_PURPOSE},
+        expires_delta=timedelta(seconds=settings.STREAM_TICKET_SECONDS)
+    )
+
+def get_user_for_token(token: Optional[str], db: Session, purpose: Optional[str] = None):
+    """The user a token was issued to; purpose must match (None for access tokens)"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    if not token:
+        raise credentials_exception
     try:
         # Decode the token
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
-        if email is None:
+        if email is None or payload.get("purpose") != purpose:
             raise credentials_exception
     except JWTError:
         raise credentials_exception
     
     # Check if user exists in DB
-    user = db.query(models.User).filter(models.User.email == email).first()
+    user = statements.user_by_email(db, email)
     if user is None:
         raise credentials_exception
         
-    return user
\ No newline at end of file
+    return user
+
+def require_operator(x_operator_token: Optional[str] = Header(None)):
+    """
+    Guards server-wide endpoints (metrics, profiles). They cover every
+    tenant, so a store login is not enough: the caller must hold
+    OPERATOR_TOKEN. Disabled while it is unset.
+    """
+    if not settings.OPERATOR_TOKEN or not x_operator_token or \
+            not hmac.compare_digest(x_operator_token, settings.OPERATOR_TOKEN):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Operator access required")
@@ -0,0 +1,112 @@
+"""
+Checkout lane benchmark.
+
+Simulates N tills ("lanes") against a scratch database: each lane scans
+three barcodes, checks out the basket and every fifth sale reloads the
+product list, back to back with no think time. Reports checkouts per second,
+latency percentiles and failed requests for each lane count, so the
+SQLite profile (or any DATABASE_URL) can be sized for a store.
+
+A real lane completes a sale every 30-60 seconds, so a database sustaining
+X checkouts/s at an acceptable p95 serves roughly X * 45 lanes.
+
+Usage:
+    python benchmark_lanes.py                        # scratch SQLite file
+    python benchmark_lanes.py --lanes 1,4,16 --seconds 20
+    SQLITE_TUNED=False python benchmark_lanes.py     # compare with stock SQLite
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def run_lanes(client, headers, products, lanes: int, seconds: float):
+    """Run `lanes` concurrent tills for `seconds`; returns (latencies, failures)"""
+    latencies, failures = [], []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def lane(seed):
+        rng = random.Random(seed)
+        sale = 0
+        while time.perf_counter() < deadline:
+            basket = rng.sample(products, 3)
+            for product in basket:
+                response = client.get(f"/api/v1/products/by-barcode/{product['barcode']}", headers=headers)
+                if response.status_code != 200:
+                    with lock:
+                        failures.append(response.status_code)
+            started = time.perf_counter()
+            response = client.post("/api/v1/transactions/create", headers=headers, json={
+                "items": [{
+                    "product_id": product["id"], "product_name": product["name"],
+                    "quantity": 1, "unit_price": product["selling_price"]
+                } for product in basket],
+                "payment_method": "cash"
+            })
+            elapsed = time.perf_counter() - started
+            with lock:
+                if response.status_code == 200:
+                    latencies.append(elapsed)
+                else:
+                    failures.append(response.status_code)
+            sale += 1
+            if sale % 5 == 0:
+                client.get("/api/v1/products", headers=headers)
+
+    threads = [threading.Thread(target=lane, args=(seed,)) for seed in range(lanes)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, failures
+
+def main(lane_counts, seconds: float, product_count: int):
+    from fastapi.testclient import TestClient
+    from config import settings
+    settings.AUTH_RATE_LIMIT_ENABLED = False
+    import main as app_module
+
+    with TestClient(app_module.app) as client:
+        response = client.post("/api/v1/auth/signup", json={
+            "store_name": "Benchmark Store", "contact_phone": "0", "address": "-", "city": "-", "state": "-",
+            "first_name": "Bench", "last_name": "Mark", "email": f"bench{time.time_ns()}@example.com",
+            "password": "Benchmark1!", "plan_id": "basic", "terms_accepted": True
+        })
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        category = client.post("/api/v1/categories", json={"name": "Bench"}, headers=headers).json()
+        products = [client.post("/api/v1/products", headers=headers, json={
+            "name": f"Product {i}", "barcode": f"BENCH{i:06d}", "category_id": category["id"],
+            "cost_price": 1.0, "selling_price": 2.5, "stock_quantity": 1_000_000
+        }).json() for i in range(product_count)]
+
+        print(f"Database: {settings.DATABASE_URL} (SQLITE_TUNED={settings.SQLITE_TUNED})")
+        print(f"{'lanes':>5} {'checkouts/s':>12} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'failed':>7}")
+        for lanes in lane_counts:
+            latencies, failures = run_lanes(client, headers, products, lanes, seconds)
+            print(
+                f"{lanes:>5} {len(latencies) / seconds:>12.1f} "
+                f"{statistics.median(latencies) * 1000 if latencies else 0:>8.1f} "
+                f"{percentile(latencies, 0.95) * 1000:>8.1f} {percentile(latencies, 0.99) * 1000:>8.1f} "
+                f"{len(failures):>7}"
+            )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure checkout throughput for concurrent lanes")
+    parser.add_argument("--lanes", default="1,2,4,8,16", help="Comma-separated lane counts")
+    parser.add_argument("--seconds", type=float, default=10.0, help="Duration of each run")
+    parser.add_argument("--products", type=int, default=200, help="Products to seed")
+    args = parser.parse_args()
+
+    # Scratch database unless one is given explicitly
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/benchmark.db")
+    main([int(lanes) for lanes in args.lanes.split(",")], args.seconds, args.products)
@@ -0,0 +1,136 @@
+"""
+Statement construction micro-benchmark.
+
+Compares the per-call CPU time of the hot lookups written as
+db.query(...).filter(...) against the prebuilt statements in
+statements.py, on a small scratch database, so the time measured is mostly
+Python-side statement building and caching rather than SQL execution.
+
+Usage:
+    python benchmark_statements.py                   # scratch SQLite file
+    python benchmark_statements.py --calls 20000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+def with_items(transactions):
+    """Load each transaction's items, as serialising the history response does"""
+    for transaction in transactions:
+        transaction.items
+    return transactions
+
+def legacy_lookups(models):
+    """The same lookups as built per request before statements.py"""
+    return {
+        "user by email": lambda db, k: db.query(models.User).filter(
+            models.User.email == k["email"]
+        ).first(),
+        "product by id": lambda db, k: db.query(models.Product).filter(
+            models.Product.id == k["product_id"],
+            models.Product.tenant_id == k["tenant_id"]
+        ).first(),
+        "product by barcode": lambda db, k: db.query(models.Product).filter(
+            models.Product.barcode == k["barcode"],
+            models.Product.tenant_id == k["tenant_id"]
+        ).first(),
+        "customer by id": lambda db, k: db.query(models.Customer).filter(
+            models.Customer.id == k["customer_id"],
+            models.Customer.tenant_id == k["tenant_id"]
+        ).first(),
+        "transaction list": lambda db, k: with_items(db.query(models.Transaction).filter(
+            models.Transaction.tenant_id == k["tenant_id"]
+        ).order_by(models.Transaction.created_at.desc()).offset(0).limit(20).all()),
+    }
+
+def cached_lookups(statements):
+    return {
+        "user by email": lambda db, k: statements.user_by_email(db, k["email"]),
+        "product by id": lambda db, k: statements.product_by_id(
+            db, k["tenant_id"], k["product_id"]
+        ),
+        "product by barcode": lambda db, k: statements.product_by_barcode(
+            db, k["tenant_id"], k["barcode"]
+        ),
+        "customer by id": lambda db, k: statements.customer_by_id(
+            db, k["tenant_id"], k["customer_id"]
+        ),
+        "transaction list": lambda db, k: statements.transaction_page(db, k["tenant_id"], 20),
+    }
+
+def cpu_per_call(lookup, db, keys, calls: int) -> float:
+    """Microseconds of CPU per call, best of three rounds"""
+    for _ in range(min(calls, 200)):  # Warm the compiled-SQL cache
+        lookup(db, keys)
+    rounds = []
+    for _ in range(3):
+        started = time.process_time()
+        for _ in range(calls):
+            lookup(db, keys)
+        rounds.append((time.process_time() - started) / calls * 1e6)
+    return min(rounds)
+
+def seed(db, models):
+    tenant = models.Tenant(
+        business_name="Benchmark Store", contact_phone="0", address="-", city="-", state="-"
+    )
+    db.add(tenant)
+    db.flush()
+    user = models.User(
+        first_name="Bench", last_name="Mark", email=f"bench{time.time_ns()}@example.com",
+        hashed_password="-", tenant_id=tenant.id
+    )
+    product = models.Product(
+        name="Bench", barcode="BENCH000001", cost_price=1.0, selling_price=2.0,
+        stock_quantity=100, tenant_id=tenant.id
+    )
+    customer = models.Customer(name="Bench", tenant_id=tenant.id)
+    db.add_all([user, product, customer])
+    db.flush()
+    db.add_all([models.Transaction(
+        tenant_id=tenant.id, user_id=user.id, subtotal=2.0, total_amount=2.0, payment_method="cash",
+        items=[models.TransactionItem(
+            product_id=product.id, product_name=product.name, quantity=1, unit_price=2.0, total_price=2.0
+        )]
+    ) for _ in range(20)])
+    db.commit()
+    return {
+        "email": user.email, "tenant_id": tenant.id, "product_id": product.id,
+        "barcode": product.barcode, "customer_id": customer.id
+    }
+
+def main(calls: int):
+    import database
+    import models
+    import statements
+    models.Base.metadata.create_all(bind=database.engine)
+
+    db = database.SessionLocal()
+    try:
+        keys = seed(db, models)
+        legacy, cached = legacy_lookups(models), cached_lookups(statements)
+        for name in legacy:
+            assert [row.id for row in _as_list(legacy[name](db, keys))] == \
+                [row.id for row in _as_list(cached[name](db, keys))], name
+
+        print(f"Database: {database.SQLALCHEMY_DATABASE_URL} ({calls} calls each)")
+        print(f"{'lookup':<20} {'query() µs':>11} {'cached µs':>10} {'saved µs':>9} {'saved':>6}")
+        for name in legacy:
+            before = cpu_per_call(legacy[name], db, keys, calls)
+            after = cpu_per_call(cached[name], db, keys, calls)
+            print(f"{name:<20} {before:>11.1f} {after:>10.1f} {before - after:>9.1f} {1 - after / before:>6.0%}")
+    finally:
+        db.close()
+
+def _as_list(result):
+    return result if isinstance(result, list) else [result]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure CPU saved by cached statements")
+    parser.add_argument("--calls", type=int, default=5000, help="Calls per lookup")
+    args = parser.parse_args()
+
+    # Scratch database unless one is given explicitly
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/benchmark.db")
+    main(args.calls)
@@ -0,0 +1,237 @@
+"""
+Per-tenant catalog change feed (products and categories) for open tills.
+
+Writers call record_*() before their commit, which adds a compact delta to
+the catalog_changes table in the same transaction. Every worker process runs
+a poller thread that reads new rows and fans them out to the Server-Sent
+Events subscribers connected to that process, so a change made through any
+worker reaches every till. The table doubles as a short replay log: a
+reconnecting EventSource sends Last-Event-ID and receives what it missed.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+from sqlalchemy import delete, func, or_, select
+import database
+import models
+from config import settings
+from database import utcnow
+
+logger = logging.getLogger(__name__)
+
+# Replay at most this many missed changes to a reconnecting client
+MAX_REPLAY = 1000
+# Sequence gaps (ids of transactions still in flight) are rechecked this long
+GAP_TIMEOUT_SECONDS = 10
+MAX_GAPS = 100
+PRUNE_INTERVAL_SECONDS = 3600
+# Sent to a client whose queue overflowed: it should refetch the catalog
+RESYNC = {"seq": None, "type": "resync", "data": {}}
+
+# Product fields tills work with: product upserts and the bootstrap snapshot columns
+PRODUCT_FIELDS = (
+    "id", "name", "barcode", "category_id", "selling_price", "stock_quantity", "min_stock_level", "version"
+)
+
+def product_delta(product, op: str = "upsert"):
+    """Compact product representation sent to tills"""
+    if op == "delete":
+        return {"id": product.id}
+    if op == "stock":
+        return {"id": product.id, "stock_quantity": product.stock_quantity, "version": product.version}
+    return {field: getattr(product, field) for field in PRODUCT_FIELDS}
+
+def category_delta(category, op: str = "upsert"):
+    if op == "delete":
+        return {"id": category.id}
+    return {"id": category.id, "name": category.name}
+
+def record_product_change(db, product, op: str = "upsert"):
+    """op: upsert (catalog fields), stock (quantity only) or delete. Call before commit."""
+    db.add(models.CatalogChange(
+        tenant_id=product.tenant_id,
+        entity="product",
+        op=op,
+        data=json.dumps(product_delta(product, op))
+    ))
+
+def record_category_change(db, category, op: str = "upsert"):
+    db.add(models.CatalogChange(
+        tenant_id=category.tenant_id,
+        entity="category",
+        op=op,
+        data=json.dumps(category_delta(category, op))
+    ))
+
+def to_event(change):
+    return {
+        "seq": change.id,
+        "type": f"{change.entity}.{change.op}",
+        "data": json.loads(change.data)
+    }
+
+def changes_since(tenant_id: int, last_seq: int):
+    """Changes for a tenant after last_seq (used to replay on reconnect)"""
+    db = database.ReadSessionLocal()
+    try:
+        rows = db.query(models.CatalogChange).filter(
+            models.CatalogChange.tenant_id == tenant_id,
+            models.CatalogChange.id > last_seq
+        ).order_by(models.CatalogChange.id).limit(MAX_REPLAY).all()
+        return [to_event(row) for row in rows]
+    finally:
+        db.close()
+
+def latest_change_id(db, tenant_id: int, entity: str = None):
+    """
+    Newest change for a tenant, optionally of one entity (one index probe);
+    used as a catalog/stock version token. prune() keeps the newest change
+    per tenant and entity, so the token never goes back.
+    """
+    query = db.query(func.max(models.CatalogChange.id)).filter(models.CatalogChange.tenant_id == tenant_id)
+    if entity is not None:
+        query = query.filter(models.CatalogChange.entity == entity)
+    return query.scalar()
+
+def catalog_snapshot(db, tenant_id: int):
+    """
+    A store's products as parallel arrays, one per PRODUCT_FIELDS entry
+    (ordered by id), read as plain columns without building ORM objects
+    """
+    P = models.Product
+    rows = db.execute(
+        select(*(getattr(P, field) for field in PRODUCT_FIELDS)).where(P.tenant_id == tenant_id).order_by(P.id)
+    ).all()
+    columns = list(zip(*rows)) if rows else [() for _ in PRODUCT_FIELDS]
+    return {field: list(values) for field, values in zip(PRODUCT_FIELDS, columns)}
+
+class ChangeBroker:
+    """
+    In-process pub/sub: tenant_id -> subscriber queues living on the event
+    loop. The poller thread publishes with call_soon_threadsafe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)  # tenant_id -> {(loop, queue)}
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_seq = None
+        self._gaps = {}  # missing seq -> first seen (monotonic)
+        self._last_prune = 0.0
+
+    def subscribe(self, tenant_id: int):
+        queue = asyncio.Queue(maxsize=1000)
+        entry = (asyncio.get_running_loop(), queue)
+        with self._lock:
+            self._subscribers[tenant_id].add(entry)
+        self.wake()
+        return entry
+
+    def unsubscribe(self, tenant_id: int, entry):
+        with self._lock:
+            self._subscribers[tenant_id].discard(entry)
+            if not self._subscribers[tenant_id]:
+                del self._subscribers[tenant_id]
+
+    def publish(self, tenant_id: int, event: dict):
+        with self._lock:
+            entries = list(self._subscribers.get(tenant_id, ()))
+        for loop, queue in entries:
+            loop.call_soon_threadsafe(self._offer, queue, event)
+
+    @staticmethod
+    def _offer(queue, event):
+        if queue.full():
+            # Slow client: drop its backlog and tell it to reload the catalog
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(RESYNC)
+            return
+        queue.put_nowait(event)
+
+    def wake(self):
+        """Poll now (called after a commit that recorded changes)"""
+        self._wakeup.set()
+
+    def poll_once(self):
+        """Read changes committed since the last poll and fan them out"""
+        db = database.PrimaryReadSessionLocal()
+        try:
+            if self._last_seq is None:
+                self._last_seq = db.query(func.max(models.CatalogChange.id)).scalar() or 0
+                return 0
+            query = db.query(models.CatalogChange)
+            if self._gaps:
+                query = query.filter(or_(
+                    models.CatalogChange.id > self._last_seq,
+                    models.CatalogChange.id.in_(list(self._gaps))
+                ))
+            else:
+                query = query.filter(models.CatalogChange.id > self._last_seq)
+            rows = query.order_by(models.CatalogChange.id).limit(500).all()
+        finally:
+            db.close()
+
+        now = time.monotonic()
+        for row in rows:
+            self._gaps.pop(row.id, None)
+            if row.id > self._last_seq:
+                # Ids skipped over may belong to transactions that have not committed yet
+                for missing in range(max(self._last_seq + 1, row.id - MAX_GAPS), row.id):
+                    self._gaps.setdefault(missing, now)
+                self._last_seq = row.id
+            self.publish(row.tenant_id, to_event(row))
+        self._gaps = {seq: seen for seq, seen in self._gaps.items() if now - seen < GAP_TIMEOUT_SECONDS}
+        return len(rows)
+
+    def prune(self):
+        """Delete changes older than the retention window, except each tenant's newest per entity"""
+        cutoff = utcnow() - timedelta(hours=settings.CHANGE_FEED_RETENTION_HOURS)
+        C = models.CatalogChange
+        newest = select(func.max(C.id)).group_by(C.tenant_id, C.entity)
+        db = database.SessionLocal()
+        try:
+            db.execute(delete(C).where(C.created_at < cutoff, C.id.notin_(newest)))
+            db.commit()
+        finally:
+            db.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll_once()
+                if time.monotonic() - self._last_prune > PRUNE_INTERVAL_SECONDS:
+                    self._last_prune = time.monotonic()
+                    self.prune()
+            except Exception as e:
+                logger.error(f"Change feed poller error: {e}")
+            self._wakeup.wait(settings.CHANGE_FEED_POLL_INTERVAL)
+            self._wakeup.clear()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="changefeed-poller", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+broker = ChangeBroker()
+
+def format_sse(event: dict) -> str:
+    """Encode an event in text/event-stream format"""
+    data = json.dumps(event["data"], separators=(",", ":"))
+    if event["seq"] is None:
+        return f"event: {event['type']}\ndata: {data}\n\n"
+    return f"id: {event['seq']}\nevent: {event['type']}\ndata: {data}\n\n"
@@ -0,0 +1,227 @@
+"""
+Query Plan Check
+Runs EXPLAIN for the hot tenant-scoped queries used by main.py and fails
+(exit code 1) if any of them falls back to a sequential scan.
+
+By default the check runs against a scratch database that it creates,
+migrates, seeds with synthetic data and drops again: a temporary SQLite
+file, or a new database on the PostgreSQL server of DATABASE_URL. The
+configured database itself is never written to.
+
+Usage:
+    python check_query_plans.py               # scratch database (CI, before deploying)
+    python check_query_plans.py --existing    # EXPLAIN against the configured database, read only
+
+Works on PostgreSQL (EXPLAIN) and SQLite (EXPLAIN QUERY PLAN).
+"""
+import argparse
+import os
+import random
+import re
+import secrets
+import shutil
+import sys
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import create_engine, select, func, insert, text
+from sqlalchemy.engine import make_url
+
+SEED_TENANTS = 20
+SEED_PRODUCTS = 500
+SEED_CUSTOMERS = 500
+SEED_TRANSACTIONS = 2000
+SEED_ITEMS_PER_TRANSACTION = 3
+
+# Sequential scans cheaper than this (a handful of pages: empty partitions,
+# tables with a few rows) are the planner's correct choice and are ignored.
+MIN_SEQ_SCAN_COST = 100.0
+PLAN_COST = re.compile(r"cost=[\d.]+\.\.(?P<total>[\d.]+)")
+
+def seed(conn):
+    """Insert synthetic tenants, catalog, customers and sales history"""
+    import models
+    now = datetime.now(timezone.utc)
+    rng = random.Random(29)
+    for t in range(SEED_TENANTS):
+        tenant_id = conn.execute(insert(models.Tenant).values(
+            business_name=f"Seed Store {t}", store_code=models.generate_store_code(),
+            contact_phone="0000000000", address="-", city="-", state="-"
+        ).returning(models.Tenant.id)).scalar()
+        user_id = conn.execute(insert(models.User).values(
+            first_name="Seed", last_name="Owner", email=f"seed{tenant_id}@example.com",
+            hashed_password="!", tenant_id=tenant_id
+        ).returning(models.User.id)).scalar()
+        category_id = conn.execute(insert(models.Category).values(
+            name="General", tenant_id=tenant_id
+        ).returning(models.Category.id)).scalar()
+
+        conn.execute(insert(models.Product), [{
+            "name": f"Product {i}", "barcode": f"{tenant_id:04d}{i:08d}", "category_id": category_id,
+            "cost_price": 1.0, "selling_price": 2.0, "stock_quantity": 100, "tenant_id": tenant_id
+        } for i in range(SEED_PRODUCTS)])
+        product_ids = conn.execute(select(models.Product.id).where(
+            models.Product.tenant_id == tenant_id)).scalars().all()
+        conn.execute(insert(models.Customer), [{
+            "name": f"Customer {i}", "phone": f"9{tenant_id:04d}{i:05d}",
+            "phone_normalized": f"9{tenant_id:04d}{i:05d}", "tenant_id": tenant_id
+        } for i in range(SEED_CUSTOMERS)])
+
+        created = [now - timedelta(minutes=rng.randrange(90 * 24 * 60)) for _ in range(SEED_TRANSACTIONS)]
+        txn_ids = conn.execute(insert(models.Transaction).returning(
+            models.Transaction.id, models.Transaction.created_at, sort_by_parameter_order=True
+        ), [{
+            "tenant_id": tenant_id, "user_id": user_id, "subtotal": 6.0, "total_amount": 6.0,
+            "payment_method": "cash", "created_at": created_at
+        } for created_at in created]).all()
+        conn.execute(insert(models.TransactionItem), [{
+            "transaction_id": txn_id, "product_id": rng.choice(product_ids), "product_name": "Product",
+            "quantity": 1, "unit_price": 2.0, "total_price": 2.0, "created_at": created_at
+        } for txn_id, created_at in txn_ids for _ in range(SEED_ITEMS_PER_TRANSACTION)])
+    print(f"✓ Seeded {SEED_TENANTS} tenants")
+
+def hot_queries(conn):
+    """The tenant-scoped queries issued by the API, keyed by a readable name"""
+    import models
+    tenant_id = conn.execute(select(func.max(models.Tenant.id))).scalar() or 1
+    product = conn.execute(select(models.Product.id, models.Product.barcode).where(
+        models.Product.tenant_id == tenant_id).limit(1)).first()
+    product_id, barcode = product if product else (1, "0")
+    txn_id = conn.execute(select(func.max(models.Transaction.id)).where(
+        models.Transaction.tenant_id == tenant_id)).scalar() or 1
+    now = datetime.now(timezone.utc)
+    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    T = models.Transaction
+
+    return {
+        "user by email": select(models.User).where(models.User.email == f"seed{tenant_id}@example.com"),
+        "products by tenant": select(models.Product).where(models.Product.tenant_id == tenant_id),
+        "product by barcode": select(models.Product).where(
+            models.Product.tenant_id == tenant_id, models.Product.barcode == barcode),
+        "product by id": select(models.Product).where(
+            models.Product.id == product_id, models.Product.tenant_id == tenant_id),
+        "also bought": select(models.ProductAssociation).where(
+            models.ProductAssociation.tenant_id == tenant_id,
+            models.ProductAssociation.product_id == product_id
+        ).order_by(models.ProductAssociation.rank).limit(5),
+        "categories by tenant": select(models.Category).where(models.Category.tenant_id == tenant_id),
+        "catalog version": select(func.max(models.CatalogChange.id)).where(
+            models.CatalogChange.tenant_id == tenant_id),
+        "category version": select(func.max(models.CatalogChange.id)).where(
+            models.CatalogChange.tenant_id == tenant_id, models.CatalogChange.entity == "category"),
+        "customer by phone": select(models.Customer).where(
+            models.Customer.tenant_id == tenant_id, models.Customer.phone_normalized == "90001000001"),
+        "customers by tenant": select(models.Customer).where(
+            models.Customer.tenant_id == tenant_id).order_by(models.Customer.name).limit(100),
+        "transaction history": select(T.id, T.created_at).where(T.tenant_id == tenant_id).order_by(
+            T.created_at.desc(), T.id.desc()).limit(100),
+        "customer history": select(T.id, T.created_at).where(
+            T.tenant_id == tenant_id, T.customer_id == 1).order_by(T.created_at.desc(), T.id.desc()).limit(100),
+        "transaction items": select(models.TransactionItem).where(
+            models.TransactionItem.transaction_id == txn_id),
+        "today's sales": select(func.sum(T.total_amount), func.count(T.id)).where(
+            T.tenant_id == tenant_id, T.created_at >= today_start),
+        "daily sales (30 days)": select(
+            func.date(T.created_at), func.sum(T.total_amount), func.count(T.id)
+        ).where(T.tenant_id == tenant_id, T.created_at >= now - timedelta(days=30)).group_by(
+            func.date(T.created_at)),
+        "product sales rollup (30 days)": select(
+            models.ProductDailySales.product_id, func.sum(models.ProductDailySales.revenue)
+        ).where(
+            models.ProductDailySales.tenant_id == tenant_id,
+            models.ProductDailySales.day >= (now - timedelta(days=30)).date()
+        ).group_by(models.ProductDailySales.product_id),
+    }
+
+def explain(conn, statement):
+    """Return the plan lines and the relations read by a sequential scan"""
+    sql = str(statement.compile(conn, compile_kwargs={"literal_binds": True}))
+    if conn.dialect.name == "postgresql":
+        lines = [row[0] for row in conn.execute(text(f"EXPLAIN {sql}"))]
+        seq_scans = [
+            line for line in lines
+            if "Seq Scan on" in line and float(PLAN_COST.search(line).group("total")) >= MIN_SEQ_SCAN_COST
+        ]
+    else:
+        lines = [row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+        seq_scans = [line for line in lines if line.startswith("SCAN") and "USING" not in line]
+    return lines, seq_scans
+
+def check_plans(verbose=False):
+    """EXPLAIN every hot query; returns the names of the queries that regressed"""
+    import database
+    failures = []
+    with database.engine.connect() as conn:
+        for name, statement in hot_queries(conn).items():
+            lines, seq_scans = explain(conn, statement)
+            print(f"{'✗' if seq_scans else '✓'} {name}")
+            if verbose or seq_scans:
+                for line in lines:
+                    print(f"    {line}")
+            if seq_scans:
+                failures.append(name)
+    return failures
+
+@contextmanager
+def scratch_database(url: str):
+    """URL of an empty database beside `url` (same server, or a temporary SQLite file), dropped afterwards"""
+    url = make_url(url)
+    if url.get_backend_name() != "postgresql":
+        directory = tempfile.mkdtemp()
+        try:
+            yield f"sqlite:///{directory}/plans.db"
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        return
+
+    name = f"plan_check_{secrets.token_hex(4)}"
+    server = create_engine(url.set(database="postgres"), isolation_level="AUTOCOMMIT")
+    try:
+        with server.connect() as conn:
+            conn.execute(text(f'CREATE DATABASE "{name}"'))
+        try:
+            yield url.set(database=name).render_as_string(hide_password=False)
+        finally:
+            with server.connect() as conn:
+                conn.execute(text(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)'))
+    finally:
+        server.dispose()
+
+def run(seed_first: bool, verbose: bool):
+    """Migrate and seed (scratch databases only), then check; returns the regressed query names"""
+    import database
+    import models
+    from migrate_database import migrate_database
+
+    try:
+        if seed_first:
+            models.Base.metadata.create_all(bind=database.engine)
+            migrate_database()
+            with database.engine.begin() as conn:
+                seed(conn)
+                conn.execute(text("ANALYZE"))
+        return check_plans(verbose)
+    finally:
+        for engine in {database.engine, database.read_engine, database.sqlite_read_engine} - {None}:
+            engine.dispose()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fail if a hot query plan uses a sequential scan")
+    parser.add_argument("--existing", action="store_true",
+                        help="Check the configured database as it is instead of a seeded scratch one")
+    parser.add_argument("--verbose", action="store_true", help="Print every plan")
+    args = parser.parse_args()
+
+    if args.existing:
+        failures = run(seed_first=False, verbose=args.verbose)
+    else:
+        from config import settings
+        with scratch_database(settings.DATABASE_URL) as url:
+            # Imported modules build their engines from this
+            settings.DATABASE_URL = os.environ["DATABASE_URL"] = url
+            failures = run(seed_first=True, verbose=args.verbose)
+
+    if failures:
+        print(f"\n❌ Sequential scans in: {', '.join(failures)}")
+        sys.exit(1)
+    print("\n✅ All hot queries use indexes")
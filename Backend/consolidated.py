@@ -0,0 +1,71 @@
+"""
+Consolidated reporting for owners running several stores.
+
+Stores (tenants) are linked into a store group; owners of member stores can
+see figures for the whole group. Each store's figures come from the same
+per-store query functions as the single-store endpoints, run concurrently on
+a shared thread pool with one pooled read session per store, then merged.
+Latency therefore follows the slowest store rather than the sum of all of
+them. The pool is shared by every request in the worker, so consolidated
+reports never hold more than CONSOLIDATED_MAX_PARALLEL connections. The
+calling request uses the session that authenticated it and hands that
+connection back first (release_connections); otherwise concurrent reports
+could hold the whole pool while waiting for it.
+
+Stores join a group with a single-use join code and count as members once
+the group owner (the user who created it) approves them.
+"""
+import secrets
+from sqlalchemy.orm import object_session
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import database
+from config import settings
+
+_executor = ThreadPoolExecutor(
+    max_workers=max(1, min(settings.CONSOLIDATED_MAX_PARALLEL, database.POOL_SIZE + database.MAX_OVERFLOW)),
+    thread_name_prefix="consolidated"
+)
+
+def new_join_code() -> str:
+    """Single-use code the group owner shares to let another store ask to join"""
+    return secrets.token_urlsafe(12)
+
+def release_connections(db, current_user):
+    """
+    Close the request's sessions (its own and the one that loaded the user)
+    so their connections return to the pool before fan_out draws from it.
+    Loaded attributes of current_user stay readable.
+    """
+    auth_db = object_session(current_user)
+    for session in (db, auth_db):
+        if session is not None:
+            session.close()
+
+def fan_out(tenant_ids, compute):
+    """Run compute(db, tenant_id) for every store concurrently; results in tenant_ids order"""
+    def run(tenant_id):
+        db = database.ReadSessionLocal()
+        try:
+            return compute(db, tenant_id)
+        finally:
+            db.close()
+    return list(_executor.map(run, tenant_ids))
+
+def merge_totals(results):
+    """Field-wise sum of per-store dicts with the same numeric keys"""
+    totals = defaultdict(int)
+    for result in results:
+        for key, value in result.items():
+            totals[key] += value
+    return dict(totals)
+
+def merge_daily(results):
+    """Per-store lists of {date, total_sales, transaction_count} summed by date"""
+    days = defaultdict(lambda: {"total_sales": 0.0, "transaction_count": 0})
+    for rows in results:
+        for row in rows:
+            day = days[row["date"]]
+            day["total_sales"] += row["total_sales"]
+            day["transaction_count"] += row["transaction_count"]
+    return [{"date": day, **values} for day, values in sorted(days.items())]
@@ -0,0 +1,116 @@
+"""
+Exact customer lookup for the till (phone number or loyalty card code).
+
+Customers carry a normalised copy of their phone number and their loyalty
+card code, each unique per tenant, so a lookup is a single probe of a
+(tenant_id, key) index. Recently used keys are kept in a small per-tenant LRU
+of customer ids; a hit becomes a primary-key read that is re-checked against
+the key, so an entry made stale by another worker is simply dropped.
+"""
+import re
+import threading
+from collections import OrderedDict
+import models
+
+# Keys cached per tenant, and tenants kept in memory
+CACHE_SIZE_PER_TENANT = 256
+CACHE_MAX_TENANTS = 1000
+
+_NON_DIGITS = re.compile(r"\D")
+_CARD_SEPARATORS = re.compile(r"[\s-]")
+
+def normalize_phone(phone):
+    """Digits only, so '+1 (555) 010-0' and '155501000' match. None if no digits."""
+    if not phone:
+        return None
+    digits = _NON_DIGITS.sub("", phone)
+    return digits or None
+
+def normalize_card(code):
+    """Upper case without spaces or dashes. None if empty."""
+    if not code:
+        return None
+    return _CARD_SEPARATORS.sub("", code).upper() or None
+
+class TenantLRU:
+    """tenant_id -> OrderedDict(key -> customer id), both levels least-recently-used"""
+
+    def __init__(self, per_tenant: int = CACHE_SIZE_PER_TENANT, max_tenants: int = CACHE_MAX_TENANTS):
+        self.per_tenant = per_tenant
+        self.max_tenants = max_tenants
+        self._tenants = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, tenant_id: int, key):
+        with self._lock:
+            entries = self._tenants.get(tenant_id)
+            if entries is None or key not in entries:
+                return None
+            self._tenants.move_to_end(tenant_id)
+            entries.move_to_end(key)
+            return entries[key]
+
+    def put(self, tenant_id: int, key, customer_id: int):
+        with self._lock:
+            entries = self._tenants.get(tenant_id)
+            if entries is None:
+                entries = self._tenants[tenant_id] = OrderedDict()
+                if len(self._tenants) > self.max_tenants:
+                    self._tenants.popitem(last=False)
+            self._tenants.move_to_end(tenant_id)
+            entries[key] = customer_id
+            entries.move_to_end(key)
+            if len(entries) > self.per_tenant:
+                entries.popitem(last=False)
+
+    def discard(self, tenant_id: int, key):
+        with self._lock:
+            entries = self._tenants.get(tenant_id)
+            if entries is not None:
+                entries.pop(key, None)
+
+cache = TenantLRU()
+
+def _column(kind: str):
+    return models.Customer.phone_normalized if kind == "phone" else models.Customer.loyalty_card
+
+def find_customer(db, tenant_id: int, kind: str, key: str):
+    """kind is 'phone' or 'card'; key must already be normalised"""
+    column = _column(kind)
+    cache_key = (kind, key)
+    customer_id = cache.get(tenant_id, cache_key)
+    if customer_id is not None:
+        customer = db.get(models.Customer, customer_id)
+        if customer is not None and customer.tenant_id == tenant_id and getattr(customer, column.key) == key:
+            return customer
+        cache.discard(tenant_id, cache_key)
+
+    customer = db.query(models.Customer).filter(
+        models.Customer.tenant_id == tenant_id,
+        column == key
+    ).first()
+    if customer is not None:
+        cache.put(tenant_id, cache_key, customer.id)
+    return customer
+
+def forget(customer):
+    """Drop a customer's keys from this process's cache (after update or delete)"""
+    if customer.phone_normalized:
+        cache.discard(customer.tenant_id, ("phone", customer.phone_normalized))
+    if customer.loyalty_card:
+        cache.discard(customer.tenant_id, ("card", customer.loyalty_card))
+
+def find_conflict(db, tenant_id: int, phone_normalized, loyalty_card, exclude_id: int = None):
+    """Detail message if another customer of the tenant already has this phone or card"""
+    for kind, key, label in (("phone", phone_normalized, "phone number"), ("card", loyalty_card, "loyalty card")):
+        if not key:
+            continue
+        query = db.query(models.Customer.id).filter(
+            models.Customer.tenant_id == tenant_id,
+            _column(kind) == key
+        )
+        if exclude_id is not None:
+            query = query.filter(models.Customer.id != exclude_id)
+        if query.first():
+            return f"A customer with this {label} already exists"
+    return None
@@ -1,4 +1,7 @@
-from sqlalchemy import create_engine
+import threading
+from datetime import datetime, timezone
+from fastapi import Request
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from config import settings
@@ -6,21 +9,141 @@ from config import settings
 # Use database URL from environment variables
 SQLALCHEMY_DATABASE_URL = settings.DATABASE_URL
 
+def pool_limits(max_connections: int, workers: int):
+    """
+    Split the database connection budget between worker processes.
+    Returns (pool_size, max_overflow) for a single worker so that
+    workers * (pool_size + max_overflow) never exceeds max_connections.
+    """
+    per_worker = max(1, max_connections // max(1, workers))
+    pool_size = max(1, per_worker // 3)
+    max_overflow = max(0, per_worker - pool_size)
+    return pool_size, max_overflow
+
+POOL_SIZE, MAX_OVERFLOW = pool_limits(settings.DB_MAX_CONNECTIONS, settings.WORKERS)
+
+# ==========================================
+# SQLITE PROFILE (single-store installs)
+# ==========================================
+# WAL lets readers run alongside the single writer. Write sessions start with
+# BEGIN IMMEDIATE, so a transaction that reads and then writes can never fail
+# half-way with "database is locked", and they queue on an in-process lock
+# rather than polling the file lock. Read-only sessions (read engine, GET
+# requests) take no lock.
+
+IS_SQLITE = SQLALCHEMY_DATABASE_URL.startswith("sqlite")
+# A separate reader engine needs a database file both engines can open
+SQLITE_FILE = IS_SQLITE and SQLALCHEMY_DATABASE_URL not in ("sqlite://", "sqlite:///:memory:")
+
+_writer_lock = threading.Lock()
+
+def _sqlite_pragmas(dbapi_connection):
+    cursor = dbapi_connection.cursor()
+    for pragma in (
+        "PRAGMA journal_mode=WAL",
+        f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}",
+        f"PRAGMA cache_size=-{settings.SQLITE_CACHE_SIZE_KB}",
+        f"PRAGMA mmap_size={settings.SQLITE_MMAP_SIZE}",
+        f"PRAGMA busy_timeout={settings.SQLITE_BUSY_TIMEOUT_MS}",
+        "PRAGMA temp_store=MEMORY",
+    ):
+        cursor.execute(pragma)
+    cursor.close()
+
+def _writer_connect(dbapi_connection, connection_record):
+    _sqlite_pragmas(dbapi_connection)
+    # Let SQLAlchemy emit BEGIN itself (see _begin_immediate)
+    dbapi_connection.isolation_level = None
+
+def _reader_connect(dbapi_connection, connection_record):
+    _sqlite_pragmas(dbapi_connection)
+
+def _begin_immediate(conn):
+    if not _writer_lock.acquire(timeout=settings.SQLITE_BUSY_TIMEOUT_MS / 1000):
+        raise TimeoutError("Timed out waiting for the database writer")
+    conn.info["writer_lock"] = True
+    try:
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+    except Exception:
+        _end_write(conn)
+        raise
+
+def _end_write(conn):
+    if conn.info.pop("writer_lock", False):
+        _writer_lock.release()
+
+def create_sqlite_engine(url: str, writer: bool):
+    engine = create_engine(
+        url,
+        pool_pre_ping=True,
+        connect_args={"check_same_thread": False, "timeout": settings.SQLITE_BUSY_TIMEOUT_MS / 1000}
+    )
+    if settings.SQLITE_TUNED:
+        event.listen(engine, "connect", _writer_connect if writer else _reader_connect)
+        if writer:
+            event.listen(engine, "begin", _begin_immediate)
+            event.listen(engine, "commit", _end_write)
+            event.listen(engine, "rollback", _end_write)
+    return engine
+
 # Create engine with connection pooling for production
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    pool_pre_ping=True,  # Verify connections before using
-    pool_size=10,  # Number of connections to maintain
-    max_overflow=20  # Maximum number of connections beyond pool_size
-)
+if IS_SQLITE:
+    engine = create_sqlite_engine(SQLALCHEMY_DATABASE_URL, writer=True)
+else:
+    engine = create_engine(
+        SQLALCHEMY_DATABASE_URL,
+        pool_pre_ping=True,  # Verify connections before using
+        pool_size=POOL_SIZE,  # Number of connections to maintain
+        max_overflow=MAX_OVERFLOW  # Maximum number of connections beyond pool_size
+    )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Reader connections on the primary SQLite file (WAL readers never take the writer lock)
+sqlite_read_engine = create_sqlite_engine(SQLALCHEMY_DATABASE_URL, writer=False) if SQLITE_FILE else None
+
+# Read-only engine: uses the replica when configured, otherwise the primary
+if settings.READ_REPLICA_URL:
+    read_engine = create_engine(
+        settings.READ_REPLICA_URL,
+        pool_pre_ping=True,
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW
+    )
+elif SQLITE_FILE:
+    read_engine = sqlite_read_engine
+else:
+    read_engine = engine
+
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+# Reads that must see the primary's latest commits (pollers, health check), never via the writer lock
+PrimaryReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=sqlite_read_engine or engine)
+
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
+def utcnow():
+    """Naive UTC timestamp, matching how DateTime columns are stored"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def get_db(request: Request = None):
+    # On SQLite, GET requests use a reader so they never queue behind checkouts
+    if SQLITE_FILE and request is not None and request.method in ("GET", "HEAD"):
+        db = ReadSessionLocal()
+    else:
+        db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def get_read_db():
+    """
+    Session for read-only endpoints (analytics, reports, lists).
+    Reads may lag the primary slightly when a replica is configured.
+    """
+    db = ReadSessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
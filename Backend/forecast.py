@@ -0,0 +1,176 @@
+"""
+Demand forecasting and reorder suggestions (batch job).
+
+Builds a products x days sales matrix from the product_daily_sales rollup
+(one row per product and day sold, so transaction_items is never scanned)
+for the last FORECAST_HISTORY_DAYS closed days, then fits every SKU at once
+with NumPy: a weekday profile (so weekend-heavy items are not under-ordered
+on Fridays) and simple exponential smoothing of the deseasonalised series.
+
+For each product with recent demand it stores the expected daily demand,
+the reorder point (demand over the supplier lead time plus safety stock
+for the configured service level) and the order-up-to level covering the
+review period. The suggested order quantity is derived from live stock when
+suggestions are read.
+
+Usage:
+    python forecast.py              # all stores
+    python forecast.py --tenant 12  # one store
+"""
+import argparse
+import time
+from datetime import timedelta
+import numpy as np
+from sqlalchemy import delete, insert, select
+import database
+import models
+from config import settings
+from database import utcnow
+
+# Products per batch (whole stores): bounds the matrix to ~BLOCK x days floats
+BLOCK_PRODUCTS = 50_000
+# Days of history per weekday before the product's own profile gets half weight
+WEEKDAY_SHRINKAGE = 4
+
+def load_products(conn, tenant_id=None):
+    """Product ids and tenant ids as arrays, ordered by tenant"""
+    P = models.Product
+    query = select(P.id, P.tenant_id).order_by(P.tenant_id, P.id)
+    if tenant_id is not None:
+        query = query.where(P.tenant_id == tenant_id)
+    rows = conn.execute(query).all()
+    columns = list(zip(*rows)) if rows else [(), ()]
+    return np.array(columns[0], dtype=np.int64), np.array(columns[1], dtype=np.int64)
+
+def tenant_blocks(tenant_ids):
+    """Split tenant-ordered products into slices of whole tenants, about BLOCK_PRODUCTS each"""
+    boundaries = np.flatnonzero(np.r_[True, tenant_ids[1:] != tenant_ids[:-1]])
+    start = 0
+    for boundary in boundaries[1:]:
+        if boundary - start >= BLOCK_PRODUCTS:
+            yield slice(start, boundary)
+            start = boundary
+    if len(tenant_ids):
+        yield slice(start, len(tenant_ids))
+
+def sales_matrix(conn, product_ids, tenants, first_day, days):
+    """Units sold per product (rows aligned with product_ids) and day"""
+    order = np.argsort(product_ids)
+    sorted_ids = product_ids[order]
+    sales = np.zeros((len(product_ids), days))
+    R = models.ProductDailySales
+    rows = conn.execute(select(R.product_id, R.day, R.quantity).where(
+        R.tenant_id.in_(tenants.tolist()),
+        R.day >= first_day,
+        R.day < first_day + timedelta(days=days)
+    )).all()
+    if not rows:
+        return sales
+    ids, sold_on, quantities = zip(*rows)
+    ids = np.array(ids, dtype=np.int64)
+    index = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+    # Rollups outlive deleted products
+    known = sorted_ids[index] == ids
+    day_index = np.array([(day - first_day).days for day in sold_on])
+    np.add.at(sales, (order[index[known]], day_index[known]), np.array(quantities, dtype=float)[known])
+    return sales
+
+def fit(sales, weekdays, alpha):
+    """
+    Fit every row of `sales` at once. History starts at each product's first
+    sale in the window, so new products are not dragged down by the days
+    before they were stocked. Returns (level, weekday factors (n x 7),
+    one-step forecast error std, has_history).
+    """
+    n, days = sales.shape
+    sold = sales > 0
+    has_history = sold.any(axis=1)
+    first = np.where(has_history, sold.argmax(axis=1), days)
+    observed = np.arange(days)[None, :] >= first[:, None]
+    n_observed = observed.sum(axis=1)
+    overall = (sales * observed).sum(axis=1) / np.maximum(n_observed, 1)
+
+    # Weekday profile relative to the product's mean, shrunk towards 1 for short histories
+    factors = np.ones((n, 7))
+    for weekday in range(7):
+        columns = weekdays == weekday
+        count = observed[:, columns].sum(axis=1)
+        total = (sales[:, columns] * observed[:, columns]).sum(axis=1)
+        raw = np.divide(total, count * overall, out=np.ones(n), where=(count > 0) & (overall > 0))
+        weight = count / (count + WEEKDAY_SHRINKAGE)
+        factors[:, weekday] = weight * raw + (1 - weight)
+
+    level = overall.copy()
+    squared_error = np.zeros(n)
+    for day in range(days):
+        active = observed[:, day]
+        factor = factors[:, weekdays[day]]
+        squared_error += np.where(active, (sales[:, day] - level * factor) ** 2, 0)
+        level = np.where(active, alpha * sales[:, day] / factor + (1 - alpha) * level, level)
+    sigma = np.sqrt(squared_error / np.maximum(n_observed, 1))
+    return level, factors, sigma, has_history
+
+def suggest(level, factors, sigma, first_weekday):
+    """Daily demand, reorder point and order-up-to level from the fitted model"""
+    lead, review = settings.FORECAST_LEAD_TIME_DAYS, settings.FORECAST_REVIEW_DAYS
+    horizon = (first_weekday + np.arange(lead + review)) % 7
+    demand = level[:, None] * factors[:, horizon]
+    lead_demand = demand[:, :lead].sum(axis=1)
+    safety_stock = settings.FORECAST_SERVICE_LEVEL_Z * sigma * np.sqrt(lead)
+    reorder_point = np.ceil(lead_demand + safety_stock)
+    order_up_to = reorder_point + np.ceil(demand[:, lead:].sum(axis=1))
+    return demand.mean(axis=1), reorder_point, order_up_to
+
+def refresh_forecasts(tenant_id: int = None, engine=None):
+    """Recompute suggestions for every store (or one) and replace the stored rows; returns stats"""
+    engine = engine or database.engine
+    started = time.perf_counter()
+    days = settings.FORECAST_HISTORY_DAYS
+    today = utcnow().date()
+    first_day = today - timedelta(days=days)
+    weekdays = (first_day.weekday() + np.arange(days)) % 7
+    F = models.ProductForecast
+    now = utcnow()
+
+    with engine.connect() as conn:
+        product_ids, tenant_ids = load_products(conn, tenant_id)
+    stored = 0
+    for block in tenant_blocks(tenant_ids):
+        ids, tenants = product_ids[block], np.unique(tenant_ids[block])
+        # One transaction per block: readers see either the old or the new suggestions
+        with engine.begin() as conn:
+            sales = sales_matrix(conn, ids, tenants, first_day, days)
+            level, factors, sigma, has_history = fit(sales, weekdays, settings.FORECAST_SMOOTHING)
+            daily_demand, reorder_point, order_up_to = suggest(level, factors, sigma, today.weekday())
+            keep = has_history & (daily_demand >= 0.01)
+
+            conn.execute(delete(F).where(F.tenant_id.in_(tenants.tolist())))
+            rows = [{
+                "product_id": int(product_id),
+                "tenant_id": int(tenant),
+                "daily_demand": round(float(demand), 3),
+                "demand_std": round(float(std), 3),
+                "reorder_point": int(point),
+                "order_up_to": int(up_to),
+                "updated_at": now
+            } for product_id, tenant, demand, std, point, up_to in zip(
+                ids[keep], tenant_ids[block][keep], daily_demand[keep], sigma[keep],
+                reorder_point[keep], order_up_to[keep]
+            )]
+            if rows:
+                conn.execute(insert(F), rows)
+            stored += len(rows)
+
+    return {
+        "products": len(product_ids),
+        "forecasted": stored,
+        "seconds": round(time.perf_counter() - started, 2)
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recompute demand forecasts and reorder suggestions")
+    parser.add_argument("--tenant", type=int, default=None, help="Only this tenant id")
+    args = parser.parse_args()
+
+    stats = refresh_forecasts(args.tenant)
+    print(f"✅ Forecasted {stats['forecasted']} of {stats['products']} products in {stats['seconds']}s")
@@ -1,11 +1,18 @@
 from fastapi import FastAPI, Depends, HTTPException, status, Request
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_, text
+from sqlalchemy import func, and_, text, extract
+from sqlalchemy.exc import IntegrityError
 from fastapi.middleware.cors import CORSMiddleware
 from datetime import timedelta, datetime, timezone, date
 from typing import List, Optional
+import asyncio
+import base64
+import gzip
+import hashlib
+import json
 import logging
 
 # Configure logging
@@ -21,6 +28,19 @@ import schemas
 import utils
 import database
 import auth
+import receipts
+import tasks
+import changefeed
+import customer_lookup
+import reservations
+import partitions
+import stock
+import ratelimit
+import cache
+import consolidated
+import sales_archive
+import statements
+import profiler
 from config import settings
 
 # 1. Initialize Database Tables
@@ -35,8 +55,7 @@ try:
 except ImportError:
     print("Migration script not found, skipping...")
 except Exception as e:
-    print(f"Migration completed or already done: {str(e)[:100]}")
-    # Continue - migration might already be done
+    print(f"⚠ Migration failed, starting anyway (run python migrate_database.py): {str(e)[:100]}")
 
 app = FastAPI(
     title="GroceryPOS Pro API",
@@ -47,8 +66,21 @@ app = FastAPI(
 )
 
 # Add logging middleware
-from middleware import LoggingMiddleware
+from middleware import LoggingMiddleware, ProfilerMiddleware
 app.add_middleware(LoggingMiddleware)
+app.add_middleware(ProfilerMiddleware)
+
+# Background task worker (outbox side effects such as customer stats and receipts)
+@app.on_event("startup")
+def start_task_worker():
+    if settings.TASK_WORKER_ENABLED:
+        tasks.start_worker()
+    changefeed.broker.start()
+
+@app.on_event("shutdown")
+def stop_task_worker():
+    tasks.stop_worker()
+    changefeed.broker.stop()
 
 # Custom exception handler for validation errors
 @app.exception_handler(RequestValidationError)
@@ -70,6 +102,17 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
         }
     )
 
+# Stock conflicts (insufficient stock, stale version) are reported per line
+@app.exception_handler(stock.StockConflict)
+async def stock_conflict_handler(request: Request, exc: stock.StockConflict):
+    return JSONResponse(
+        status_code=409,
+        content={
+            "detail": str(exc),
+            "conflicts": exc.conflicts
+        }
+    )
+
 # 2. CORS Configuration (Allow Frontend to talk to Backend)
 app.add_middleware(
     CORSMiddleware,
@@ -77,6 +120,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Profile", "X-Profile-Id"],
 )
 
 @app.get("/")
@@ -91,8 +135,8 @@ def read_root():
 def health_check():
     """Health check endpoint for monitoring and load balancers"""
     try:
-        # Test database connection
-        db = next(database.get_db())
+        # Test database connection (a reader, so it never waits on the SQLite writer lock)
+        db = database.PrimaryReadSessionLocal()
         db.execute(text("SELECT 1"))
         db.close()
         return {
@@ -113,6 +157,24 @@ def health_check():
             }
         )
 
+@app.get("/api/v1/metrics/rate-limits", dependencies=[Depends(auth.require_operator)])
+def get_rate_limit_stats():
+    """Allowed and throttled login/signup attempts seen by this worker process (operators only)"""
+    return ratelimit.stats()
+
+@app.get("/api/v1/admin/profiles", dependencies=[Depends(auth.require_operator)])
+def list_request_profiles():
+    """Recent request profiles saved by this worker process, newest first (operators only)"""
+    return profiler.list_profiles()
+
+@app.get("/api/v1/admin/profiles/{name}", dependencies=[Depends(auth.require_operator)])
+def download_request_profile(name: str):
+    """One profile as collapsed stacks (open in speedscope.app or flamegraph.pl)"""
+    path = profiler.profile_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="text/plain", filename=name)
+
 @app.get("/api/v1/info")
 def get_api_info():
     """Get API information"""
@@ -128,11 +190,12 @@ def get_api_info():
 # ==========================================
 
 @app.post("/api/v1/auth/signup", response_model=schemas.AuthResponse)
-def signup(payload: schemas.SignupRequest, db: Session = Depends(database.get_db)):
+def signup(payload: schemas.SignupRequest, request: Request, db: Session = Depends(database.get_db)):
     """
     Registers a new Tenant (Store) and a new User (Owner).
     Returns an access token for immediate login.
     """
+    ratelimit.limit_auth(request, "signup", payload.email)
     
     # 1. Check if Email is already registered
     if db.query(models.User).filter(models.User.email == payload.email).first():
@@ -197,11 +260,13 @@ def signup(payload: schemas.SignupRequest, db: Session = Depends(database.get_db
     }
 
 @app.post("/api/v1/auth/login", response_model=schemas.LoginResponse)
-def login(payload: schemas.LoginRequest, db: Session = Depends(database.get_db)):
+def login(payload: schemas.LoginRequest, request: Request, db: Session = Depends(database.get_db)):
     """
     Advanced Login: Checks user existence, account lock status, 
     password validity, and subscription status.
+    Rate limited per IP and per email before any password hashing.
     """
+    ratelimit.limit_auth(request, "login", payload.email)
     
     # 1. Fetch User
     user = db.query(models.User).filter(models.User.email == payload.email).first()
@@ -271,16 +336,41 @@ def login(payload: schemas.LoginRequest, db: Session = Depends(database.get_db))
 # INVENTORY ENDPOINTS
 # ==========================================
 
+def conditional_get(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """
+    Set a strong ETag on the response; return a 304 response when the
+    client's If-None-Match already holds it (browsers revalidate on their own).
+    """
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
+    # If-None-Match uses weak comparison (proxies may mark the tag W/)
+    client_tags = {
+        tag.strip().removeprefix("W/") for tag in request.headers.get("if-none-match", "").split(",")
+    }
+    if etag in client_tags or "*" in client_tags:
+        return Response(status_code=304, headers=dict(response.headers))
+    return None
+
 @app.get("/api/v1/products", response_model=List[schemas.ProductResponse])
 def get_products(
+    request: Request,
+    response: Response,
     barcode: Optional[str] = None,
-    db: Session = Depends(database.get_db),
+    db: Session = Depends(database.get_read_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """
     Get all products belonging to the logged-in user's store (Tenant).
-    Optionally filter by barcode.
+    Optionally filter by barcode. Answers If-None-Match with 304 while no
+    product, stock or category change was recorded.
     """
+    # Every product, stock and category write records a catalog change; read the
+    # version before the rows so a concurrent write can only make the tag older
+    version = changefeed.latest_change_id(db, current_user.tenant_id)
+    not_modified = conditional_get(request, response, f'"products-{current_user.tenant_id}-{version or 0}"')
+    if not_modified:
+        return not_modified
+    
     query = db.query(models.Product).filter(models.Product.tenant_id == current_user.tenant_id)
     
     # Filter by barcode if provided
@@ -302,6 +392,7 @@ def get_products(
             "stock_quantity": product.stock_quantity,
             "min_stock_level": product.min_stock_level,
             "tenant_id": product.tenant_id,
+            "version": product.version,
             "category_name": product.category.name if product.category else None
         }
         result.append(product_dict)
@@ -338,8 +429,11 @@ def create_product(
     )
     
     db.add(new_product)
+    db.flush()
+    changefeed.record_product_change(db, new_product)
     db.commit()
     db.refresh(new_product)
+    changefeed.broker.wake()
     
     # Add category name to response
     response_data = {
@@ -357,12 +451,10 @@ def update_product(
 ):
     """
     Update an existing product. Only updates provided fields.
+    Send the product's version to reject the update (409) if it changed meanwhile.
     """
     # Find product and verify it belongs to the user's tenant
-    product = db.query(models.Product).filter(
-        models.Product.id == product_id,
-        models.Product.tenant_id == current_user.tenant_id
-    ).first()
+    product = statements.product_by_id(db, current_user.tenant_id, product_id)
     
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
@@ -377,13 +469,20 @@ def update_product(
         if not category:
             raise HTTPException(status_code=404, detail="Category not found")
     
-    # Update only provided fields
+    # Update only provided fields; stock and the version check go through the atomic primitive
     update_data = product_update.dict(exclude_unset=True)
+    stock.apply_stock_changes(db, current_user.tenant_id, [stock.StockChange(
+        product.id,
+        set_to=update_data.pop("stock_quantity", None),
+        expected_version=update_data.pop("version", None)
+    )])
     for field, value in update_data.items():
         setattr(product, field, value)
     
+    changefeed.record_product_change(db, product)
     db.commit()
     db.refresh(product)
+    changefeed.broker.wake()
     
     # Add category name to response
     response_data = {
@@ -402,16 +501,15 @@ def delete_product(
     Delete a product from the inventory.
     """
     # Find product and verify it belongs to the user's tenant
-    product = db.query(models.Product).filter(
-        models.Product.id == product_id,
-        models.Product.tenant_id == current_user.tenant_id
-    ).first()
+    product = statements.product_by_id(db, current_user.tenant_id, product_id)
     
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
+    changefeed.record_product_change(db, product, "delete")
     db.delete(product)
     db.commit()
+    changefeed.broker.wake()
     return {"message": "Product deleted successfully"}
 
 @app.get("/api/v1/products/by-barcode/{barcode}", response_model=schemas.ProductResponse)
@@ -421,10 +519,7 @@ def get_product_by_barcode(
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """Get a product by barcode - useful for barcode scanner."""
-    product = db.query(models.Product).filter(
-        models.Product.barcode == barcode,
-        models.Product.tenant_id == current_user.tenant_id
-    ).first()
+    product = statements.product_by_barcode(db, current_user.tenant_id, barcode)
     
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
@@ -439,20 +534,134 @@ def get_product_by_barcode(
         "stock_quantity": product.stock_quantity,
         "min_stock_level": product.min_stock_level,
         "tenant_id": product.tenant_id,
+        "version": product.version,
         "category_name": product.category.name if product.category else None
     }
     return product_dict
 
+@app.get("/api/v1/products/{product_id}/also-bought", response_model=List[schemas.ProductAssociationResponse])
+def get_also_bought(
+    product_id: int,
+    limit: int = 5,
+    db: Session = Depends(database.get_read_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """
+    Products most often bought together with this one (strongest first), as
+    of the last run of associations.py. Empty when there is not enough history.
+    """
+    limit = max(1, min(limit, settings.ASSOCIATION_TOP_K))
+    A, P = models.ProductAssociation, models.Product
+    rows = db.query(A, P.name, P.barcode, P.selling_price, P.stock_quantity).join(
+        P, P.id == A.related_product_id
+    ).filter(
+        A.tenant_id == current_user.tenant_id,
+        A.product_id == product_id
+    ).order_by(A.rank).limit(limit).all()
+    
+    return [{
+        "product_id": row.ProductAssociation.related_product_id,
+        "product_name": row.name,
+        "barcode": row.barcode,
+        "selling_price": row.selling_price,
+        "stock_quantity": row.stock_quantity,
+        "pair_count": row.ProductAssociation.pair_count,
+        "confidence": row.ProductAssociation.confidence,
+        "lift": row.ProductAssociation.lift
+    } for row in rows]
+
+@app.post("/api/v1/inventory/adjustments", response_model=List[schemas.StockLevel])
+def adjust_stock(
+    adjustment: schemas.StockAdjustmentRequest,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """
+    Receive deliveries (positive delta) or write off stock (negative delta).
+    All lines apply or none do; conflicts are reported per line (409).
+    """
+    product_ids = [line.product_id for line in adjustment.lines]
+    if len(set(product_ids)) != len(product_ids):
+        raise HTTPException(status_code=400, detail="Each product may appear only once")
+    
+    applied = stock.apply_stock_changes(db, current_user.tenant_id, [
+        stock.StockChange(line.product_id, delta=line.delta, expected_version=line.version)
+        for line in adjustment.lines
+    ])
+    for product in db.query(models.Product).filter(models.Product.id.in_(product_ids)):
+        changefeed.record_product_change(db, product, "stock")
+    db.commit()
+    changefeed.broker.wake()
+    
+    return [{
+        "product_id": product_id,
+        "stock_quantity": stock_quantity,
+        "version": version
+    } for product_id, (stock_quantity, version) in applied.items()]
+
+@app.get("/api/v1/inventory/reorder-suggestions", response_model=List[schemas.ReorderSuggestion])
+def get_reorder_suggestions(
+    due_only: bool = True,
+    limit: int = 100,
+    db: Session = Depends(database.get_read_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """
+    Products to reorder, fewest days of cover first. Levels come from the
+    nightly forecast (forecast.py); quantities use live stock. With
+    due_only=false every forecasted product is listed.
+    """
+    limit = max(1, min(limit, 1000))
+    F, P = models.ProductForecast, models.Product
+    available = P.stock_quantity - P.reserved_quantity
+    query = db.query(
+        F, P.name, P.barcode, P.stock_quantity, available.label('available'),
+        P.min_stock_level, models.Category.name.label('category_name')
+    ).join(
+        P, P.id == F.product_id
+    ).outerjoin(
+        models.Category, models.Category.id == P.category_id
+    ).filter(F.tenant_id == current_user.tenant_id)
+    if due_only:
+        query = query.filter(available <= F.reorder_point)
+    rows = query.order_by(available / F.daily_demand, P.id).limit(limit).all()
+    
+    return [{
+        "product_id": row.ProductForecast.product_id,
+        "product_name": row.name,
+        "barcode": row.barcode,
+        "category_name": row.category_name,
+        "stock_quantity": row.stock_quantity,
+        "available": row.available,
+        "min_stock_level": row.min_stock_level,
+        "daily_demand": row.ProductForecast.daily_demand,
+        "reorder_point": row.ProductForecast.reorder_point,
+        "order_up_to": row.ProductForecast.order_up_to,
+        "suggested_quantity": (
+            row.ProductForecast.order_up_to - row.available
+            if row.available <= row.ProductForecast.reorder_point else 0
+        ),
+        "days_of_cover": round(max(row.available, 0) / row.ProductForecast.daily_demand, 1),
+        "forecast_updated_at": row.ProductForecast.updated_at
+    } for row in rows]
+
 # ==========================================
 # CATEGORY ENDPOINTS
 # ==========================================
 
 @app.get("/api/v1/categories", response_model=List[schemas.CategoryResponse])
 def get_categories(
-    db: Session = Depends(database.get_db),
+    request: Request,
+    response: Response,
+    db: Session = Depends(database.get_read_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
-    """Get all categories for the current tenant."""
+    """Get all categories for the current tenant (304 if If-None-Match is current)."""
+    version = changefeed.latest_change_id(db, current_user.tenant_id, "category")
+    not_modified = conditional_get(request, response, f'"categories-{current_user.tenant_id}-{version or 0}"')
+    if not_modified:
+        return not_modified
+    
     return db.query(models.Category).filter(
         models.Category.tenant_id == current_user.tenant_id
     ).all()
@@ -470,8 +679,11 @@ def create_category(
         tenant_id=current_user.tenant_id
     )
     db.add(new_category)
+    db.flush()
+    changefeed.record_category_change(db, new_category)
     db.commit()
     db.refresh(new_category)
+    changefeed.broker.wake()
     return new_category
 
 @app.put("/api/v1/categories/{category_id}", response_model=schemas.CategoryResponse)
@@ -492,8 +704,10 @@ def update_category(
     
     category.name = category_update.name
     category.description = category_update.description
+    changefeed.record_category_change(db, category)
     db.commit()
     db.refresh(category)
+    changefeed.broker.wake()
     return category
 
 @app.delete("/api/v1/categories/{category_id}")
@@ -522,27 +736,166 @@ def delete_category(
             detail=f"Cannot delete category. {products_count} product(s) are using it."
         )
     
+    changefeed.record_category_change(db, category, "delete")
     db.delete(category)
     db.commit()
+    changefeed.broker.wake()
     return {"message": "Category deleted successfully"}
 
+# ==========================================
+# CHANGE FEED (SERVER-SENT EVENTS)
+# ==========================================
+
+@app.post("/api/v1/stream/ticket")
+def create_stream_ticket(current_user: models.User = Depends(auth.get_current_user)):
+    """
+    Ticket for opening a stream from a browser: EventSource(url + "?ticket=...").
+    It expires after STREAM_TICKET_SECONDS, so fetch a new one for every
+    (re)connect.
+    """
+    return {
+        "ticket": auth.create_stream_ticket(current_user.email),
+        "expires_in": settings.STREAM_TICKET_SECONDS
+    }
+
+@app.get("/api/v1/stream/catalog")
+async def stream_catalog_changes(
+    request: Request,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user_for_stream)
+):
+    """
+    Live product/category deltas for the current store as text/event-stream.
+    Events: product.upsert, product.stock, product.delete, category.upsert,
+    category.delete, and resync (client fell behind: refetch the catalog).
+    Reconnecting clients send Last-Event-ID to receive missed changes.
+    """
+    tenant_id = current_user.tenant_id
+    db.close()  # Don't hold a pooled connection for the life of the stream
+    last_event_id = request.headers.get("last-event-id", "")
+    entry = changefeed.broker.subscribe(tenant_id)
+    queue = entry[1]
+
+    async def event_stream():
+        try:
+            yield "retry: 3000\n\n"
+            replayed = set()
+            if last_event_id.isdigit():
+                for event in await run_in_threadpool(changefeed.changes_since, tenant_id, int(last_event_id)):
+                    replayed.add(event["seq"])
+                    yield changefeed.format_sse(event)
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=settings.CHANGE_FEED_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if event["seq"] not in replayed:
+                    yield changefeed.format_sse(event)
+        finally:
+            changefeed.broker.unsubscribe(tenant_id, entry)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# ==========================================
+# POS BOOTSTRAP
+# ==========================================
+
+@app.get("/api/v1/pos/bootstrap")
+def pos_bootstrap(
+    request: Request,
+    response: Response,
+    db: Session = Depends(database.get_read_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """
+    Everything a till needs to start, in one round trip:
+        seq         catalog version; send it as Last-Event-ID to /stream/catalog
+        store, user store and cashier details
+        categories  [{id, name}]
+        products    parallel arrays {field: [...]} (fields in changefeed.PRODUCT_FIELDS)
+    Gzip-compressed when the client accepts it, and 304 for a current If-None-Match.
+    """
+    tenant_id = current_user.tenant_id
+    # Read the version before the rows so a concurrent write can only make the tag older
+    seq = changefeed.latest_change_id(db, tenant_id) or 0
+    tenant = db.get(models.Tenant, tenant_id)
+    store = {
+        "id": tenant.id,
+        "business_name": tenant.business_name,
+        "store_code": tenant.store_code,
+        "address": tenant.address,
+        "city": tenant.city,
+        "state": tenant.state,
+        "contact_phone": tenant.contact_phone,
+        "subscription_status": tenant.subscription_status
+    }
+    user = {
+        "id": current_user.id,
+        "first_name": current_user.first_name,
+        "last_name": current_user.last_name,
+        "role": current_user.role
+    }
+    # Store and cashier details change without a catalog change, so they are part of the tag
+    header = json.dumps({"store": store, "user": user}, sort_keys=True).encode()
+    compress = "gzip" in request.headers.get("accept-encoding", "")
+    # Strong tags name one exact representation, so the gzip body gets its own
+    etag = f'"pos-{tenant_id}-{seq}-{hashlib.sha1(header).hexdigest()[:12]}{"-gz" if compress else ""}"'
+    response.headers["Vary"] = "Accept-Encoding"
+    not_modified = conditional_get(request, response, etag)
+    if not_modified:
+        return not_modified
+    
+    categories = db.query(models.Category.id, models.Category.name).filter(
+        models.Category.tenant_id == tenant_id
+    ).order_by(models.Category.id).all()
+    body = json.dumps({
+        "seq": seq,
+        "store": store,
+        "user": user,
+        "categories": [{"id": category.id, "name": category.name} for category in categories],
+        "products": changefeed.catalog_snapshot(db, tenant_id)
+    }, separators=(",", ":")).encode()
+    
+    headers = dict(response.headers)
+    if compress:
+        body = gzip.compress(body, compresslevel=6, mtime=0)
+        headers["Content-Encoding"] = "gzip"
+    return Response(content=body, media_type="application/json", headers=headers)
+
 # ==========================================
 # CUSTOMER ENDPOINTS
 # ==========================================
 
+def commit_customer(db: Session):
+    """Commit, reporting a phone/card taken concurrently by another customer as 400"""
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="A customer with this phone number or loyalty card already exists")
+
 @app.get("/api/v1/customers", response_model=List[schemas.CustomerResponse])
 def get_customers(
     skip: int = 0,
     limit: int = 100,
     search: Optional[str] = None,
-    db: Session = Depends(database.get_db),
+    segment: Optional[str] = None,
+    db: Session = Depends(database.get_read_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
-    """Get all customers for the current tenant."""
+    """Get all customers for the current tenant, optionally in one RFM segment."""
     query = db.query(models.Customer).filter(
         models.Customer.tenant_id == current_user.tenant_id
     )
     
+    if segment:
+        query = query.filter(models.Customer.segment == segment)
+    
     if search:
         query = query.filter(
             (models.Customer.name.ilike(f"%{search}%")) |
@@ -559,17 +912,25 @@ def create_customer(
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """Create a new customer."""
+    phone_normalized = customer_lookup.normalize_phone(customer.phone)
+    loyalty_card = customer_lookup.normalize_card(customer.loyalty_card)
+    conflict = customer_lookup.find_conflict(db, current_user.tenant_id, phone_normalized, loyalty_card)
+    if conflict:
+        raise HTTPException(status_code=400, detail=conflict)
+    
     new_customer = models.Customer(
         name=customer.name,
         email=customer.email,
         phone=customer.phone,
+        phone_normalized=phone_normalized,
+        loyalty_card=loyalty_card,
         address=customer.address,
         city=customer.city,
         state=customer.state,
         tenant_id=current_user.tenant_id
     )
     db.add(new_customer)
-    db.commit()
+    commit_customer(db)
     db.refresh(new_customer)
     return new_customer
 
@@ -581,19 +942,29 @@ def update_customer(
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """Update a customer."""
-    customer = db.query(models.Customer).filter(
-        models.Customer.id == customer_id,
-        models.Customer.tenant_id == current_user.tenant_id
-    ).first()
+    customer = statements.customer_by_id(db, current_user.tenant_id, customer_id)
     
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
     
     update_data = customer_update.dict(exclude_unset=True)
+    if "phone" in update_data:
+        update_data["phone_normalized"] = customer_lookup.normalize_phone(update_data["phone"])
+    if "loyalty_card" in update_data:
+        update_data["loyalty_card"] = customer_lookup.normalize_card(update_data["loyalty_card"])
+    conflict = customer_lookup.find_conflict(
+        db, current_user.tenant_id,
+        update_data.get("phone_normalized"), update_data.get("loyalty_card"),
+        exclude_id=customer.id
+    )
+    if conflict:
+        raise HTTPException(status_code=400, detail=conflict)
+    
+    customer_lookup.forget(customer)
     for field, value in update_data.items():
         setattr(customer, field, value)
     
-    db.commit()
+    commit_customer(db)
     db.refresh(customer)
     return customer
 
@@ -604,18 +975,68 @@ def delete_customer(
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """Delete a customer."""
-    customer = db.query(models.Customer).filter(
-        models.Customer.id == customer_id,
-        models.Customer.tenant_id == current_user.tenant_id
-    ).first()
+    customer = statements.customer_by_id(db, current_user.tenant_id, customer_id)
     
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
     
+    customer_lookup.forget(customer)
     db.delete(customer)
     db.commit()
     return {"message": "Customer deleted successfully"}
 
+@app.get("/api/v1/customers/segments", response_model=List[schemas.CustomerSegmentSummary])
+def get_customer_segments(
+    db: Session = Depends(database.get_read_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """
+    Customer count and lifetime spend per RFM segment, as of the last run of
+    the segmentation job (segments.py). Use /api/v1/customers?segment= to list members.
+    """
+    C = models.Customer
+    rows = db.query(
+        C.segment,
+        func.count(C.id).label('customer_count'),
+        func.sum(C.total_purchases).label('total_purchases'),
+        func.max(C.segment_updated_at).label('updated_at')
+    ).filter(
+        and_(
+            C.tenant_id == current_user.tenant_id,
+            C.segment.isnot(None)
+        )
+    ).group_by(C.segment).order_by(func.count(C.id).desc()).all()
+    
+    return [{
+        "segment": row.segment,
+        "customer_count": int(row.customer_count),
+        "total_purchases": float(row.total_purchases or 0),
+        "updated_at": row.updated_at
+    } for row in rows]
+
+@app.get("/api/v1/customers/lookup", response_model=schemas.CustomerResponse)
+def lookup_customer(
+    phone: Optional[str] = None,
+    card: Optional[str] = None,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """
+    Exact customer match for checkout by phone number or loyalty card code.
+    Formatting is ignored ('+1 555-0100' matches '15550100').
+    """
+    if card:
+        kind, key = "card", customer_lookup.normalize_card(card)
+    else:
+        kind, key = "phone", customer_lookup.normalize_phone(phone)
+    if not key:
+        raise HTTPException(status_code=400, detail="Provide a phone number or loyalty card code")
+    
+    customer = customer_lookup.find_customer(db, current_user.tenant_id, kind, key)
+    if not customer:
+        raise HTTPException(status_code=404, detail="Customer not found")
+    return customer
+
 @app.get("/api/v1/customers/{customer_id}", response_model=schemas.CustomerResponse)
 def get_customer(
     customer_id: int,
@@ -623,10 +1044,7 @@ def get_customer(
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """Get a specific customer."""
-    customer = db.query(models.Customer).filter(
-        models.Customer.id == customer_id,
-        models.Customer.tenant_id == current_user.tenant_id
-    ).first()
+    customer = statements.customer_by_id(db, current_user.tenant_id, customer_id)
     
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
@@ -645,15 +1063,17 @@ def create_transaction(
 ):
     """
     Process a Sale:
+    0. Release the cart's stock holds (if cart_id is provided)
     1. Validate Customer (if provided)
     2. Calculate Subtotal
     3. Apply Discount (if provided)
-    4. Deduct Stock
+    4. Deduct Stock (atomic conditional update per product, 409 listing every short line)
     5. Save Transaction
-    6. Update Customer Stats
+    6. Queue side effects (customer stats, sales rollup, receipt) for the task worker
     """
     subtotal = 0.0
     transaction_items = []
+    rollup_lines = []
 
     # 1. Validate Customer if provided
     customer = None
@@ -665,32 +1085,34 @@ def create_transaction(
         if not customer:
             raise HTTPException(status_code=404, detail="Customer not found")
 
-    # 2. Validate Items & Calculate Subtotal
-    for item in payload.items:
-        # Fetch fresh product data to ensure price/stock is correct
-        # Also verify product belongs to the current user's tenant
-        product_db = db.query(models.Product).filter(
-            models.Product.id == item.product_id,
+    # Holds taken by this cart become part of the sale
+    if payload.cart_id:
+        reservations.release_cart(db, current_user.tenant_id, payload.cart_id)
+
+    # 2. Validate Items & Calculate Subtotal (one query for the whole basket)
+    product_ids = {item.product_id for item in payload.items}
+    products = {
+        product.id: product for product in db.query(models.Product).filter(
+            models.Product.id.in_(product_ids),
             models.Product.tenant_id == current_user.tenant_id
-        ).first()
-        
+        )
+    }
+    quantities = {}
+    for item in payload.items:
+        product_db = products.get(item.product_id)
         if not product_db:
             raise HTTPException(status_code=404, detail=f"Product {item.product_name} not found")
-        
-        # Check if enough stock exists
-        if product_db.stock_quantity < item.quantity:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Not enough stock for {product_db.name}. Available: {product_db.stock_quantity}"
-            )
-
-        # Deduct Stock
-        product_db.stock_quantity -= item.quantity
+        if item.quantity <= 0:
+            raise HTTPException(status_code=400, detail=f"Invalid quantity for {product_db.name}")
+        quantities[product_db.id] = quantities.get(product_db.id, 0) + item.quantity
         
         # Calculate Line Total
         line_total = product_db.selling_price * item.quantity
         subtotal += line_total
         
+        # Rollup line: (product, qty, revenue, cost at time of sale)
+        rollup_lines.append((product_db.id, item.quantity, line_total, (product_db.cost_price or 0.0) * item.quantity))
+        
         # Prepare Item Record for Database
         transaction_items.append(models.TransactionItem(
             product_id=product_db.id,
@@ -700,6 +1122,12 @@ def create_transaction(
             total_price=line_total
         ))
 
+    # Deduct Stock: one conditional update per product (other carts' holds are not
+    # available); every short line is reported in a single 409
+    stock.apply_stock_changes(db, current_user.tenant_id, [
+        stock.StockChange(product_id, delta=-quantity) for product_id, quantity in quantities.items()
+    ])
+
     # 3. Calculate Discount
     discount_amount = 0.0
     if payload.discount_type and payload.discount_value:
@@ -729,45 +1157,102 @@ def create_transaction(
         payment_method=payload.payment_method
     )
     db.add(new_txn)
-    db.commit()
-    db.refresh(new_txn)
+    db.flush()  # Assigns id and created_at
 
     # 5. Save Items Linked to Transaction
     for txn_item in transaction_items:
         txn_item.transaction_id = new_txn.id
+        txn_item.created_at = new_txn.created_at  # Same monthly partition as the transaction
         db.add(txn_item)
     
-    # 6. Update Customer Stats if customer exists
+    # 6. Queue side effects in the same commit (run by the task worker)
     if customer:
-        customer.total_purchases += total_amount
-        customer.last_purchase_date = datetime.now(timezone.utc)
-        # Award loyalty points (1 point per dollar spent)
-        customer.loyalty_points += int(total_amount)
-        db.commit()
-
-    db.commit()
-
-    return {
+        tasks.enqueue(db, "customer_stats", {
+            "customer_id": customer.id,
+            "tenant_id": current_user.tenant_id,
+            "total_amount": total_amount,
+            "purchased_at": new_txn.created_at.isoformat()
+        })
+    # Product sales rollup (revenue net of discount, allocated pro rata)
+    net_ratio = total_amount / subtotal if subtotal else 1.0
+    tasks.enqueue(db, "product_rollup", {
+        "tenant_id": current_user.tenant_id,
+        "day": new_txn.created_at.date().isoformat(),
+        "lines": [[product_id, qty, revenue * net_ratio, cost] for product_id, qty, revenue, cost in rollup_lines]
+    })
+    tasks.enqueue(db, "render_receipt", {
+        "transaction_id": new_txn.id,
+        "tenant_id": current_user.tenant_id
+    })
+    for product_id in quantities:
+        changefeed.record_product_change(db, products[product_id], "stock")
+    
+    response = {
         "id": new_txn.id, 
         "total_amount": total_amount, 
         "created_at": new_txn.created_at,
         "message": "Sale successful"
     }
+    db.commit()
+    tasks.notify()
+    changefeed.broker.wake()
+
+    return response
+
+def encode_cursor(transaction) -> str:
+    """Opaque keyset cursor: the (created_at, id) of a page's last transaction"""
+    key = f"{transaction.created_at.isoformat()}|{transaction.id}"
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        created_at, transaction_id = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode().split("|")
+        return datetime.fromisoformat(created_at), int(transaction_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 @app.get("/api/v1/transactions", response_model=List[schemas.TransactionDetailResponse])
 def get_transactions(
-    skip: int = 0,
+    response: Response,
     limit: int = 100,
-    db: Session = Depends(database.get_db),
+    cursor: Optional[str] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    tz_offset: int = 0,
+    customer_id: Optional[int] = None,
+    cashier_id: Optional[int] = None,
+    payment_method: Optional[str] = None,
+    skip: int = 0,
+    db: Session = Depends(database.get_read_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """
-    Get transaction history for the current tenant.
+    Get transaction history for the current tenant, newest first.
+    Optional filters: start_date/end_date (store local dates, tz_offset
+    minutes east of UTC), customer_id, cashier_id, payment_method.
+    While a full page is returned, the X-Next-Cursor header holds the
+    cursor for the next one (pass it as ?cursor=; each page costs the same).
+    skip is still accepted but reads and discards the skipped rows.
     """
-    transactions = db.query(models.Transaction).filter(
-        models.Transaction.tenant_id == current_user.tenant_id
-    ).order_by(models.Transaction.created_at.desc()).offset(skip).limit(limit).all()
+    if not 1 <= limit <= 500:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 500")
+    if not -840 <= tz_offset <= 840:
+        raise HTTPException(status_code=400, detail="tz_offset must be between -840 and 840 minutes")
+    if start_date and end_date and start_date > end_date:
+        raise HTTPException(status_code=400, detail="start_date must be on or before end_date")
+    offset = timedelta(minutes=tz_offset)
     
+    transactions = statements.transaction_page(
+        db, current_user.tenant_id, limit, max(skip, 0),
+        start=datetime.combine(start_date, datetime.min.time()) - offset if start_date else None,
+        end=datetime.combine(end_date + timedelta(days=1), datetime.min.time()) - offset if end_date else None,
+        customer_id=customer_id,
+        user_id=cashier_id,
+        payment_method=payment_method,
+        before=decode_cursor(cursor) if cursor else None
+    )
+    if len(transactions) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(transactions[-1])
     return transactions
 
 @app.get("/api/v1/transactions/{transaction_id}", response_model=schemas.TransactionDetailResponse)
@@ -795,17 +1280,82 @@ def get_transaction(
     return response_data
 
 # ==========================================
-# ANALYTICS ENDPOINTS
+# CART STOCK HOLDS
 # ==========================================
 
-@app.get("/api/v1/analytics/dashboard", response_model=schemas.DashboardStats)
-def get_dashboard_stats(
+@app.put("/api/v1/carts/{cart_id}/holds/{product_id}", response_model=schemas.HoldResponse)
+def set_cart_hold(
+    cart_id: str,
+    product_id: int,
+    hold: schemas.HoldRequest,
     db: Session = Depends(database.get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """
-    Get dashboard statistics: today's sales, transactions, low stock items, etc.
+    Hold stock for a product in an open cart (quantity 0 releases it).
+    Holds expire CART_HOLD_TTL_SECONDS after the cart was last changed and
+    are converted into the sale by create_transaction with the same cart_id.
     """
+    if hold.quantity < 0:
+        raise HTTPException(status_code=400, detail="Quantity cannot be negative")
+    if len(cart_id) > 64:
+        raise HTTPException(status_code=400, detail="Cart id is too long")
+    
+    product = statements.product_by_id(db, current_user.tenant_id, product_id)
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    
+    try:
+        expires_at, available = reservations.set_hold(
+            db, current_user.tenant_id, cart_id, product_id, hold.quantity
+        )
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Cart was changed concurrently, please retry")
+    if expires_at is None:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Not enough stock for {product.name}. Available: {available}"
+        )
+    
+    return {
+        "product_id": product_id,
+        "quantity": hold.quantity,
+        "expires_at": expires_at,
+        "available": max(reservations.available_quantity(db, current_user.tenant_id, product_id), 0)
+    }
+
+@app.get("/api/v1/carts/{cart_id}/holds", response_model=List[schemas.HoldResponse])
+def get_cart_holds(
+    cart_id: str,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """List the stock held by a cart."""
+    return [{
+        "product_id": hold.product_id,
+        "quantity": hold.quantity,
+        "expires_at": hold.expires_at,
+        "available": max(available, 0)
+    } for hold, available in reservations.cart_holds(db, current_user.tenant_id, cart_id)]
+
+@app.delete("/api/v1/carts/{cart_id}/holds")
+def release_cart_holds(
+    cart_id: str,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """Release every hold of a cart (cart cancelled)."""
+    released = reservations.release_cart(db, current_user.tenant_id, cart_id)
+    db.commit()
+    return {"message": f"Released holds on {len(released)} products"}
+
+# ==========================================
+# ANALYTICS ENDPOINTS
+# ==========================================
+
+def dashboard_stats(db: Session, tenant_id: int):
+    """Today's and this month's sales plus stock counts for one store"""
     today = date.today()
     today_start = datetime.combine(today, datetime.min.time()).replace(tzinfo=timezone.utc)
     today_end = datetime.combine(today, datetime.max.time()).replace(tzinfo=timezone.utc)
@@ -816,7 +1366,7 @@ def get_dashboard_stats(
         func.count(models.Transaction.id).label('transaction_count')
     ).filter(
         and_(
-            models.Transaction.tenant_id == current_user.tenant_id,
+            models.Transaction.tenant_id == tenant_id,
             models.Transaction.created_at >= today_start,
             models.Transaction.created_at <= today_end
         )
@@ -832,7 +1382,7 @@ def get_dashboard_stats(
         func.count(models.Transaction.id).label('transaction_count')
     ).filter(
         and_(
-            models.Transaction.tenant_id == current_user.tenant_id,
+            models.Transaction.tenant_id == tenant_id,
             models.Transaction.created_at >= month_start
         )
     ).first()
@@ -843,14 +1393,14 @@ def get_dashboard_stats(
     # Low stock items
     low_stock_count = db.query(models.Product).filter(
         and_(
-            models.Product.tenant_id == current_user.tenant_id,
+            models.Product.tenant_id == tenant_id,
             models.Product.stock_quantity <= models.Product.min_stock_level
         )
     ).count()
     
     # Total products
     total_products = db.query(models.Product).filter(
-        models.Product.tenant_id == current_user.tenant_id
+        models.Product.tenant_id == tenant_id
     ).count()
     
     return {
@@ -862,43 +1412,664 @@ def get_dashboard_stats(
         "monthly_transactions": monthly_transactions
     }
 
+@app.get("/api/v1/analytics/dashboard", response_model=schemas.DashboardStats)
+def get_dashboard_stats(
+    db: Session = Depends(database.get_read_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """
+    Get dashboard statistics: today's sales, transactions, low stock items, etc.
+    """
+    return dashboard_stats(db, current_user.tenant_id)
+
+def daily_sales(db: Session, tenant_id: int, start_date: datetime):
+    """Sales total and transaction count per day since start_date for one store (including archived months)"""
+    rows = db.query(
+        func.date(models.Transaction.created_at).label('date'),
+        func.sum(models.Transaction.total_amount).label('total_sales'),
+        func.count(models.Transaction.id).label('transaction_count')
+    ).filter(
+        and_(
+            models.Transaction.tenant_id == tenant_id,
+            models.Transaction.created_at >= start_date
+        )
+    ).group_by(func.date(models.Transaction.created_at)).order_by('date').all()
+    
+    totals = {
+        (row.date.isoformat() if isinstance(row.date, date) else str(row.date),):
+        [int(row.transaction_count or 0), float(row.total_sales or 0), 0.0]
+        for row in rows
+    }
+    archived = sales_archive.aggregate(db, tenant_id, start_date, datetime.now(timezone.utc), ["day"])
+    sales_archive.merge_into(totals, {(day.isoformat(),): values for (day,), values in archived.items()})
+    return [{
+        "date": day,
+        "total_sales": total_sales,
+        "transaction_count": transaction_count
+    } for (day,), (transaction_count, total_sales, _) in sorted(totals.items())]
+
 @app.get("/api/v1/analytics/sales", response_model=List[schemas.SalesAnalytics])
 def get_sales_analytics(
     days: int = 30,
-    db: Session = Depends(database.get_db),
+    db: Session = Depends(database.get_read_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """
     Get daily sales analytics for the last N days.
     """
     start_date = datetime.now(timezone.utc) - timedelta(days=days)
+    return daily_sales(db, current_user.tenant_id, start_date)
+
+def resolve_date_range(start_date: Optional[date], end_date: Optional[date], default_days: int = 30):
+    """Default to the last `default_days` days; reject inverted ranges"""
+    end_date = end_date or datetime.now(timezone.utc).date()
+    start_date = start_date or end_date - timedelta(days=default_days - 1)
+    if start_date > end_date:
+        raise HTTPException(status_code=400, detail="start_date must be on or before end_date")
+    return start_date, end_date
+
+PRODUCT_SORT_COLUMNS = {"revenue", "quantity", "margin"}
+
+@app.get("/api/v1/analytics/products", response_model=List[schemas.ProductPerformance])
+def get_product_analytics(
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    sort_by: str = "revenue",
+    limit: int = 10,
+    db: Session = Depends(database.get_read_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """
+    Top-N products by revenue, quantity or margin over a date range.
+    Aggregated from the product_daily_sales rollup.
+    """
+    if sort_by not in PRODUCT_SORT_COLUMNS:
+        raise HTTPException(status_code=400, detail="sort_by must be 'revenue', 'quantity' or 'margin'")
+    start_date, end_date = resolve_date_range(start_date, end_date)
+    limit = max(1, min(limit, 100))
     
-    # Group transactions by date
-    daily_sales = db.query(
-        func.date(models.Transaction.created_at).label('date'),
-        func.sum(models.Transaction.total_amount).label('total_sales'),
-        func.count(models.Transaction.id).label('transaction_count')
+    R = models.ProductDailySales
+    quantity = func.sum(R.quantity).label('quantity_sold')
+    revenue = func.sum(R.revenue).label('revenue')
+    cost = func.sum(R.cost).label('cost')
+    margin = (func.sum(R.revenue) - func.sum(R.cost)).label('margin')
+    order = {"revenue": revenue, "quantity": quantity, "margin": margin}[sort_by]
+    
+    rows = db.query(
+        R.product_id,
+        models.Product.name.label('product_name'),
+        models.Category.name.label('category_name'),
+        quantity, revenue, cost, margin
+    ).outerjoin(
+        models.Product, models.Product.id == R.product_id
+    ).outerjoin(
+        models.Category, models.Category.id == models.Product.category_id
     ).filter(
         and_(
-            models.Transaction.tenant_id == current_user.tenant_id,
-            models.Transaction.created_at >= start_date
+            R.tenant_id == current_user.tenant_id,
+            R.day >= start_date,
+            R.day <= end_date
         )
-    ).group_by(func.date(models.Transaction.created_at)).order_by('date').all()
+    ).group_by(
+        R.product_id, models.Product.name, models.Category.name
+    ).order_by(order.desc()).limit(limit).all()
     
+    return [{
+        "product_id": row.product_id,
+        "product_name": row.product_name or "Deleted product",
+        "category_name": row.category_name,
+        "quantity_sold": int(row.quantity_sold or 0),
+        "revenue": float(row.revenue or 0),
+        "cost": float(row.cost or 0),
+        "margin": float(row.margin or 0)
+    } for row in rows]
+
+@app.get("/api/v1/analytics/categories", response_model=List[schemas.CategoryPerformance])
+def get_category_analytics(
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    db: Session = Depends(database.get_read_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """
+    Sales, margin and revenue share per category over a date range.
+    Products without a category are grouped as "Uncategorized".
+    """
+    start_date, end_date = resolve_date_range(start_date, end_date)
+    
+    R = models.ProductDailySales
+    rows = db.query(
+        models.Category.id.label('category_id'),
+        models.Category.name.label('category_name'),
+        func.count(func.distinct(R.product_id)).label('product_count'),
+        func.sum(R.quantity).label('quantity_sold'),
+        func.sum(R.revenue).label('revenue'),
+        func.sum(R.cost).label('cost')
+    ).outerjoin(
+        models.Product, models.Product.id == R.product_id
+    ).outerjoin(
+        models.Category, models.Category.id == models.Product.category_id
+    ).filter(
+        and_(
+            R.tenant_id == current_user.tenant_id,
+            R.day >= start_date,
+            R.day <= end_date
+        )
+    ).group_by(models.Category.id, models.Category.name).all()
+    
+    total_revenue = sum(float(row.revenue or 0) for row in rows)
     result = []
-    for row in daily_sales:
+    for row in sorted(rows, key=lambda r: r.revenue or 0, reverse=True):
+        revenue = float(row.revenue or 0)
         result.append({
-            "date": row.date.isoformat() if isinstance(row.date, date) else str(row.date),
-            "total_sales": float(row.total_sales or 0),
-            "transaction_count": int(row.transaction_count or 0)
+            "category_id": row.category_id,
+            "category_name": row.category_name or "Uncategorized",
+            "product_count": int(row.product_count or 0),
+            "quantity_sold": int(row.quantity_sold or 0),
+            "revenue": revenue,
+            "cost": float(row.cost or 0),
+            "margin": revenue - float(row.cost or 0),
+            "revenue_share": revenue / total_revenue if total_revenue else 0.0
         })
-    
     return result
 
+def local_datetime(db: Session, column, tz_offset: int):
+    """A UTC DateTime column shifted to store local time (tz_offset minutes east of UTC)"""
+    if not tz_offset:
+        return column
+    if db.get_bind().dialect.name == "sqlite":
+        return func.datetime(column, f"{tz_offset:+d} minutes")
+    return column + timedelta(minutes=tz_offset)
+
+def resolve_report_range(start_date: Optional[date], end_date: Optional[date], tz_offset: int):
+    """
+    Local dates -> (start_date, end_date, utc_start, utc_end) where [utc_start, utc_end)
+    covers the whole local days, so filters stay on the indexed created_at column.
+    """
+    if not -840 <= tz_offset <= 840:
+        raise HTTPException(status_code=400, detail="tz_offset must be between -840 and 840 minutes")
+    offset = timedelta(minutes=tz_offset)
+    local_today = (datetime.now(timezone.utc) + offset).date()
+    start_date, end_date = resolve_date_range(start_date, end_date or local_today)
+    utc_start = datetime.combine(start_date, datetime.min.time()) - offset
+    utc_end = datetime.combine(end_date + timedelta(days=1), datetime.min.time()) - offset
+    return start_date, end_date, utc_start, utc_end
+
+def report_cache_ttl(end_date: date, tz_offset: int):
+    """Short TTL while the range still includes today, long once it is closed"""
+    today = (datetime.now(timezone.utc) + timedelta(minutes=tz_offset)).date()
+    if end_date >= today:
+        return settings.REPORT_CACHE_TTL_SECONDS
+    return settings.REPORT_CACHE_CLOSED_TTL_SECONDS
+
+@app.get("/api/v1/analytics/sales/by-payment-method", response_model=List[schemas.PaymentMethodSales])
+def get_sales_by_payment_method(
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    tz_offset: int = 0,
+    db: Session = Depends(database.get_read_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """
+    Sales per payment method over a date range (store local dates; tz_offset
+    is minutes east of UTC).
+    """
+    start_date, end_date, utc_start, utc_end = resolve_report_range(start_date, end_date, tz_offset)
+    T = models.Transaction
+    
+    def compute():
+        rows = db.query(
+            T.payment_method,
+            func.count(T.id).label('transaction_count'),
+            func.sum(T.total_amount).label('total_sales'),
+            func.sum(T.discount_amount).label('discount_total')
+        ).filter(
+            and_(
+                T.tenant_id == current_user.tenant_id,
+                T.created_at >= utc_start,
+                T.created_at < utc_end
+            )
+        ).group_by(T.payment_method).all()
+        totals = {
+            (row.payment_method,): [int(row.transaction_count), float(row.total_sales or 0), float(row.discount_total or 0)]
+            for row in rows
+        }
+        sales_archive.merge_into(totals, sales_archive.aggregate(
+            db, current_user.tenant_id, utc_start, utc_end, ["payment_method"]
+        ))
+        return sorted([{
+            "payment_method": payment_method,
+            "transaction_count": transaction_count,
+            "total_sales": total_sales,
+            "discount_total": discount_total,
+            "average_sale": total_sales / transaction_count
+        } for (payment_method,), (transaction_count, total_sales, discount_total) in totals.items()],
+            key=lambda entry: entry["total_sales"], reverse=True)
+    
+    return cache.reports.get_or_compute(
+        (current_user.tenant_id, "payment_methods", start_date, end_date, tz_offset),
+        compute, report_cache_ttl(end_date, tz_offset)
+    )
+
+@app.get("/api/v1/analytics/sales/by-cashier", response_model=List[schemas.CashierSales])
+def get_sales_by_cashier(
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    tz_offset: int = 0,
+    db: Session = Depends(database.get_read_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """Sales per cashier over a date range."""
+    start_date, end_date, utc_start, utc_end = resolve_report_range(start_date, end_date, tz_offset)
+    T, U = models.Transaction, models.User
+    
+    def compute():
+        rows = db.query(
+            T.user_id,
+            U.first_name,
+            U.last_name,
+            func.count(T.id).label('transaction_count'),
+            func.sum(T.total_amount).label('total_sales')
+        ).outerjoin(
+            U, U.id == T.user_id
+        ).filter(
+            and_(
+                T.tenant_id == current_user.tenant_id,
+                T.created_at >= utc_start,
+                T.created_at < utc_end
+            )
+        ).group_by(T.user_id, U.first_name, U.last_name).all()
+        names = {
+            row.user_id: f"{row.first_name} {row.last_name}" if row.first_name else "Unknown"
+            for row in rows
+        }
+        totals = {(row.user_id,): [int(row.transaction_count), float(row.total_sales or 0), 0.0] for row in rows}
+        sales_archive.merge_into(totals, sales_archive.aggregate(
+            db, current_user.tenant_id, utc_start, utc_end, ["user_id"]
+        ))
+        missing = [user_id for (user_id,) in totals if user_id is not None and user_id not in names]
+        if missing:
+            for user in db.query(U.id, U.first_name, U.last_name).filter(U.id.in_(missing)):
+                names[user.id] = f"{user.first_name} {user.last_name}"
+        return sorted([{
+            "user_id": user_id,
+            "cashier_name": names.get(user_id, "Unknown"),
+            "transaction_count": transaction_count,
+            "total_sales": total_sales,
+            "average_sale": total_sales / transaction_count
+        } for (user_id,), (transaction_count, total_sales, _) in totals.items()],
+            key=lambda entry: entry["total_sales"], reverse=True)
+    
+    return cache.reports.get_or_compute(
+        (current_user.tenant_id, "cashiers", start_date, end_date, tz_offset),
+        compute, report_cache_ttl(end_date, tz_offset)
+    )
+
+@app.get("/api/v1/analytics/sales/heatmap", response_model=List[schemas.SalesHeatmapCell])
+def get_sales_heatmap(
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    tz_offset: int = 0,
+    db: Session = Depends(database.get_read_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """
+    Sales by weekday and hour of day (store local time) over a date range.
+    Only cells with sales are returned.
+    """
+    start_date, end_date, utc_start, utc_end = resolve_report_range(start_date, end_date, tz_offset)
+    T = models.Transaction
+    
+    def compute():
+        local_created_at = local_datetime(db, T.created_at, tz_offset)
+        dow = extract('dow', local_created_at).label('dow')  # 0 = Sunday
+        hour = extract('hour', local_created_at).label('hour')
+        rows = db.query(
+            dow,
+            hour,
+            func.count(T.id).label('transaction_count'),
+            func.sum(T.total_amount).label('total_sales')
+        ).filter(
+            and_(
+                T.tenant_id == current_user.tenant_id,
+                T.created_at >= utc_start,
+                T.created_at < utc_end
+            )
+        ).group_by(dow, hour).all()
+        totals = {
+            ((int(row.dow) + 6) % 7, int(row.hour)): [int(row.transaction_count), float(row.total_sales or 0), 0.0]
+            for row in rows
+        }
+        sales_archive.merge_into(totals, sales_archive.aggregate(
+            db, current_user.tenant_id, utc_start, utc_end, ["weekday", "hour"], tz_offset
+        ))
+        return [{
+            "weekday": weekday,
+            "hour": hour,
+            "transaction_count": transaction_count,
+            "total_sales": total_sales
+        } for (weekday, hour), (transaction_count, total_sales, _) in sorted(totals.items())]
+    
+    return cache.reports.get_or_compute(
+        (current_user.tenant_id, "heatmap", start_date, end_date, tz_offset),
+        compute, report_cache_ttl(end_date, tz_offset)
+    )
+
+def margin_percent(retail_value: float, cost_value: float):
+    return (retail_value - cost_value) / retail_value * 100 if retail_value else 0.0
+
+@app.get("/api/v1/analytics/inventory-valuation", response_model=schemas.InventoryValuation)
+def get_inventory_valuation(
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """
+    Stock on hand valued at cost and at retail, with potential margin per
+    category (products with stock <= 0 are left out). Cached until the
+    tenant's next catalog or stock change.
+    """
+    P = models.Product
+    # Every product/stock write records a catalog change, so its id versions the snapshot
+    version = changefeed.latest_change_id(db, current_user.tenant_id)
+    
+    def compute():
+        rows = db.query(
+            models.Category.id.label('category_id'),
+            models.Category.name.label('category_name'),
+            func.count(P.id).label('product_count'),
+            func.sum(P.stock_quantity).label('units'),
+            func.sum(func.coalesce(P.cost_price, 0.0) * P.stock_quantity).label('cost_value'),
+            func.sum(P.selling_price * P.stock_quantity).label('retail_value')
+        ).outerjoin(
+            models.Category, models.Category.id == P.category_id
+        ).filter(
+            and_(
+                P.tenant_id == current_user.tenant_id,
+                P.stock_quantity > 0
+            )
+        ).group_by(models.Category.id, models.Category.name).all()
+        
+        categories = []
+        for row in sorted(rows, key=lambda r: r.retail_value or 0, reverse=True):
+            cost_value, retail_value = float(row.cost_value or 0), float(row.retail_value or 0)
+            categories.append({
+                "category_id": row.category_id,
+                "category_name": row.category_name or "Uncategorized",
+                "product_count": int(row.product_count),
+                "units": int(row.units or 0),
+                "cost_value": cost_value,
+                "retail_value": retail_value,
+                "potential_margin": retail_value - cost_value,
+                "margin_percent": margin_percent(retail_value, cost_value)
+            })
+        cost_value = sum(category["cost_value"] for category in categories)
+        retail_value = sum(category["retail_value"] for category in categories)
+        return {
+            "product_count": sum(category["product_count"] for category in categories),
+            "units": sum(category["units"] for category in categories),
+            "cost_value": cost_value,
+            "retail_value": retail_value,
+            "potential_margin": retail_value - cost_value,
+            "margin_percent": margin_percent(retail_value, cost_value),
+            "categories": categories
+        }
+    
+    return cache.reports.get_or_compute(
+        (current_user.tenant_id, "inventory_valuation", version),
+        compute, settings.REPORT_CACHE_CLOSED_TTL_SECONDS
+    )
+
+# ==========================================
+# STORE GROUPS (MULTI-STORE OWNERS)
+# ==========================================
+
+def require_owner(current_user: models.User):
+    if current_user.role != "owner":
+        raise HTTPException(status_code=403, detail="Only store owners can manage store groups")
+
+def current_group(db: Session, current_user: models.User):
+    """(tenant, group) of the current store; 404 when it is in no group"""
+    require_owner(current_user)
+    tenant = db.query(models.Tenant).filter(models.Tenant.id == current_user.tenant_id).first()
+    if tenant.group_id is None:
+        raise HTTPException(status_code=404, detail="This store is not part of a store group")
+    return tenant, tenant.group
+
+def require_group_owner(db: Session, current_user: models.User):
+    """The current store's group, if the current user created (owns) it"""
+    tenant, group = current_group(db, current_user)
+    if group.owner_user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Only the group owner can manage its stores")
+    return group
+
+def group_member(db: Session, group: models.StoreGroup, tenant_id: int):
+    tenant = db.query(models.Tenant).filter(
+        models.Tenant.id == tenant_id,
+        models.Tenant.group_id == group.id
+    ).first()
+    if not tenant:
+        raise HTTPException(status_code=404, detail="Store not found in this group")
+    return tenant
+
+def group_response(db: Session, group: models.StoreGroup, tenant: models.Tenant, current_user: models.User):
+    """Members see approved stores; the owner also sees pending ones and the join code"""
+    is_owner = group.owner_user_id == current_user.id
+    query = db.query(models.Tenant).filter(models.Tenant.group_id == group.id)
+    if not is_owner:
+        query = query.filter(models.Tenant.group_approved.is_(True))
+    stores = query.order_by(models.Tenant.id).all()
+    return {
+        "id": group.id,
+        "name": group.name,
+        "is_owner": is_owner,
+        "approved": tenant.group_approved,
+        "join_code": group.join_code if is_owner else None,
+        "stores": [{
+            "tenant_id": store.id,
+            "business_name": store.business_name,
+            "city": store.city,
+            "approved": store.group_approved
+        } for store in stores]
+    }
+
+def group_stores(db: Session, current_user: models.User):
+    """(id, business_name) of every approved store in the owner's group"""
+    require_owner(current_user)
+    membership = db.query(models.Tenant.group_id, models.Tenant.group_approved).filter(
+        models.Tenant.id == current_user.tenant_id
+    ).first()
+    if membership.group_id is None:
+        raise HTTPException(status_code=404, detail="This store is not part of a store group")
+    if not membership.group_approved:
+        raise HTTPException(status_code=403, detail="The group owner has not approved this store yet")
+    return db.query(models.Tenant.id, models.Tenant.business_name).filter(
+        models.Tenant.group_id == membership.group_id,
+        models.Tenant.group_approved.is_(True)
+    ).order_by(models.Tenant.id).all()
+
+@app.post("/api/v1/store-groups", response_model=schemas.StoreGroupResponse)
+def create_store_group(
+    group_data: schemas.StoreGroupCreate,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """
+    Create a store group containing the current store, owned by the current
+    user. Other stores ask to join with the join code; the owner approves them.
+    """
+    require_owner(current_user)
+    tenant = db.query(models.Tenant).filter(models.Tenant.id == current_user.tenant_id).first()
+    if tenant.group_id is not None:
+        raise HTTPException(status_code=400, detail="This store is already part of a store group")
+    
+    group = models.StoreGroup(
+        name=group_data.name,
+        join_code=consolidated.new_join_code(),
+        owner_user_id=current_user.id
+    )
+    db.add(group)
+    db.flush()
+    tenant.group_id = group.id
+    tenant.group_approved = True
+    db.commit()
+    return group_response(db, group, tenant, current_user)
+
+@app.post("/api/v1/store-groups/join", response_model=schemas.StoreGroupResponse)
+def join_store_group(
+    join_data: schemas.StoreGroupJoin,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """
+    Ask to add the current store to the group with this join code. The code
+    is used up; the store sees no group figures until the group owner approves it.
+    """
+    require_owner(current_user)
+    group = db.query(models.StoreGroup).filter(
+        models.StoreGroup.join_code == join_data.join_code
+    ).first()
+    if not group:
+        raise HTTPException(status_code=404, detail="Invalid join code")
+    
+    tenant = db.query(models.Tenant).filter(models.Tenant.id == current_user.tenant_id).first()
+    if tenant.group_id is not None:
+        raise HTTPException(status_code=400, detail="This store is already part of a store group")
+    tenant.group_id = group.id
+    tenant.group_approved = False
+    group.join_code = consolidated.new_join_code()
+    db.commit()
+    return group_response(db, group, tenant, current_user)
+
+@app.get("/api/v1/store-groups/current", response_model=schemas.StoreGroupResponse)
+def get_store_group(
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """The current store's group and its member stores."""
+    tenant, group = current_group(db, current_user)
+    return group_response(db, group, tenant, current_user)
+
+@app.post("/api/v1/store-groups/join-code", response_model=schemas.StoreGroupResponse)
+def rotate_join_code(
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """Replace the join code (group owner only); the old one stops working."""
+    group = require_group_owner(db, current_user)
+    group.join_code = consolidated.new_join_code()
+    db.commit()
+    tenant = group_member(db, group, current_user.tenant_id)
+    return group_response(db, group, tenant, current_user)
+
+@app.post("/api/v1/store-groups/stores/{tenant_id}/approve", response_model=schemas.StoreGroupResponse)
+def approve_group_store(
+    tenant_id: int,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """Approve a store that asked to join (group owner only)."""
+    group = require_group_owner(db, current_user)
+    group_member(db, group, tenant_id).group_approved = True
+    db.commit()
+    tenant = group_member(db, group, current_user.tenant_id)
+    return group_response(db, group, tenant, current_user)
+
+@app.delete("/api/v1/store-groups/stores/{tenant_id}", response_model=schemas.StoreGroupResponse)
+def remove_group_store(
+    tenant_id: int,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """Remove a store, or decline a pending one (group owner only)."""
+    group = require_group_owner(db, current_user)
+    if tenant_id == current_user.tenant_id:
+        raise HTTPException(status_code=400, detail="Use /api/v1/store-groups/leave for your own store")
+    member = group_member(db, group, tenant_id)
+    member.group_id = None
+    member.group_approved = False
+    db.commit()
+    tenant = group_member(db, group, current_user.tenant_id)
+    return group_response(db, group, tenant, current_user)
+
+@app.post("/api/v1/store-groups/leave")
+def leave_store_group(
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """Remove the current store from its group (the owner's store leaves last, closing the group)."""
+    tenant, group = current_group(db, current_user)
+    if group.owner_user_id == current_user.id:
+        others = db.query(models.Tenant.id).filter(
+            models.Tenant.group_id == group.id,
+            models.Tenant.id != tenant.id
+        ).count()
+        if others:
+            raise HTTPException(status_code=400, detail="Remove the other stores before leaving a group you own")
+    tenant.group_id = None
+    tenant.group_approved = False
+    if group.owner_user_id == current_user.id:
+        db.delete(group)
+    db.commit()
+    return {"message": "Store removed from the group"}
+
+@app.get("/api/v1/consolidated/dashboard", response_model=schemas.ConsolidatedDashboard)
+def get_consolidated_dashboard(
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """
+    Dashboard statistics for every store in the owner's group and their totals.
+    Stores are queried concurrently.
+    """
+    stores = group_stores(db, current_user)
+    consolidated.release_connections(db, current_user)
+    results = consolidated.fan_out([store.id for store in stores], dashboard_stats)
+    return {
+        "totals": consolidated.merge_totals(results),
+        "stores": [{
+            "tenant_id": store.id,
+            "business_name": store.business_name,
+            **result
+        } for store, result in zip(stores, results)]
+    }
+
+@app.get("/api/v1/consolidated/sales", response_model=schemas.ConsolidatedSales)
+def get_consolidated_sales(
+    days: int = 30,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """
+    Daily sales for the last N days summed over the owner's stores, plus each
+    store's total for the period. Stores are queried concurrently.
+    """
+    stores = group_stores(db, current_user)
+    consolidated.release_connections(db, current_user)
+    start_date = datetime.now(timezone.utc) - timedelta(days=days)
+    results = consolidated.fan_out(
+        [store.id for store in stores],
+        lambda store_db, tenant_id: daily_sales(store_db, tenant_id, start_date)
+    )
+    return {
+        "daily": consolidated.merge_daily(results),
+        "stores": [{
+            "tenant_id": store.id,
+            "business_name": store.business_name,
+            "total_sales": sum(row["total_sales"] for row in rows),
+            "transaction_count": sum(row["transaction_count"] for row in rows)
+        } for store, rows in zip(stores, results)]
+    }
+
 # ==========================================
 # RECEIPT ENDPOINTS
 # ==========================================
 
+def get_receipt_or_404(db: Session, transaction_id: int, tenant_id: int):
+    receipt = receipts.get_or_render_receipt(db, transaction_id, tenant_id)
+    if not receipt:
+        raise HTTPException(status_code=404, detail="Transaction not found")
+    return receipt
+
 @app.get("/api/v1/transactions/{transaction_id}/receipt", response_model=schemas.ReceiptData)
 def get_receipt(
     transaction_id: int,
@@ -906,29 +2077,31 @@ def get_receipt(
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """
-    Get receipt data for printing.
+    Get receipt data for printing (served from the receipt cache).
     """
-    transaction = db.query(models.Transaction).filter(
-        models.Transaction.id == transaction_id,
-        models.Transaction.tenant_id == current_user.tenant_id
-    ).first()
-    
-    if not transaction:
-        raise HTTPException(status_code=404, detail="Transaction not found")
-    
-    tenant = current_user.tenant
-    
-    return {
-        "transaction_id": transaction.id,
-        "store_name": tenant.business_name,
-        "store_address": f"{tenant.address}, {tenant.city}, {tenant.state}",
-        "store_phone": tenant.contact_phone,
-        "transaction_date": transaction.created_at,
-        "items": transaction.items,
-        "subtotal": transaction.subtotal,
-        "discount_amount": transaction.discount_amount,
-        "total_amount": transaction.total_amount,
-        "payment_method": transaction.payment_method,
-        "customer_name": transaction.customer.name if transaction.customer else None,
-        "cashier_name": f"{current_user.first_name} {current_user.last_name}"
-    }
\ No newline at end of file
+    receipt = get_receipt_or_404(db, transaction_id, current_user.tenant_id)
+    return json.loads(receipt.data)
+
+@app.get("/api/v1/transactions/{transaction_id}/receipt/escpos")
+def get_receipt_escpos(
+    transaction_id: int,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """Raw ESC/POS bytes to send straight to a thermal printer."""
+    receipt = get_receipt_or_404(db, transaction_id, current_user.tenant_id)
+    return Response(content=receipt.escpos, media_type="application/octet-stream")
+
+@app.get("/api/v1/transactions/{transaction_id}/receipt/pdf")
+def get_receipt_pdf(
+    transaction_id: int,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """Receipt as a compact PDF (for email copies)."""
+    receipt = get_receipt_or_404(db, transaction_id, current_user.tenant_id)
+    return Response(
+        content=receipt.pdf,
+        media_type="application/pdf",
+        headers={"Content-Disposition": f'inline; filename="receipt-{transaction_id}.pdf"'}
+    )
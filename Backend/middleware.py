@@ -1,11 +1,12 @@
 """
-Custom middleware for logging and error handling
+Custom middleware for logging, error handling and request profiling
 """
 import time
 import logging
 from fastapi import Request, status
 from fastapi.responses import JSONResponse
 from starlette.middleware.base import BaseHTTPMiddleware
+import profiler
 
 logger = logging.getLogger(__name__)
 
@@ -43,3 +44,31 @@ class LoggingMiddleware(BaseHTTPMiddleware):
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 content={"detail": "Internal server error"}
             )
+
+class ProfilerMiddleware(BaseHTTPMiddleware):
+    """Profile requests that carry a valid X-Profile token (see profiler.py)"""
+    
+    async def dispatch(self, request: Request, call_next):
+        token = profiler.requested_token(request)
+        if not token or not profiler.authorized(token):
+            return await call_next(request)
+        
+        sampler = profiler.start()
+        if sampler is None:
+            response = await call_next(request)
+            response.headers["X-Profile"] = "throttled"
+            return response
+        
+        start_time = time.perf_counter()
+        status_code = 500
+        try:
+            response = await call_next(request)
+            status_code = response.status_code
+        finally:
+            name = profiler.finish(
+                sampler, request.method, request.url.path, status_code,
+                (time.perf_counter() - start_time) * 1000
+            )
+            logger.info(f"Profiled {request.method} {request.url.path} -> {name}")
+        response.headers["X-Profile-Id"] = name
+        return response
@@ -1,22 +1,53 @@
 """
 Database Migration Script
-This script migrates the database schema to support:
-1. category_id in products (instead of category string)
-2. customer_id and discount fields in transactions
-3. New customers and categories tables
+This script migrates the database schema. Steps, in the order they run:
+1. categories table
+2. customers table
+3. category_id in products (instead of category string)
+4. customer_id and discount fields in transactions
+5. created_at in transaction_items (partition key)
+6. Normalised phone and loyalty card columns on customers (unique per tenant)
+7. RFM scores and segment on customers
+8. reserved_quantity on products (cart stock holds)
+9. version and updated_at on products (atomic stock updates)
+10. group_id on tenants (multi-store owners)
+11. Store group owner and member approval
+12. Monthly partitioning of transactions (PostgreSQL)
+13. Composite (tenant_id, ...) indexes declared in models.py
+14. Keyset history index on transactions replaces the (tenant_id, created_at) one
+15. product_daily_sales rollup backfilled from transaction_items
 """
 from sqlalchemy import create_engine, text, inspect
 from sqlalchemy.orm import sessionmaker
 import database
+import models
+import partitions
+import rollups
+import customer_lookup
+
+def create_indexes(engine):
+    """
+    Create any index declared in models.py that is missing from the database
+    (create_all only adds indexes when it creates the table itself).
+    """
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        for table in models.Base.metadata.sorted_tables:
+            existing = {ix['name'] for ix in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing:
+                    print(f"Creating index {index.name}...")
+                    index.create(bind=conn)
 
 def migrate_database():
     """Run database migrations"""
     engine = database.engine
-    inspector = inspect(engine)
     
     with engine.connect() as conn:
         # Start transaction
         trans = conn.begin()
+        # Inspect through the same connection (SQLite allows one writer at a time)
+        inspector = inspect(conn)
         
         try:
             # 1. Create categories table if it doesn't exist
@@ -47,6 +78,13 @@ def migrate_database():
                         name VARCHAR NOT NULL,
                         email VARCHAR,
                         phone VARCHAR,
+                        phone_normalized VARCHAR,
+                        loyalty_card VARCHAR,
+                        rfm_recency INTEGER,
+                        rfm_frequency INTEGER,
+                        rfm_monetary INTEGER,
+                        segment VARCHAR,
+                        segment_updated_at TIMESTAMP,
                         address VARCHAR,
                         city VARCHAR,
                         state VARCHAR,
@@ -184,21 +222,155 @@ def migrate_database():
                     """))
                     print("✓ Added discount fields to transactions")
             
+            # 5. Add created_at to transaction_items (partition key, copied from transaction)
+            if 'transaction_items' in inspector.get_table_names():
+                item_columns = [col['name'] for col in inspector.get_columns('transaction_items')]
+                
+                if 'created_at' not in item_columns:
+                    print("Adding created_at to transaction_items...")
+                    conn.execute(text("""
+                        ALTER TABLE transaction_items 
+                        ADD COLUMN created_at TIMESTAMP;
+                    """))
+                    conn.execute(text("""
+                        UPDATE transaction_items 
+                        SET created_at = (
+                            SELECT t.created_at FROM transactions t 
+                            WHERE t.id = transaction_items.transaction_id
+                        );
+                    """))
+                    print("✓ Added created_at to transaction_items")
+            
+            # 6. Normalised phone and loyalty card for exact customer lookup
+            if 'customers' in inspector.get_table_names():
+                customer_columns = [col['name'] for col in inspector.get_columns('customers')]
+                
+                if 'phone_normalized' not in customer_columns:
+                    print("Adding phone_normalized and loyalty_card to customers...")
+                    conn.execute(text("ALTER TABLE customers ADD COLUMN phone_normalized VARCHAR"))
+                    conn.execute(text("ALTER TABLE customers ADD COLUMN loyalty_card VARCHAR"))
+                    
+                    # Only the oldest customer keeps a phone number shared within a tenant
+                    seen = set()
+                    duplicates = 0
+                    rows = conn.execute(text(
+                        "SELECT id, tenant_id, phone FROM customers WHERE phone IS NOT NULL ORDER BY id"
+                    ))
+                    for customer_id, tenant_id, phone in rows.fetchall():
+                        normalized = customer_lookup.normalize_phone(phone)
+                        if normalized is None:
+                            continue
+                        if (tenant_id, normalized) in seen:
+                            duplicates += 1
+                            continue
+                        seen.add((tenant_id, normalized))
+                        conn.execute(text(
+                            "UPDATE customers SET phone_normalized = :phone WHERE id = :id"
+                        ), {"phone": normalized, "id": customer_id})
+                    print("✓ Added phone_normalized and loyalty_card to customers")
+                    if duplicates:
+                        print(f"⚠ {duplicates} customers share a phone number with an older customer "
+                              f"and cannot be found by phone lookup until it is corrected")
+                
+                # 7. RFM scores and segment (filled by segments.py)
+                if 'segment' not in customer_columns:
+                    print("Adding RFM segment columns to customers...")
+                    for column in ("rfm_recency INTEGER", "rfm_frequency INTEGER", "rfm_monetary INTEGER",
+                                   "segment VARCHAR", "segment_updated_at TIMESTAMP"):
+                        conn.execute(text(f"ALTER TABLE customers ADD COLUMN {column}"))
+                    print("✓ Added RFM segment columns to customers")
+            
+            # 8. Quantity held by open carts (stock_reservations)
+            if 'products' in inspector.get_table_names():
+                product_columns = [col['name'] for col in inspector.get_columns('products')]
+                
+                if 'reserved_quantity' not in product_columns:
+                    print("Adding reserved_quantity to products...")
+                    conn.execute(text("""
+                        ALTER TABLE products 
+                        ADD COLUMN reserved_quantity INTEGER NOT NULL DEFAULT 0;
+                    """))
+                    print("✓ Added reserved_quantity to products")
+                
+                # 9. Row version for atomic, optimistic stock updates
+                if 'version' not in product_columns:
+                    print("Adding version and updated_at to products...")
+                    conn.execute(text("""
+                        ALTER TABLE products 
+                        ADD COLUMN version INTEGER NOT NULL DEFAULT 0;
+                    """))
+                    conn.execute(text("""
+                        ALTER TABLE products 
+                        ADD COLUMN updated_at TIMESTAMP;
+                    """))
+                    print("✓ Added version and updated_at to products")
+            
+            # 10. Store group of each tenant (consolidated multi-store reports)
+            if 'tenants' in inspector.get_table_names():
+                tenant_columns = [col['name'] for col in inspector.get_columns('tenants')]
+                
+                if 'group_id' not in tenant_columns:
+                    print("Adding group_id to tenants...")
+                    models.StoreGroup.__table__.create(bind=conn, checkfirst=True)
+                    conn.execute(text("""
+                        ALTER TABLE tenants 
+                        ADD COLUMN group_id INTEGER REFERENCES store_groups(id);
+                    """))
+                    print("✓ Added group_id to tenants")
+
+                # 11. Group owner and member approval (joining needs the owner's consent)
+                if 'group_approved' not in tenant_columns:
+                    print("Adding group owner and member approval...")
+                    group_columns = [col['name'] for col in inspect(conn).get_columns('store_groups')]
+                    if 'owner_user_id' not in group_columns:
+                        conn.execute(text("""
+                            ALTER TABLE store_groups
+                            ADD COLUMN owner_user_id INTEGER REFERENCES users(id);
+                        """))
+                    conn.execute(text("""
+                        ALTER TABLE tenants
+                        ADD COLUMN group_approved BOOLEAN NOT NULL DEFAULT FALSE;
+                    """))
+                    # Existing members stay in; the owner of each group's first store manages it
+                    conn.execute(text("UPDATE tenants SET group_approved = TRUE WHERE group_id IS NOT NULL"))
+                    conn.execute(text("""
+                        UPDATE store_groups SET owner_user_id = (
+                            SELECT u.id FROM users u JOIN tenants t ON t.id = u.tenant_id
+                            WHERE t.group_id = store_groups.id AND u.role = 'owner'
+                            ORDER BY t.id, u.id LIMIT 1
+                        ) WHERE owner_user_id IS NULL;
+                    """))
+                    print("✓ Added group owner and member approval (review existing members)")
+
             # Commit transaction
             trans.commit()
-            print("\n✅ Database migration completed successfully!")
-            return True
-            
         except Exception as e:
+            # Every step above checks before altering, so even "already exists" means
+            # this block hit an unexpected schema; it was rolled back as a whole and
+            # the steps below must not run on top of it
             trans.rollback()
-            # Check if error is because columns already exist
-            error_str = str(e).lower()
-            if 'already exists' in error_str or 'duplicate' in error_str:
-                print(f"\n✓ Migration already completed (columns exist)")
-                return True
-            else:
-                print(f"\n❌ Migration failed: {e}")
-                raise
+            print(f"\n❌ Migration failed (no schema changes applied): {e}")
+            raise
+    
+    # 12. Monthly partitions for transactions (PostgreSQL only)
+    partitions.setup_partitions(engine)
+    
+    # 13. Composite indexes for tenant-scoped queries
+    create_indexes(engine)
+    
+    # 14. (tenant_id, created_at, id) covers everything (tenant_id, created_at) served
+    with engine.begin() as conn:
+        if 'ix_transactions_tenant_id_created_at' in {ix['name'] for ix in inspect(conn).get_indexes('transactions')}:
+            conn.execute(text("DROP INDEX ix_transactions_tenant_id_created_at"))
+            print("✓ Dropped ix_transactions_tenant_id_created_at (superseded by the keyset index)")
+    
+    # 15. Product sales rollup for analytics (built once from existing sales)
+    with engine.begin() as conn:
+        if rollups.backfill_product_daily_sales(conn):
+            print("✓ Built product_daily_sales rollup from existing transactions")
+    
+    print("\n✅ Database migration completed successfully!")
+    return True
 
 if __name__ == "__main__":
     print("Starting database migration...\n")
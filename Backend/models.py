@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean, Float, event
+from sqlalchemy import Column, Integer, String, Text, LargeBinary, ForeignKey, DateTime, Date, Boolean, Float, Index, UniqueConstraint, event
 from sqlalchemy.orm import relationship
 from database import Base
 from datetime import datetime, timezone
@@ -8,6 +8,18 @@ def generate_store_code():
     """Generate a unique store code"""
     return str(uuid.uuid4())[:8].upper()
 
+class StoreGroup(Base):
+    """Stores run by the same owner, reported on together"""
+    __tablename__ = "store_groups"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, nullable=False)
+    join_code = Column(String, unique=True, nullable=False) # Single use; replaced when used or rotated
+    owner_user_id = Column(Integer, ForeignKey("users.id", use_alter=True, name="fk_store_groups_owner_user"), nullable=True) # Creator; approves and removes stores
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+    stores = relationship("Tenant", back_populates="group")
+
 class Tenant(Base):
     __tablename__ = "tenants"
 
@@ -25,12 +37,17 @@ class Tenant(Base):
     plan_id = Column(String, default="basic")
     subscription_status = Column(String, default="active")
     
+    # Multi-store owners
+    group_id = Column(Integer, ForeignKey("store_groups.id"), nullable=True, index=True)
+    group_approved = Column(Boolean, nullable=False, default=False) # Pending until the group owner approves
+    
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     
     users = relationship("User", back_populates="tenant")
     products = relationship("Product", back_populates="tenant")
     customers = relationship("Customer", back_populates="tenant")
     categories = relationship("Category", back_populates="tenant")
+    group = relationship("StoreGroup", back_populates="stores")
 
 class User(Base):
     __tablename__ = "users"
@@ -66,23 +83,36 @@ class Category(Base):
     tenant = relationship("Tenant", back_populates="categories")
     products = relationship("Product", back_populates="category")
 
+    __table_args__ = (
+        Index("ix_categories_tenant_id_name", tenant_id, name),
+    )
+
 class Product(Base):
     __tablename__ = "products"
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True, nullable=False)
     barcode = Column(String, index=True, nullable=True, unique=False)  # Allow duplicates for now
-    category_id = Column(Integer, ForeignKey("categories.id"), nullable=True)
+    category_id = Column(Integer, ForeignKey("categories.id"), nullable=True, index=True)
     category = relationship("Category", back_populates="products")
     
     cost_price = Column(Float)  
     selling_price = Column(Float, nullable=False) 
     stock_quantity = Column(Integer, default=0)
+    # Sum of active cart holds (stock_reservations); available = stock_quantity - reserved_quantity
+    reserved_quantity = Column(Integer, nullable=False, default=0)
+    # Bumped by every stock change (stock.py); clients send it back for optimistic updates
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
     
     min_stock_level = Column(Integer, default=5) 
     
     tenant_id = Column(Integer, ForeignKey("tenants.id"))
     tenant = relationship("Tenant", back_populates="products")
+
+    __table_args__ = (
+        Index("ix_products_tenant_id_barcode", tenant_id, barcode),
+    )
    
 # ... existing imports ...
 
@@ -93,12 +123,20 @@ class Customer(Base):
     name = Column(String, nullable=False, index=True)
     email = Column(String, nullable=True, index=True)
     phone = Column(String, nullable=True, index=True)
+    phone_normalized = Column(String, nullable=True)  # digits only, for exact lookup
+    loyalty_card = Column(String, nullable=True)
     address = Column(String, nullable=True)
     city = Column(String, nullable=True)
     state = Column(String, nullable=True)
     loyalty_points = Column(Integer, default=0)
     total_purchases = Column(Float, default=0.0)
     last_purchase_date = Column(DateTime, nullable=True)
+    # RFM scores (1-5, 0 = no purchases in the window) and segment, set by segments.py
+    rfm_recency = Column(Integer, nullable=True)
+    rfm_frequency = Column(Integer, nullable=True)
+    rfm_monetary = Column(Integer, nullable=True)
+    segment = Column(String, nullable=True)
+    segment_updated_at = Column(DateTime, nullable=True)
     
     tenant_id = Column(Integer, ForeignKey("tenants.id"))
     tenant = relationship("Tenant", back_populates="customers")
@@ -106,6 +144,13 @@ class Customer(Base):
     
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
 
+    __table_args__ = (
+        Index("ix_customers_tenant_id_name", tenant_id, name),
+        Index("ix_customers_tenant_id_phone_normalized", tenant_id, phone_normalized, unique=True),
+        Index("ix_customers_tenant_id_loyalty_card", tenant_id, loyalty_card, unique=True),
+        Index("ix_customers_tenant_id_segment", tenant_id, segment),
+    )
+
 class Transaction(Base):
     __tablename__ = "transactions"
 
@@ -127,6 +172,16 @@ class Transaction(Base):
     cashier = relationship("User", back_populates="transactions")
     customer = relationship("Customer", back_populates="transactions")
 
+    __table_args__ = (
+        # History pages (keyset on created_at, id); filter columns included so the page of
+        # ids is an index-only scan on PostgreSQL
+        Index(
+            "ix_transactions_tenant_id_created_at_id", tenant_id, created_at.desc(), id.desc(),
+            postgresql_include=["user_id", "customer_id", "payment_method"]
+        ),
+        Index("ix_transactions_tenant_id_customer_id_created_at", tenant_id, customer_id, created_at.desc(), id.desc()),
+    )
+
 # Event listener to auto-generate store_code if None
 @event.listens_for(Tenant, 'before_insert')
 def receive_before_insert(mapper, connection, target):
@@ -138,12 +193,130 @@ class TransactionItem(Base):
     __tablename__ = "transaction_items"
 
     id = Column(Integer, primary_key=True, index=True)
-    transaction_id = Column(Integer, ForeignKey("transactions.id"))
+    transaction_id = Column(Integer, ForeignKey("transactions.id"), index=True)
     product_id = Column(Integer, ForeignKey("products.id"))
     
     product_name = Column(String) # Snapshot of name at time of sale
     quantity = Column(Integer, nullable=False)
     unit_price = Column(Float, nullable=False) # Snapshot of price at time of sale
     total_price = Column(Float, nullable=False) # qty * unit_price
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc)) # Copy of transaction.created_at (partition key)
+    
+    transaction = relationship("Transaction", back_populates="items")
+
+class ProductDailySales(Base):
+    """Per-product, per-day sales rollup maintained at checkout (analytics source)"""
+    __tablename__ = "product_daily_sales"
+
+    id = Column(Integer, primary_key=True)
+    tenant_id = Column(Integer, ForeignKey("tenants.id"), nullable=False)
+    product_id = Column(Integer, nullable=False) # No FK: rollups outlive deleted products
+    day = Column(Date, nullable=False)
+    
+    quantity = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0.0) # Sum of line totals
+    cost = Column(Float, nullable=False, default=0.0) # Sum of qty * cost_price at time of sale
+
+    __table_args__ = (
+        UniqueConstraint("tenant_id", "product_id", "day", name="uq_product_daily_sales_tenant_product_day"),
+        Index("ix_product_daily_sales_tenant_id_day", tenant_id, day),
+    )
+
+class ProductForecast(Base):
+    """Demand forecast and reorder levels per product, rebuilt nightly by forecast.py"""
+    __tablename__ = "product_forecasts"
+
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), primary_key=True)
+    tenant_id = Column(Integer, ForeignKey("tenants.id"), nullable=False, index=True)
+
+    daily_demand = Column(Float, nullable=False) # Expected units per day over the next order cycle
+    demand_std = Column(Float, nullable=False) # Daily forecast error
+    reorder_point = Column(Integer, nullable=False) # Reorder when available stock is at or below this
+    order_up_to = Column(Integer, nullable=False) # Stock level an order should bring the product to
+    updated_at = Column(DateTime, nullable=False)
+
+class ProductAssociation(Base):
+    """Top products bought together with a product, rebuilt by associations.py"""
+    __tablename__ = "product_associations"
+
+    id = Column(Integer, primary_key=True)
+    tenant_id = Column(Integer, ForeignKey("tenants.id"), nullable=False)
+    product_id = Column(Integer, nullable=False) # No FK: the job replaces rows wholesale
+    related_product_id = Column(Integer, nullable=False)
+    rank = Column(Integer, nullable=False) # 0 = strongest
+
+    pair_count = Column(Integer, nullable=False) # Baskets containing both
+    support = Column(Float, nullable=False)
+    confidence = Column(Float, nullable=False)
+    lift = Column(Float, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_product_associations_tenant_id_product_id_rank", tenant_id, product_id, rank),
+    )
+
+class Receipt(Base):
+    """Pre-rendered receipt, cached by transaction id"""
+    __tablename__ = "receipts"
+
+    transaction_id = Column(Integer, primary_key=True) # No FK: transactions may be partitioned
+    tenant_id = Column(Integer, ForeignKey("tenants.id"), nullable=False)
     
-    transaction = relationship("Transaction", back_populates="items")    
\ No newline at end of file
+    data = Column(Text, nullable=False) # ReceiptData as JSON
+    escpos = Column(LargeBinary, nullable=False) # Thermal printer byte stream
+    pdf = Column(LargeBinary, nullable=False)
+    
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+class OutboxTask(Base):
+    """
+    Durable queue of post-commit side effects (see tasks.py).
+    Written in the same database transaction as the change that caused it.
+    """
+    __tablename__ = "outbox_tasks"
+
+    id = Column(Integer, primary_key=True)
+    task_type = Column(String, nullable=False)
+    payload = Column(Text, nullable=False) # JSON
+    status = Column(String, nullable=False, default="pending") # pending, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(String, nullable=True)
+    # Next time the task may be claimed; pushed forward while a worker holds it
+    available_at = Column(DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        Index("ix_outbox_tasks_status_available_at", status, available_at),
+    )
+
+class CatalogChange(Base):
+    """Compact product/category deltas streamed to open tills (see changefeed.py)"""
+    __tablename__ = "catalog_changes"
+
+    id = Column(Integer, primary_key=True) # Feed sequence number (SSE event id)
+    tenant_id = Column(Integer, ForeignKey("tenants.id"), nullable=False)
+    entity = Column(String, nullable=False) # product, category
+    op = Column(String, nullable=False) # upsert, stock, delete
+    data = Column(Text, nullable=False) # JSON delta
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), index=True)
+
+    __table_args__ = (
+        Index("ix_catalog_changes_tenant_id_id", tenant_id, id),
+        Index("ix_catalog_changes_tenant_id_entity_id", tenant_id, entity, id), # Category version token
+    )
+
+class StockReservation(Base):
+    """Quantity held for an open cart until it is checked out or expires (see reservations.py)"""
+    __tablename__ = "stock_reservations"
+
+    id = Column(Integer, primary_key=True)
+    tenant_id = Column(Integer, ForeignKey("tenants.id"), nullable=False)
+    cart_id = Column(String, nullable=False) # Chosen by the till
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), nullable=False)
+    quantity = Column(Integer, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        UniqueConstraint("tenant_id", "cart_id", "product_id", name="uq_stock_reservations_cart_product"),
+    )
@@ -0,0 +1,240 @@
+"""
+Monthly partitioning for transactions and transaction_items (PostgreSQL only).
+
+- setup_partitions(): one-time conversion of both tables to declarative
+  RANGE partitioning on created_at, then creation of upcoming monthly
+  partitions. Safe to run on every startup.
+- maintain_partitions(): the same check as a daily @tasks.periodic job, so
+  workers that run for months keep creating partitions ahead of time.
+- archive_partitions(): detaches partitions older than N months and moves
+  them to the `archive` schema, so hot queries only touch recent months.
+
+Partitions are named <table>_pYYYY_MM; rows outside every monthly range
+land in <table>_default. Every check creates the months of any such rows
+(and moves the rows in), so nothing stays in the default partition where
+archiving cannot see it.
+
+Partitioned tables cannot enforce the transaction_items -> transactions
+foreign key while still allowing partitions to be detached independently,
+so that link is maintained by the application only.
+
+Usage:
+    python partitions.py ensure
+    python partitions.py archive [--keep-months 24]
+"""
+import argparse
+import re
+from datetime import date
+from sqlalchemy import text
+import database
+import tasks
+from config import settings
+
+PARTITIONED_TABLES = ("transactions", "transaction_items")
+ARCHIVE_SCHEMA = "archive"
+PARTITION_NAME = re.compile(r"^(?P<table>\w+)_p(?P<year>\d{4})_(?P<month>\d{2})$")
+
+# Serializes partition maintenance between workers starting at the same time
+ADVISORY_LOCK_ID = 728_028
+
+def add_months(month_start: date, months: int) -> date:
+    """First day of the month `months` after month_start"""
+    index = month_start.year * 12 + (month_start.month - 1) + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def month_of(value) -> date:
+    return date(value.year, value.month, 1)
+
+def partition_name(table: str, month_start: date) -> str:
+    return f"{table}_p{month_start.year:04d}_{month_start.month:02d}"
+
+def is_partitioned(conn, table: str) -> bool:
+    return conn.execute(text("""
+        SELECT 1 FROM pg_partitioned_table p
+        JOIN pg_class c ON c.oid = p.partrelid
+        WHERE c.relname = :table AND c.relnamespace = 'public'::regnamespace
+    """), {"table": table}).first() is not None
+
+def list_partitions(conn, table: str):
+    """Return {month_start: partition_name} for attached monthly partitions"""
+    rows = conn.execute(text("""
+        SELECT child.relname FROM pg_inherits i
+        JOIN pg_class parent ON parent.oid = i.inhparent
+        JOIN pg_class child ON child.oid = i.inhrelid
+        WHERE parent.relname = :table AND parent.relnamespace = 'public'::regnamespace
+    """), {"table": table})
+    partitions = {}
+    for (name,) in rows:
+        match = PARTITION_NAME.match(name)
+        if match and match.group("table") == table:
+            partitions[date(int(match.group("year")), int(match.group("month")), 1)] = name
+    return partitions
+
+def create_month_partition(conn, table: str, month_start: date):
+    """
+    Create and attach the partition for one month. Rows for that month that
+    already sit in the default partition are moved into it first.
+    """
+    name = partition_name(table, month_start)
+    start = month_start.isoformat()
+    end = add_months(month_start, 1).isoformat()
+    conn.execute(text(f"""
+        CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+    """))
+    # No new rows for this month may reach the default partition before ATTACH
+    conn.execute(text(f"LOCK TABLE {table}_default IN SHARE ROW EXCLUSIVE MODE"))
+    conn.execute(text(f"""
+        WITH moved AS (
+            DELETE FROM {table}_default
+            WHERE created_at >= '{start}' AND created_at < '{end}'
+            RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    """))
+    conn.execute(text(f"""
+        ALTER TABLE {table} ATTACH PARTITION {name}
+        FOR VALUES FROM ('{start}') TO ('{end}')
+    """))
+    print(f"✓ Created partition {name}")
+
+def oldest_default_month(conn, table: str):
+    """Month of the oldest row stranded in <table>_default, or None"""
+    oldest = conn.execute(text(f"SELECT MIN(created_at) FROM {table}_default")).scalar()
+    return month_of(oldest) if oldest else None
+
+def ensure_partitions(conn, first_month: date = None, months_ahead: int = None):
+    """
+    Create any missing monthly partitions from first_month (default: this
+    month, or the oldest month with rows in the default partition) up to
+    months_ahead from now
+    """
+    if months_ahead is None:
+        months_ahead = settings.PARTITION_MONTHS_AHEAD
+    current = month_of(date.today())
+    last = add_months(current, months_ahead)
+    for table in PARTITIONED_TABLES:
+        existing = list_partitions(conn, table)
+        month = first_month or min(filter(None, (current, oldest_default_month(conn, table))))
+        while month <= last:
+            if month not in existing:
+                create_month_partition(conn, table, month)
+            month = add_months(month, 1)
+
+def convert_table(conn, table: str, primary_key: str):
+    """Swap a plain table for a RANGE(created_at) partitioned table with the same columns"""
+    old = f"{table}_unpartitioned"
+    sequence = conn.execute(
+        text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": table}
+    ).scalar()
+    conn.execute(text(f"ALTER TABLE {table} RENAME TO {old}"))
+    conn.execute(text(f"ALTER INDEX IF EXISTS {table}_pkey RENAME TO {old}_pkey"))
+    conn.execute(text(f"""
+        CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS, PRIMARY KEY ({primary_key}))
+        PARTITION BY RANGE (created_at)
+    """))
+    conn.execute(text(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT"))
+    if sequence:
+        # Keep the id sequence alive when the old table is dropped
+        conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id"))
+
+def setup_partitions(engine=None):
+    """Convert transactions/transaction_items to monthly partitions and create upcoming months"""
+    engine = engine or database.engine
+    if engine.dialect.name != "postgresql":
+        return False
+
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": ADVISORY_LOCK_ID})
+
+        if not is_partitioned(conn, "transactions"):
+            print("Partitioning transactions and transaction_items by month...")
+            conn.execute(text("""
+                UPDATE transactions SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL
+            """))
+            conn.execute(text("""
+                UPDATE transaction_items SET created_at = COALESCE(
+                    (SELECT t.created_at FROM transactions t WHERE t.id = transaction_items.transaction_id),
+                    CURRENT_TIMESTAMP
+                ) WHERE created_at IS NULL
+            """))
+            oldest = conn.execute(text("SELECT MIN(created_at) FROM transactions")).scalar()
+
+            convert_table(conn, "transactions", "id, created_at")
+            convert_table(conn, "transaction_items", "id, created_at")
+            ensure_partitions(conn, first_month=month_of(oldest) if oldest else None)
+
+            conn.execute(text("INSERT INTO transactions SELECT * FROM transactions_unpartitioned"))
+            conn.execute(text("INSERT INTO transaction_items SELECT * FROM transaction_items_unpartitioned"))
+            conn.execute(text("DROP TABLE transaction_items_unpartitioned"))
+            conn.execute(text("DROP TABLE transactions_unpartitioned CASCADE"))
+
+            conn.execute(text("""
+                ALTER TABLE transactions
+                    ADD FOREIGN KEY (tenant_id) REFERENCES tenants(id),
+                    ADD FOREIGN KEY (user_id) REFERENCES users(id),
+                    ADD FOREIGN KEY (customer_id) REFERENCES customers(id);
+                ALTER TABLE transaction_items
+                    ADD FOREIGN KEY (product_id) REFERENCES products(id);
+                CREATE INDEX ix_transactions_id ON transactions(id);
+                CREATE INDEX ix_transaction_items_id ON transaction_items(id);
+                CREATE INDEX ix_transaction_items_transaction_id ON transaction_items(transaction_id);
+            """))
+            print("✓ Transactions partitioned by month")
+        else:
+            ensure_partitions(conn)
+    return True
+
+@tasks.periodic(settings.PARTITION_CHECK_INTERVAL)
+def maintain_partitions(db):
+    """Create upcoming months (and months stranded in the default partition)"""
+    if db.get_bind().dialect.name != "postgresql":
+        return
+    conn = db.connection()
+    conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": ADVISORY_LOCK_ID})
+    if is_partitioned(conn, "transactions"):
+        ensure_partitions(conn)
+    db.commit()
+
+def archive_partitions(keep_months: int = None, engine=None):
+    """
+    Detach monthly partitions older than keep_months and move them to the
+    archive schema. Returns the list of archived partition names.
+    """
+    engine = engine or database.engine
+    if engine.dialect.name != "postgresql":
+        print("Partition archiving requires PostgreSQL")
+        return []
+    if keep_months is None:
+        keep_months = settings.ARCHIVE_KEEP_MONTHS
+    cutoff = add_months(month_of(date.today()), -keep_months)
+
+    archived = []
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": ADVISORY_LOCK_ID})
+        conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}"))
+        # Give rows stranded in the default partition their months first
+        ensure_partitions(conn)
+        # Detach items before their parent rows' partitions
+        for table in reversed(PARTITIONED_TABLES):
+            for month, name in sorted(list_partitions(conn, table).items()):
+                if month >= cutoff:
+                    continue
+                conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+                conn.execute(text(f"ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}"))
+                archived.append(name)
+                print(f"✓ Archived {name} -> {ARCHIVE_SCHEMA}.{name}")
+    return archived
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage monthly transaction partitions")
+    parser.add_argument("command", choices=["ensure", "archive"])
+    parser.add_argument("--keep-months", type=int, default=None,
+                        help="Months of history to keep attached (archive only)")
+    args = parser.parse_args()
+
+    if args.command == "ensure":
+        if not setup_partitions():
+            print("Partitioning requires PostgreSQL, nothing to do")
+    else:
+        names = archive_partitions(args.keep_months)
+        print(f"\n✅ Archived {len(names)} partition(s)")
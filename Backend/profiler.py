@@ -0,0 +1,148 @@
+"""
+Opt-in profiling of single requests.
+
+When PROFILER_ENABLED, a request sent with the header
+X-Profile: <PROFILER_TOKEN> runs under a sampling profiler and the result
+is saved to PROFILER_DIR; the response carries its name in X-Profile-Id.
+Without a PROFILER_TOKEN nothing is profiled. (The token is only accepted
+as a header, so it stays out of access logs.) A worker profiles one request at a time, at most PROFILER_RATE_PER_HOUR,
+and keeps the newest PROFILER_KEEP files.
+
+pyinstrument and cProfile only see the thread that started them, while
+FastAPI runs sync endpoints and dependencies on worker threads, so this
+samples every thread's stack (sys._current_frames) every
+PROFILER_INTERVAL_MS instead, keeping stacks that run code from this
+directory. It measures wall-clock time: a request waiting on the database
+shows up in execute(). Requests running at the same time appear too (each
+stack is rooted at its thread name).
+
+Profiles are collapsed stacks ("frame;frame;frame count" per line, after a
+JSON header line), readable by speedscope.app and flamegraph.pl.
+"""
+import hmac
+import json
+import os
+import secrets
+import sys
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from fastapi import Request
+from config import settings
+import ratelimit
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__)) + os.sep
+# The app's own background threads run app code while idle; they are not part of a request
+BACKGROUND_THREADS = {"outbox-worker", "changefeed-poller"}
+
+_active = threading.Lock()
+
+def requested_token(request: Request) -> str:
+    return request.headers.get("x-profile", "")
+
+def authorized(token: str) -> bool:
+    """Whether token unlocks profiling"""
+    if not settings.PROFILER_ENABLED or not settings.PROFILER_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token, settings.PROFILER_TOKEN)
+
+class Sampler(threading.Thread):
+    """Counts the application stacks of all threads until stop()"""
+
+    def __init__(self, interval_ms: float):
+        super().__init__(name="profiler", daemon=True)
+        self.interval = interval_ms / 1000
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        own = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                name = names.get(ident, str(ident))
+                if ident == own or name in BACKGROUND_THREADS:
+                    continue
+                stack, in_app = [], False
+                while frame is not None:
+                    code = frame.f_code
+                    in_app = in_app or code.co_filename.startswith(APP_DIR)
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if in_app:
+                    stack.append(name)
+                    self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+def start():
+    """A running Sampler, or None while another profile runs or the rate limit is spent"""
+    if not _active.acquire(blocking=False):
+        return None
+    if not ratelimit.allow("profile", "*", settings.PROFILER_RATE_PER_HOUR / 60, settings.PROFILER_BURST):
+        _active.release()
+        return None
+    sampler = Sampler(settings.PROFILER_INTERVAL_MS)
+    sampler.start()
+    return sampler
+
+def finish(sampler: Sampler, method: str, path: str, status_code: int, duration_ms: float) -> str:
+    """Stop sampling, save the profile and return its name"""
+    try:
+        sampler.stop()
+    finally:
+        _active.release()
+    now = datetime.now(timezone.utc)
+    slug = "".join(char if char.isalnum() else "_" for char in path.strip("/"))[:60]
+    name = f"{now:%Y%m%dT%H%M%S%f}-{method}-{slug}-{secrets.token_hex(3)}.folded"
+    header = {
+        "method": method,
+        "path": path,
+        "status": status_code,
+        "duration_ms": round(duration_ms, 1),
+        "samples": sampler.samples,
+        "interval_ms": settings.PROFILER_INTERVAL_MS,
+        "created_at": now.isoformat()
+    }
+    os.makedirs(settings.PROFILER_DIR, exist_ok=True)
+    with open(os.path.join(settings.PROFILER_DIR, name), "w") as f:
+        f.write(f"# {json.dumps(header)}\n")
+        for stack, count in sampler.stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    prune()
+    return name
+
+def profile_names():
+    """Saved profiles, newest first"""
+    if not os.path.isdir(settings.PROFILER_DIR):
+        return []
+    return sorted((name for name in os.listdir(settings.PROFILER_DIR) if name.endswith(".folded")), reverse=True)
+
+def prune():
+    for name in profile_names()[settings.PROFILER_KEEP:]:
+        try:
+            os.remove(os.path.join(settings.PROFILER_DIR, name))
+        except FileNotFoundError:
+            pass
+
+def list_profiles():
+    """Header of every saved profile (name, method, path, status, duration_ms, ...), newest first"""
+    profiles = []
+    for name in profile_names():
+        try:
+            with open(os.path.join(settings.PROFILER_DIR, name)) as f:
+                header = json.loads(f.readline()[2:])
+        except (OSError, ValueError):
+            continue
+        profiles.append({"name": name, **header})
+    return profiles
+
+def profile_path(name: str):
+    """Path of a saved profile, or None (names are only accepted as listed)"""
+    if name not in profile_names():
+        return None
+    return os.path.join(settings.PROFILER_DIR, name)
@@ -0,0 +1,110 @@
+"""
+Token-bucket rate limiting for the authentication endpoints.
+
+Login and signup spend ~100ms of CPU in bcrypt, so they are throttled
+before any hashing or database work: per client IP, per email address and
+per process (a ceiling that also catches attacks spread over many IPs and
+accounts). Buckets live in memory in each worker by default; a shared store
+can be plugged in with set_backend() (anything with the MemoryBackend.take
+and take_all signatures; take_all must be atomic). A request is only charged
+when every bucket allows it, so requests rejected for one bucket do not use
+up the others (a flood for one email does not spend its sender's IP budget). Throttled requests are counted and reported by stats().
+
+allow() is the same bucket for other features (e.g. request profiling).
+"""
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from fastapi import HTTPException, Request
+from config import settings
+
+class MemoryBackend:
+    """In-process buckets: key -> (tokens, last refill), least recently used evicted first"""
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, rate_per_second: float, capacity: float) -> float:
+        """Take one token; returns 0 if allowed, otherwise seconds until a token is available"""
+        return self.take_all([(key, rate_per_second, capacity)])[0]
+
+    def take_all(self, buckets) -> list:
+        """
+        Take one token from each (key, rate_per_second, capacity) bucket, or
+        from none of them unless every bucket has one. Returns the seconds
+        until each bucket has a token (all 0 if taken).
+        """
+        now = time.monotonic()
+        with self._lock:
+            levels = []
+            for key, rate_per_second, capacity in buckets:
+                tokens, last = self._buckets.get(key, (capacity, now))
+                levels.append(min(capacity, tokens + (now - last) * rate_per_second))
+            allowed = all(tokens >= 1 for tokens in levels)
+            retry_after = []
+            for (key, rate_per_second, _), tokens in zip(buckets, levels):
+                if allowed:
+                    tokens -= 1
+                self._buckets[key] = (tokens, now)
+                self._buckets.move_to_end(key)
+                retry_after.append(0.0 if tokens >= 1 or allowed else (1 - tokens) / rate_per_second)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return retry_after
+
+_backend = MemoryBackend()
+_counters = defaultdict(int)
+_counters_lock = threading.Lock()
+
+def set_backend(backend):
+    global _backend
+    _backend = backend
+
+def _count(name: str):
+    with _counters_lock:
+        _counters[name] += 1
+
+def stats():
+    """Counters since this process started, e.g. {'login.allowed': 10, 'login.throttled.ip': 3}"""
+    with _counters_lock:
+        return dict(_counters)
+
+def allow(name: str, key: str, per_minute: float, burst: int) -> bool:
+    """Take a token from the bucket name:key; counted as name.allowed / name.throttled"""
+    allowed = not _backend.take(f"{name}:{key}", per_minute / 60.0, burst)
+    _count(f"{name}.allowed" if allowed else f"{name}.throttled")
+    return allowed
+
+def client_ip(request: Request) -> str:
+    """Peer address, or X-Real-IP / X-Forwarded-For when the peer is a trusted proxy"""
+    host = request.client.host if request.client else "unknown"
+    if host in settings.TRUSTED_PROXIES:
+        forwarded = request.headers.get("x-real-ip") or request.headers.get("x-forwarded-for", "").split(",")[-1].strip()
+        if forwarded:
+            return forwarded
+    return host
+
+def limit_auth(request: Request, endpoint: str, email: str):
+    """Raise 429 (with Retry-After) if this IP, this email or this process is over its budget"""
+    if not settings.AUTH_RATE_LIMIT_ENABLED:
+        return
+    buckets = (
+        ("ip", client_ip(request), settings.AUTH_RATE_PER_IP, settings.AUTH_BURST_PER_IP),
+        ("email", (email or "").strip().lower(), settings.AUTH_RATE_PER_EMAIL, settings.AUTH_BURST_PER_EMAIL),
+        ("global", "*", settings.AUTH_RATE_GLOBAL, settings.AUTH_BURST_GLOBAL),
+    )
+    retry_after = _backend.take_all([
+        (f"{endpoint}:{dimension}:{key}", per_minute / 60.0, burst)
+        for dimension, key, per_minute, burst in buckets
+    ])
+    if any(retry_after):
+        dimension = next(bucket[0] for bucket, wait in zip(buckets, retry_after) if wait)
+        _count(f"{endpoint}.throttled.{dimension}")
+        raise HTTPException(
+            status_code=429,
+            detail="Too many attempts. Please wait and try again.",
+            headers={"Retry-After": str(int(max(retry_after)) + 1)}
+        )
+    _count(f"{endpoint}.allowed")
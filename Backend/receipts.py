@@ -0,0 +1,221 @@
+"""
+Receipt rendering and caching.
+
+A receipt is rendered once after the sale (JSON data, ESC/POS bytes for
+thermal printers and a compact PDF) and stored in the receipts table keyed by
+transaction id. Reprints and email copies are then a single primary-key read.
+"""
+import json
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+import models
+import database
+
+# Characters per line on an 80mm thermal printer (Font A)
+ESCPOS_WIDTH = 42
+PDF_WIDTH = 40
+FOOTER = ["Thank you for your business!", "Please come again!"]
+
+# ESC/POS control sequences
+ESC_INIT = b"\x1b@"
+ESC_ALIGN_LEFT = b"\x1ba\x00"
+ESC_ALIGN_CENTER = b"\x1ba\x01"
+ESC_BOLD_ON = b"\x1bE\x01"
+ESC_BOLD_OFF = b"\x1bE\x00"
+ESC_DOUBLE_HEIGHT = b"\x1b!\x10"
+ESC_NORMAL_SIZE = b"\x1b!\x00"
+GS_FEED_AND_CUT = b"\x1dV\x42\x03"
+
+def build_receipt_data(db, transaction_id: int, tenant_id: int):
+    """Load a transaction with everything the receipt needs in one query"""
+    transaction = db.query(models.Transaction).options(
+        joinedload(models.Transaction.items),
+        joinedload(models.Transaction.customer),
+        joinedload(models.Transaction.cashier).joinedload(models.User.tenant)
+    ).filter(
+        models.Transaction.id == transaction_id,
+        models.Transaction.tenant_id == tenant_id
+    ).first()
+    if not transaction:
+        return None
+
+    cashier = transaction.cashier
+    tenant = cashier.tenant if cashier else db.get(models.Tenant, tenant_id)
+    return {
+        "transaction_id": transaction.id,
+        "store_name": tenant.business_name,
+        "store_address": f"{tenant.address}, {tenant.city}, {tenant.state}",
+        "store_phone": tenant.contact_phone,
+        "transaction_date": transaction.created_at.isoformat(),
+        "items": [{
+            "id": item.id,
+            "product_id": item.product_id,
+            "product_name": item.product_name,
+            "quantity": item.quantity,
+            "unit_price": item.unit_price,
+            "total_price": item.total_price
+        } for item in transaction.items],
+        "subtotal": transaction.subtotal,
+        "discount_amount": transaction.discount_amount or 0.0,
+        "total_amount": transaction.total_amount,
+        "payment_method": transaction.payment_method,
+        "customer_name": transaction.customer.name if transaction.customer else None,
+        "cashier_name": f"{cashier.first_name} {cashier.last_name}" if cashier else None
+    }
+
+def _columns(left: str, right: str, width: int) -> str:
+    """Left text and right-aligned amount on one line, truncating the left side"""
+    space = width - len(right) - 1
+    return f"{left[:space]:<{space}} {right}"
+
+def receipt_lines(data: dict, width: int):
+    """
+    Lay the receipt out as (style, text) lines shared by every renderer.
+    style is one of: title, center, text, bold, rule
+    """
+    created = datetime.fromisoformat(data["transaction_date"])
+    lines = [
+        ("title", data["store_name"]),
+        ("center", data["store_address"]),
+        ("center", data["store_phone"]),
+        ("rule", "-" * width),
+        ("text", f"Date: {created.strftime('%Y-%m-%d %H:%M')}"),
+        ("text", f"Transaction #{data['transaction_id']}"),
+    ]
+    if data.get("customer_name"):
+        lines.append(("text", f"Customer: {data['customer_name']}"))
+    if data.get("cashier_name"):
+        lines.append(("text", f"Cashier: {data['cashier_name']}"))
+    lines.append(("rule", "-" * width))
+
+    for item in data["items"]:
+        lines.append(("text", _columns(
+            f"{item['product_name']} x{item['quantity']}", f"${item['total_price']:.2f}", width
+        )))
+    lines.append(("rule", "-" * width))
+
+    lines.append(("text", _columns("Subtotal:", f"${data['subtotal']:.2f}", width)))
+    if data["discount_amount"] > 0:
+        lines.append(("text", _columns("Discount:", f"-${data['discount_amount']:.2f}", width)))
+    lines.append(("bold", _columns("TOTAL:", f"${data['total_amount']:.2f}", width)))
+    lines.append(("text", f"Payment: {data['payment_method'].upper()}"))
+    lines.append(("rule", "-" * width))
+    lines.extend(("center", text) for text in FOOTER)
+    return lines
+
+def render_escpos(data: dict) -> bytes:
+    """Raw ESC/POS byte stream for an 80mm thermal printer"""
+    out = bytearray(ESC_INIT)
+    for style, text in receipt_lines(data, ESCPOS_WIDTH):
+        encoded = text.encode("cp437", errors="replace")
+        if style == "title":
+            out += ESC_ALIGN_CENTER + ESC_BOLD_ON + ESC_DOUBLE_HEIGHT + encoded + ESC_NORMAL_SIZE + ESC_BOLD_OFF
+        elif style == "center":
+            out += ESC_ALIGN_CENTER + encoded
+        elif style == "bold":
+            out += ESC_ALIGN_LEFT + ESC_BOLD_ON + encoded + ESC_BOLD_OFF
+        else:
+            out += ESC_ALIGN_LEFT + encoded
+        out += b"\n"
+    out += GS_FEED_AND_CUT
+    return bytes(out)
+
+def _pdf_escape(text: str) -> str:
+    text = text.encode("latin-1", errors="replace").decode("latin-1")
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def render_pdf(data: dict) -> bytes:
+    """Single-page PDF sized like an 80mm receipt roll, using the built-in Courier font"""
+    font_size, leading, margin = 8, 10, 12
+    lines = receipt_lines(data, PDF_WIDTH)
+    char_width = font_size * 0.6  # Courier advance width
+    page_width = int(PDF_WIDTH * char_width + 2 * margin)
+    page_height = len(lines) * leading + 2 * margin
+
+    content = []
+    y = page_height - margin - font_size
+    for style, text in lines:
+        font = "F2" if style in ("title", "bold") else "F1"
+        x = margin
+        if style in ("title", "center"):
+            x = margin + max(0, (PDF_WIDTH - len(text)) * char_width / 2)
+        content.append(f"BT /{font} {font_size} Tf {x:.1f} {y} Td ({_pdf_escape(text)}) Tj ET")
+        y -= leading
+    stream = "\n".join(content).encode("latin-1")
+
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_width} {page_height}] "
+         f"/Resources << /Font << /F1 4 0 R /F2 5 0 R >> >> /Contents 6 0 R >>").encode(),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Courier >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Courier-Bold >>",
+        b"<< /Length " + str(len(stream)).encode() + b" >>\nstream\n" + stream + b"\nendstream",
+    ]
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(pdf)
+    pdf += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        pdf += f"{offset:010d} 00000 n \n".encode()
+    pdf += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(pdf)
+
+def new_receipt(db, transaction_id: int, tenant_id: int):
+    """Render a receipt without storing it; None if the transaction does not exist"""
+    data = build_receipt_data(db, transaction_id, tenant_id)
+    if data is None:
+        return None
+    return models.Receipt(
+        transaction_id=transaction_id,
+        tenant_id=tenant_id,
+        data=json.dumps(data),
+        escpos=render_escpos(data),
+        pdf=render_pdf(data)
+    )
+
+def save_receipt(db, receipt):
+    """Store a rendered receipt; returns the cached row (existing or new)"""
+    db.add(receipt)
+    try:
+        db.commit()
+    except IntegrityError:
+        # Rendered concurrently by another request or the background task
+        db.rollback()
+        return get_cached_receipt(db, receipt.transaction_id, receipt.tenant_id)
+    return receipt
+
+def render_receipt(db, transaction_id: int, tenant_id: int):
+    """Render and cache a receipt; returns the cached row (existing or new)"""
+    receipt = new_receipt(db, transaction_id, tenant_id)
+    if receipt is None:
+        return None
+    return save_receipt(db, receipt)
+
+def get_cached_receipt(db, transaction_id: int, tenant_id: int):
+    return db.query(models.Receipt).filter(
+        models.Receipt.transaction_id == transaction_id,
+        models.Receipt.tenant_id == tenant_id
+    ).first()
+
+def get_or_render_receipt(db, transaction_id: int, tenant_id: int):
+    """
+    Cache read, rendering on a miss (e.g. the background task has not run yet).
+    db may be a read-only session (GET requests on SQLite), so a miss is
+    rendered from it and only stored through a writer session.
+    """
+    receipt = get_cached_receipt(db, transaction_id, tenant_id)
+    if receipt is not None:
+        return receipt
+    receipt = new_receipt(db, transaction_id, tenant_id)
+    if receipt is None:
+        return None
+    write_db = database.SessionLocal(expire_on_commit=False)
+    try:
+        return save_receipt(write_db, receipt)
+    finally:
+        write_db.close()
@@ -0,0 +1,130 @@
+"""
+Cart stock reservations (holds).
+
+A till may hold stock for the items in an open cart so that a busy promo
+SKU cannot sell out between scanning and payment. Each hold is a row in
+stock_reservations, and products.reserved_quantity carries the sum of the
+holds on that product, so availability is a single-row check
+(stock_quantity - reserved_quantity) and taking a hold is one conditional
+UPDATE that never oversubscribes, whichever worker handles the request.
+
+Holds slide forward every time the cart changes. Checkout releases the
+cart's holds in the same transaction as the sale; abandoned carts are
+released in bulk by a periodic sweep once they expire.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from sqlalchemy import bindparam, delete, update
+import database
+import models
+import tasks
+from config import settings
+
+def available_quantity(db, tenant_id: int, product_id: int):
+    P = models.Product
+    return db.query(P.stock_quantity - P.reserved_quantity).filter(
+        P.id == product_id,
+        P.tenant_id == tenant_id
+    ).scalar()
+
+def set_hold(db, tenant_id: int, cart_id: str, product_id: int, quantity: int):
+    """
+    Set the quantity held for one product in a cart (0 releases it) and extend
+    the cart's expiry. Commits on success. Returns (expires_at, None), or
+    (None, available) if the product cannot cover the additional quantity.
+    """
+    SR, P = models.StockReservation, models.Product
+    expires_at = database.utcnow() + timedelta(seconds=settings.CART_HOLD_TTL_SECONDS)
+    hold = db.query(SR).filter(
+        SR.tenant_id == tenant_id,
+        SR.cart_id == cart_id,
+        SR.product_id == product_id
+    ).with_for_update().first()
+    held = hold.quantity if hold else 0
+    delta = quantity - held
+
+    if delta:
+        stmt = update(P).where(P.id == product_id, P.tenant_id == tenant_id)
+        if delta > 0:
+            stmt = stmt.where(P.stock_quantity - P.reserved_quantity >= delta)
+        result = db.execute(
+            stmt.values(reserved_quantity=P.reserved_quantity + delta),
+            execution_options={"synchronize_session": False}
+        )
+        if result.rowcount != 1:
+            db.rollback()
+            available = available_quantity(db, tenant_id, product_id) or 0
+            return None, max(available + held, 0)
+
+    if quantity == 0:
+        if hold:
+            db.delete(hold)
+    elif hold:
+        hold.quantity = quantity
+    else:
+        db.add(SR(
+            tenant_id=tenant_id,
+            cart_id=cart_id,
+            product_id=product_id,
+            quantity=quantity,
+            expires_at=expires_at
+        ))
+    db.flush()
+    db.execute(
+        update(SR).where(SR.tenant_id == tenant_id, SR.cart_id == cart_id).values(expires_at=expires_at),
+        execution_options={"synchronize_session": False}
+    )
+    db.commit()
+    return expires_at, None
+
+def cart_holds(db, tenant_id: int, cart_id: str):
+    """(reservation, available) for every hold in a cart"""
+    SR, P = models.StockReservation, models.Product
+    return db.query(SR, P.stock_quantity - P.reserved_quantity).join(
+        P, P.id == SR.product_id
+    ).filter(
+        SR.tenant_id == tenant_id,
+        SR.cart_id == cart_id
+    ).order_by(SR.id).all()
+
+def _release(db, rows):
+    """Give the quantities of deleted holds back to their products"""
+    totals = defaultdict(int)
+    for product_id, quantity in rows:
+        totals[product_id] += quantity
+    if not totals:
+        return
+    products = models.Product.__table__
+    db.execute(
+        products.update().where(products.c.id == bindparam("b_id")).values(
+            reserved_quantity=products.c.reserved_quantity - bindparam("b_quantity")
+        ),
+        [{"b_id": product_id, "b_quantity": quantity} for product_id, quantity in totals.items()]
+    )
+
+def release_cart(db, tenant_id: int, cart_id: str):
+    """
+    Drop every hold of a cart inside the caller's transaction (no commit).
+    Returns {product_id: quantity released}.
+    """
+    SR = models.StockReservation
+    rows = db.execute(delete(SR).where(
+        SR.tenant_id == tenant_id,
+        SR.cart_id == cart_id
+    ).returning(SR.product_id, SR.quantity)).all()
+    _release(db, rows)
+    released = defaultdict(int)
+    for product_id, quantity in rows:
+        released[product_id] += quantity
+    return dict(released)
+
+@tasks.periodic(settings.CART_HOLD_SWEEP_INTERVAL)
+def sweep_expired(db):
+    """Release all expired holds in one statement per table"""
+    SR = models.StockReservation
+    rows = db.execute(delete(SR).where(
+        SR.expires_at < database.utcnow()
+    ).returning(SR.product_id, SR.quantity)).all()
+    _release(db, rows)
+    db.commit()
+    return len(rows)
@@ -0,0 +1,92 @@
+"""
+Sales rollups used by the analytics endpoints.
+product_daily_sales holds one row per (tenant, product, day) so product and
+category reports never have to scan transaction_items.
+"""
+from collections import defaultdict
+from sqlalchemy import func, select, insert
+import models
+
+def _upsert(dialect_name):
+    """Dialect-specific INSERT supporting ON CONFLICT (PostgreSQL, SQLite)"""
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return None
+    return dialect_insert
+
+def record_sale(db, tenant_id, day, lines):
+    """
+    Add a sale to the daily rollup.
+    lines: iterable of (product_id, quantity, revenue, cost) where revenue is
+    net of the transaction discount (allocated pro rata to line totals).
+    """
+    totals = defaultdict(lambda: [0, 0.0, 0.0])
+    for product_id, quantity, revenue, cost in lines:
+        entry = totals[product_id]
+        entry[0] += quantity
+        entry[1] += revenue
+        entry[2] += cost
+    if not totals:
+        return
+
+    rows = [{
+        "tenant_id": tenant_id,
+        "product_id": product_id,
+        "day": day,
+        "quantity": quantity,
+        "revenue": revenue,
+        "cost": cost
+    } for product_id, (quantity, revenue, cost) in totals.items()]
+
+    table = models.ProductDailySales.__table__
+    dialect_insert = _upsert(db.get_bind().dialect.name)
+    if dialect_insert is not None:
+        stmt = dialect_insert(table).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["tenant_id", "product_id", "day"],
+            set_={
+                "quantity": table.c.quantity + stmt.excluded.quantity,
+                "revenue": table.c.revenue + stmt.excluded.revenue,
+                "cost": table.c.cost + stmt.excluded.cost
+            }
+        )
+        db.execute(stmt)
+        return
+
+    # Generic fallback: update, then insert when no row exists yet
+    for row in rows:
+        updated = db.execute(table.update().where(
+            table.c.tenant_id == row["tenant_id"],
+            table.c.product_id == row["product_id"],
+            table.c.day == row["day"]
+        ).values(
+            quantity=table.c.quantity + row["quantity"],
+            revenue=table.c.revenue + row["revenue"],
+            cost=table.c.cost + row["cost"]
+        ))
+        if updated.rowcount == 0:
+            db.execute(insert(table).values(**row))
+
+def backfill_product_daily_sales(conn):
+    """Build the rollup from existing transaction_items (only when it is empty)"""
+    if conn.execute(select(func.count()).select_from(models.ProductDailySales)).scalar():
+        return False
+    T, I, P = models.Transaction, models.TransactionItem, models.Product
+    day = func.date(T.created_at)
+    source = select(
+        T.tenant_id,
+        I.product_id,
+        day,
+        func.sum(I.quantity),
+        func.sum(I.total_price * func.coalesce(T.total_amount / func.nullif(T.subtotal, 0), 1.0)),
+        func.sum(I.quantity * func.coalesce(P.cost_price, 0.0))
+    ).select_from(I).join(T, T.id == I.transaction_id).outerjoin(
+        P, P.id == I.product_id
+    ).where(I.product_id.isnot(None)).group_by(T.tenant_id, I.product_id, day)
+    result = conn.execute(insert(models.ProductDailySales).from_select(
+        ["tenant_id", "product_id", "day", "quantity", "revenue", "cost"], source
+    ))
+    return result.rowcount > 0
@@ -1,15 +1,74 @@
 """
 Production server runner
 Usage: python run.py
+
+In production (ENVIRONMENT=production or WEB_CONCURRENCY > 1) the app is
+served by several worker processes. Gunicorn with uvicorn workers is used
+when installed (graceful restarts via `kill -HUP <master pid>`), otherwise
+uvicorn's own --workers mode. Each worker sizes its database pool from
+DB_MAX_CONNECTIONS / WEB_CONCURRENCY (see database.pool_limits).
 """
+import os
 import uvicorn
 from config import settings
 
-if __name__ == "__main__":
+def run_gunicorn():
+    """Serve the app with gunicorn managing uvicorn workers"""
+    from gunicorn.app.base import BaseApplication
+
+    class GunicornApp(BaseApplication):
+        def __init__(self, options):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from main import app
+            return app
+
+    options = {
+        "bind": f"{settings.HOST}:{settings.PORT}",
+        "workers": settings.WORKERS,
+        "worker_class": "uvicorn.workers.UvicornWorker",
+        "graceful_timeout": settings.GRACEFUL_TIMEOUT,
+        "timeout": settings.GRACEFUL_TIMEOUT * 2,
+        "max_requests": settings.MAX_REQUESTS,
+        "max_requests_jitter": settings.MAX_REQUESTS // 10,
+        "loglevel": "info",
+    }
+    GunicornApp(options).run()
+
+def run_uvicorn_workers():
+    """Serve the app with uvicorn's built-in process manager"""
     uvicorn.run(
         "main:app",
         host=settings.HOST,
         port=settings.PORT,
-        reload=settings.DEBUG and settings.ENVIRONMENT == "development",
-        log_level="info" if settings.ENVIRONMENT == "production" else "debug"
+        workers=settings.WORKERS,
+        timeout_graceful_shutdown=settings.GRACEFUL_TIMEOUT,
+        limit_max_requests=settings.MAX_REQUESTS or None,
+        log_level="info"
     )
+
+if __name__ == "__main__":
+    if settings.ENVIRONMENT == "production" or settings.WORKERS > 1:
+        # Workers read WEB_CONCURRENCY to size their DB pools
+        os.environ["WEB_CONCURRENCY"] = str(settings.WORKERS)
+        try:
+            import gunicorn  # noqa: F401
+        except ImportError:
+            # Gunicorn is not available on Windows
+            run_uvicorn_workers()
+        else:
+            run_gunicorn()
+    else:
+        uvicorn.run(
+            "main:app",
+            host=settings.HOST,
+            port=settings.PORT,
+            reload=settings.DEBUG and settings.ENVIRONMENT == "development",
+            log_level="info" if settings.ENVIRONMENT == "production" else "debug"
+        )
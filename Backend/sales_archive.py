@@ -0,0 +1,224 @@
+"""
+Columnar archive of old sales.
+
+archive_sales() moves closed months older than ARCHIVE_KEEP_MONTHS out of
+the live transactions/transaction_items tables into zstd-compressed Parquet
+files, one pair per store and month:
+
+    <SALES_ARCHIVE_DIR>/<tenant_id>/<YYYY-MM>/transactions.parquet
+    <SALES_ARCHIVE_DIR>/<tenant_id>/<YYYY-MM>/transaction_items.parquet
+
+The files are published just before the transaction that deletes the rows
+commits, so a sale is always in at least one place. If that commit fails (or
+the process dies first) a sale is both archived and live until the next run
+re-archives the month, merging with the files by id; aggregate() skips
+archived ids that are still live, so reports never count it twice. Receipts
+and the product_daily_sales rollup are kept, so reprints and product and
+category reports are unaffected.
+
+Sales reports over ranges that reach archived months call aggregate(),
+which reads only the needed columns of the matching files through memory
+maps (filtered to the range) and groups them with Arrow compute.
+
+Usage:
+    python sales_archive.py                  # every store
+    python sales_archive.py --tenant 12 --keep-months 12
+"""
+import argparse
+import os
+from datetime import date, datetime, timedelta, timezone
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from sqlalchemy import Date, DateTime, Float, Integer, delete, func, or_, select
+import database
+import models
+from config import settings
+from partitions import add_months, month_of
+
+TABLES = (models.Transaction.__table__, models.TransactionItem.__table__)
+ARROW_TYPES = {Integer: pa.int64(), Float: pa.float64(), DateTime: pa.timestamp("us"), Date: pa.date32()}
+
+def arrow_schema(table):
+    """Arrow schema matching a SQLAlchemy table (strings for anything else)"""
+    return pa.schema([
+        (column.name, next(
+            (arrow_type for sql_type, arrow_type in ARROW_TYPES.items() if isinstance(column.type, sql_type)),
+            pa.string()
+        )) for column in table.columns
+    ])
+
+def month_dir(tenant_id: int, month: date) -> str:
+    return os.path.join(settings.SALES_ARCHIVE_DIR, str(tenant_id), f"{month.year:04d}-{month.month:02d}")
+
+def archived_months(tenant_id: int):
+    """Months archived for a store, oldest first"""
+    root = os.path.join(settings.SALES_ARCHIVE_DIR, str(tenant_id))
+    if not os.path.isdir(root):
+        return []
+    months = []
+    for name in os.listdir(root):
+        if os.path.exists(os.path.join(root, name, "transactions.parquet")):
+            year, month = name.split("-")
+            months.append(date(int(year), int(month), 1))
+    return sorted(months)
+
+# ==========================================
+# EXPORT
+# ==========================================
+
+def _write(path: str, rows, schema):
+    """Write rows, merged with those already archived at path (by id), to path + '.tmp'"""
+    columns = list(zip(*rows)) if rows else [[] for _ in schema]
+    table = pa.table([pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema)
+    if os.path.exists(path):
+        earlier = pq.read_table(path, schema=schema)
+        keep = pc.invert(pc.is_in(earlier["id"], value_set=table["id"]))
+        table = pa.concat_tables([earlier.filter(keep), table]).sort_by([("created_at", "ascending"), ("id", "ascending")])
+    pq.write_table(table, path + ".tmp", compression="zstd")
+    if pq.ParquetFile(path + ".tmp").metadata.num_rows != table.num_rows:
+        raise RuntimeError(f"Archive file {path} failed verification")
+    return table.num_rows
+
+def export_month(engine, tenant_id: int, month: date):
+    """Archive one store's month; returns the number of transactions moved"""
+    T, I = TABLES
+    start = datetime.combine(month, datetime.min.time())
+    end = datetime.combine(add_months(month, 1), datetime.min.time())
+    in_month = (T.c.tenant_id == tenant_id, T.c.created_at >= start, T.c.created_at < end)
+    transaction_ids = select(T.c.id).where(*in_month)
+    # created_at on items (a copy of the sale's) prunes partitions
+    item_filter = (I.c.transaction_id.in_(transaction_ids), I.c.created_at >= start, I.c.created_at < end)
+
+    directory = month_dir(tenant_id, month)
+    paths = [os.path.join(directory, f"{table.name}.parquet") for table in TABLES]
+
+    with engine.begin() as conn:
+        transactions = conn.execute(select(T).where(*in_month).order_by(T.c.created_at, T.c.id)).all()
+        if not transactions:
+            return 0
+        items = conn.execute(select(I).where(*item_filter).order_by(I.c.created_at, I.c.id)).all()
+        os.makedirs(directory, exist_ok=True)
+        for path, table, rows in zip(paths, TABLES, (transactions, items)):
+            _write(path, rows, arrow_schema(table))
+
+        conn.execute(delete(I).where(*item_filter))
+        conn.execute(delete(T).where(*in_month))
+        # Publish the files just before commit (items first, so a sales file is
+        # never newer than its items); a failed commit leaves both copies, which
+        # aggregate() de-duplicates and the next run merges by id
+        for path in reversed(paths):
+            os.replace(path + ".tmp", path)
+    return len(transactions)
+
+def archive_sales(keep_months: int = None, tenant_id: int = None, engine=None):
+    """Archive every closed month older than keep_months; returns {(tenant_id, month): transactions}"""
+    engine = engine or database.engine
+    if keep_months is None:
+        keep_months = settings.ARCHIVE_KEEP_MONTHS
+    cutoff = add_months(month_of(date.today()), -keep_months)
+    T = models.Transaction
+
+    query = select(T.tenant_id, func.min(T.created_at)).where(
+        T.created_at < datetime.combine(cutoff, datetime.min.time())
+    ).group_by(T.tenant_id)
+    if tenant_id is not None:
+        query = query.where(T.tenant_id == tenant_id)
+    with engine.connect() as conn:
+        oldest = conn.execute(query).all()
+
+    archived = {}
+    for store, first_sale in oldest:
+        month = month_of(first_sale)
+        while month < cutoff:
+            moved = export_month(engine, store, month)
+            if moved:
+                archived[(store, month)] = moved
+                print(f"✓ Archived {moved} transactions of store {store} for {month:%Y-%m}")
+            month = add_months(month, 1)
+    return archived
+
+# ==========================================
+# QUERY PATH
+# ==========================================
+
+GROUP_KEYS = {"day", "payment_method", "user_id", "weekday", "hour"}
+
+def aggregate(db, tenant_id: int, utc_start: datetime, utc_end: datetime, keys, tz_offset: int = 0):
+    """
+    Archived transactions of a store in [utc_start, utc_end), except any still
+    in the live table (read through db, the session of the caller's live
+    query), grouped by
+    `keys` (any of day, payment_method, user_id, weekday (0 = Monday), hour;
+    day/weekday/hour in local time, tz_offset minutes east of UTC). Returns
+    {key tuple: [transaction_count, total_sales, discount_total]}, empty when
+    no archived month overlaps the range.
+    """
+    assert set(keys) <= GROUP_KEYS
+    utc_start, utc_end = (
+        value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value
+        for value in (utc_start, utc_end)
+    )
+    months = [
+        (month, max(utc_start, datetime.combine(month, datetime.min.time())),
+         min(utc_end, datetime.combine(add_months(month, 1), datetime.min.time())))
+        for month in archived_months(tenant_id)
+    ]
+    months = [(month, start, end) for month, start, end in months if start < end]
+    if not months:
+        return {}
+
+    # Normally none: only left behind when an archive run failed to commit
+    T = models.Transaction
+    live_ids = db.execute(select(T.id).where(T.tenant_id == tenant_id, or_(*(
+        (T.created_at >= start) & (T.created_at < end) for _, start, end in months
+    )))).scalars().all()
+
+    paths = [os.path.join(month_dir(tenant_id, month), "transactions.parquet") for month, _, _ in months]
+    columns = ["id", "created_at", "total_amount", "discount_amount"] + [
+        key for key in keys if key in ("payment_method", "user_id")
+    ]
+    table = pa.concat_tables([
+        pq.read_table(path, columns=columns, memory_map=True, filters=[
+            ("created_at", ">=", utc_start), ("created_at", "<", utc_end)
+        ]) for path in paths
+    ])
+    if live_ids:
+        table = table.filter(pc.invert(pc.is_in(table["id"], value_set=pa.array(live_ids, pa.int64()))))
+    local = pc.add(table["created_at"], pa.scalar(timedelta(minutes=tz_offset), pa.duration("us")))
+    derived = {
+        "day": lambda: pc.cast(local, pa.date32()),
+        "weekday": lambda: pc.day_of_week(local),
+        "hour": lambda: pc.hour(local),
+    }
+    for key in keys:
+        if key in derived:
+            table = table.append_column(key, derived[key]())
+
+    grouped = table.group_by(list(keys)).aggregate([
+        ("total_amount", "count"), ("total_amount", "sum"), ("discount_amount", "sum")
+    ]).to_pylist()
+    return {
+        tuple(row[key] for key in keys): [
+            row["total_amount_count"], row["total_amount_sum"] or 0.0, row["discount_amount_sum"] or 0.0
+        ] for row in grouped
+    }
+
+def merge_into(totals, archived):
+    """Add aggregate() results to live {key: [count, total, discount]} totals in place"""
+    for key, (count, total, discount) in archived.items():
+        entry = totals.setdefault(key, [0, 0.0, 0.0])
+        entry[0] += count
+        entry[1] += total
+        entry[2] += discount
+    return totals
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move old sales to Parquet files")
+    parser.add_argument("--tenant", type=int, default=None, help="Only this tenant id")
+    parser.add_argument("--keep-months", type=int, default=None,
+                        help="Months of history to keep in the database")
+    args = parser.parse_args()
+
+    archived = archive_sales(args.keep_months, args.tenant)
+    print(f"\n✅ Archived {sum(archived.values())} transactions in {len(archived)} store-month(s)")
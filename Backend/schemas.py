@@ -136,15 +136,55 @@ class ProductUpdate(BaseModel):
     selling_price: Optional[float] = None
     stock_quantity: Optional[int] = None
     min_stock_level: Optional[int] = None
+    version: Optional[int] = None  # Expected version; 409 if the product changed since it was read
 
 class ProductResponse(ProductBase):
     id: int
     tenant_id: int
+    version: int = 0
     category_name: Optional[str] = None
 
     class Config:
         from_attributes = True
 
+class StockAdjustmentLine(BaseModel):
+    product_id: int
+    delta: int  # Positive when receiving stock, negative for write-offs
+    version: Optional[int] = None
+
+class StockAdjustmentRequest(BaseModel):
+    lines: List[StockAdjustmentLine]
+
+class StockLevel(BaseModel):
+    product_id: int
+    stock_quantity: int
+    version: int
+
+class ReorderSuggestion(BaseModel):
+    product_id: int
+    product_name: str
+    barcode: Optional[str] = None
+    category_name: Optional[str] = None
+    stock_quantity: int
+    available: int  # Stock not held by open carts
+    min_stock_level: Optional[int] = None
+    daily_demand: float
+    reorder_point: int
+    order_up_to: int
+    suggested_quantity: int
+    days_of_cover: float
+    forecast_updated_at: datetime
+
+class ProductAssociationResponse(BaseModel):
+    product_id: int
+    product_name: str
+    barcode: Optional[str] = None
+    selling_price: float
+    stock_quantity: int
+    pair_count: int
+    confidence: float
+    lift: float
+
 # ==========================================
 # CUSTOMER SCHEMAS
 # ==========================================
@@ -153,6 +193,7 @@ class CustomerBase(BaseModel):
     name: str
     email: Optional[str] = None
     phone: Optional[str] = None
+    loyalty_card: Optional[str] = None
     address: Optional[str] = None
     city: Optional[str] = None
     state: Optional[str] = None
@@ -164,6 +205,7 @@ class CustomerUpdate(BaseModel):
     name: Optional[str] = None
     email: Optional[str] = None
     phone: Optional[str] = None
+    loyalty_card: Optional[str] = None
     address: Optional[str] = None
     city: Optional[str] = None
     state: Optional[str] = None
@@ -174,11 +216,21 @@ class CustomerResponse(CustomerBase):
     loyalty_points: int
     total_purchases: float
     last_purchase_date: Optional[datetime] = None
+    rfm_recency: Optional[int] = None
+    rfm_frequency: Optional[int] = None
+    rfm_monetary: Optional[int] = None
+    segment: Optional[str] = None
     created_at: datetime
 
     class Config:
         from_attributes = True
 
+class CustomerSegmentSummary(BaseModel):
+    segment: str
+    customer_count: int
+    total_purchases: float
+    updated_at: Optional[datetime] = None
+
 # ==========================================
 # TRANSACTION SCHEMAS
 # ==========================================
@@ -195,8 +247,18 @@ class TransactionCreate(BaseModel):
     customer_id: Optional[int] = None
     discount_type: Optional[str] = None  # 'percentage' or 'fixed'
     discount_value: Optional[float] = None
+    cart_id: Optional[str] = None  # Converts this cart's stock holds into the sale
     # Total is calculated on backend for security
 
+class HoldRequest(BaseModel):
+    quantity: int  # 0 releases the hold
+
+class HoldResponse(BaseModel):
+    product_id: int
+    quantity: int
+    expires_at: Optional[datetime] = None
+    available: int  # Still available to other carts
+
 class TransactionItemResponse(BaseModel):
     id: int
     product_id: int
@@ -249,6 +311,106 @@ class SalesAnalytics(BaseModel):
     total_sales: float
     transaction_count: int
 
+# ==========================================
+# STORE GROUP (MULTI-STORE) SCHEMAS
+# ==========================================
+
+class StoreGroupCreate(BaseModel):
+    name: str
+
+class StoreGroupJoin(BaseModel):
+    join_code: str
+
+class StoreSummary(BaseModel):
+    tenant_id: int
+    business_name: str
+    city: Optional[str] = None
+    approved: bool = True
+
+class StoreGroupResponse(BaseModel):
+    id: int
+    name: str
+    is_owner: bool
+    approved: bool  # Whether the current store's membership is approved
+    join_code: Optional[str] = None  # Shown to the group owner only
+    stores: List[StoreSummary]
+
+class StoreDashboard(DashboardStats):
+    tenant_id: int
+    business_name: str
+
+class ConsolidatedDashboard(BaseModel):
+    totals: DashboardStats
+    stores: List[StoreDashboard]
+
+class StoreSalesTotal(BaseModel):
+    tenant_id: int
+    business_name: str
+    total_sales: float
+    transaction_count: int
+
+class ConsolidatedSales(BaseModel):
+    daily: List[SalesAnalytics]
+    stores: List[StoreSalesTotal]
+
+class ProductPerformance(BaseModel):
+    product_id: int
+    product_name: str
+    category_name: Optional[str] = None
+    quantity_sold: int
+    revenue: float
+    cost: float
+    margin: float
+
+class CategoryPerformance(BaseModel):
+    category_id: Optional[int] = None
+    category_name: str
+    product_count: int
+    quantity_sold: int
+    revenue: float
+    cost: float
+    margin: float
+    revenue_share: float
+
+class PaymentMethodSales(BaseModel):
+    payment_method: Optional[str]  # None for sales recorded without one
+    transaction_count: int
+    total_sales: float
+    discount_total: float
+    average_sale: float
+
+class CashierSales(BaseModel):
+    user_id: Optional[int]  # None for sales without a cashier ("Unknown")
+    cashier_name: str
+    transaction_count: int
+    total_sales: float
+    average_sale: float
+
+class SalesHeatmapCell(BaseModel):
+    weekday: int  # 0 = Monday ... 6 = Sunday
+    hour: int  # 0-23, store local time
+    transaction_count: int
+    total_sales: float
+
+class CategoryValuation(BaseModel):
+    category_id: Optional[int] = None
+    category_name: str
+    product_count: int
+    units: int
+    cost_value: float
+    retail_value: float
+    potential_margin: float
+    margin_percent: float  # Of retail value
+
+class InventoryValuation(BaseModel):
+    product_count: int
+    units: int
+    cost_value: float
+    retail_value: float
+    potential_margin: float
+    margin_percent: float
+    categories: List[CategoryValuation]
+
 # ==========================================
 # RECEIPT SCHEMAS
 # ==========================================
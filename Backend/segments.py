@@ -0,0 +1,287 @@
+"""
+RFM customer segmentation (batch job).
+
+Scores every customer 1-5 on Recency (days since last purchase), Frequency
+(number of purchases) and Monetary value (amount spent) over the last
+SEGMENT_WINDOW_DAYS, relative to the other customers of the same store, and
+stores the scores and a segment label on the customer.
+
+The database aggregates the window's purchases per customer (GROUP BY) and
+returns them with the customers in one query ordered by store. On
+PostgreSQL that result is COPYed to a temporary file and streamed back in
+blocks by pyarrow's CSV reader. Stores are then scored one at a time with
+vectorised NumPy code, and only customers whose result changed are written
+back, in bulk, in one transaction per store.
+
+Usage:
+    python segments.py              # score all stores
+    python segments.py --tenant 12  # one store
+"""
+import argparse
+import io
+import tempfile
+import time
+from collections import Counter
+from datetime import timedelta
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+from sqlalchemy import Float, bindparam, cast, extract, func, select, text
+import database
+import models
+from config import settings
+from database import utcnow
+
+WRITE_BATCH_SIZE = 50_000
+
+READ_BLOCK_SIZE = 16 << 20  # Bytes of exported CSV parsed at a time
+
+# Columns of store_query, with the types pyarrow parses them as
+STORE_COLUMNS = {
+    "tenant_id": pa.int64(),
+    "id": pa.int64(),
+    "rfm_recency": pa.float64(),
+    "rfm_frequency": pa.float64(),
+    "rfm_monetary": pa.float64(),
+    "segment": pa.string(),
+    "last_purchase": pa.float64(),
+    "frequency": pa.float64(),
+    "monetary": pa.float64(),
+}
+
+# Customers without a purchase in the window
+INACTIVE = "inactive"
+SEGMENTS = (
+    "new",                 # recent first purchase
+    "champions",           # bought recently, often and spent the most
+    "loyal",               # buy often
+    "potential_loyalist",  # recent, a few purchases
+    "at_risk",             # used to buy often, not recently
+    "hibernating",         # not recent, rarely
+    "needs_attention",     # everyone in between
+    INACTIVE,
+)
+
+def store_query(since, tenant_id=None):
+    """
+    Every customer with its current RFM columns and its purchases since
+    `since` aggregated by the database (last purchase as epoch seconds,
+    count, amount), ordered by store.
+    """
+    C, T = models.Customer, models.Transaction
+    purchases = select(
+        T.customer_id,
+        func.max(T.created_at).label("last_purchase"),
+        func.count().label("frequency"),
+        func.sum(T.total_amount).label("monetary")
+    ).where(T.customer_id.isnot(None), T.created_at >= since)
+    query = select(
+        C.tenant_id, C.id, C.rfm_recency, C.rfm_frequency, C.rfm_monetary, C.segment
+    )
+    if tenant_id is not None:
+        purchases = purchases.where(T.tenant_id == tenant_id)
+        query = query.where(C.tenant_id == tenant_id)
+    purchases = purchases.group_by(T.customer_id).subquery()
+    return query.add_columns(
+        cast(extract('epoch', purchases.c.last_purchase), Float),
+        purchases.c.frequency,
+        purchases.c.monetary
+    ).outerjoin(purchases, purchases.c.customer_id == C.id).order_by(C.tenant_id, C.id)
+
+def export_customers(conn, since, tenant_id=None):
+    """
+    Run store_query and return its rows as pyarrow record batches.
+
+    On PostgreSQL the result is COPYed as CSV into a temporary file, so the
+    caller can close the connection and then read it back in blocks
+    (pyarrow's streaming CSV reader) without holding every customer in
+    memory. Other databases (single-store SQLite) are read directly.
+    """
+    query = store_query(since, tenant_id)
+    names = list(STORE_COLUMNS)
+    if conn.dialect.name != "postgresql":
+        rows = conn.execute(query).all()
+        columns = list(zip(*rows)) if rows else [()] * len(names)
+        return [pa.record_batch([
+            pa.array(column, type=STORE_COLUMNS[name]) for name, column in zip(names, columns)
+        ], names=names)]
+
+    # Lets the per-customer aggregate and the sort run in memory
+    conn.exec_driver_sql(f"SET LOCAL work_mem = '{settings.SEGMENT_WORK_MEM_MB}MB'")
+    compiled = query.compile(dialect=conn.dialect)
+    spool = tempfile.TemporaryFile()
+    with conn.connection.dbapi_connection.cursor() as cursor:
+        sql = cursor.mogrify(str(compiled), compiled.params).decode()
+        cursor.copy_expert(f"COPY ({sql}) TO STDOUT WITH CSV", spool)
+    if spool.tell() == 0:
+        spool.close()
+        return []
+    spool.seek(0)
+    return pa_csv.open_csv(
+        spool,
+        read_options=pa_csv.ReadOptions(column_names=names, block_size=READ_BLOCK_SIZE),
+        convert_options=pa_csv.ConvertOptions(column_types=STORE_COLUMNS, strings_can_be_null=True)
+    )
+
+def stores(batches):
+    """Regroup record batches ordered by store into (tenant_id, pyarrow Table) per store"""
+    tenant_id, pieces = None, []
+    for batch in batches:
+        tenants = batch.column("tenant_id").to_numpy()
+        starts = np.flatnonzero(np.r_[True, tenants[1:] != tenants[:-1]]) if len(tenants) else []
+        for start, end in zip(starts, np.r_[starts[1:], len(tenants)].astype(int)):
+            if pieces and tenants[start] != tenant_id:
+                yield tenant_id, pa.Table.from_batches(pieces)
+                pieces = []
+            tenant_id = int(tenants[start])
+            pieces.append(batch.slice(start, end - start))
+    if pieces:
+        yield tenant_id, pa.Table.from_batches(pieces)
+
+def store_arrays(table):
+    """One store's rows as the arrays score_customers and the change check use"""
+    column = lambda name: table.column(name).to_numpy()
+    return {
+        "id": column("id").astype(np.int64),
+        "tenant_id": column("tenant_id").astype(np.int64),
+        "scores": np.column_stack([column("rfm_recency"), column("rfm_frequency"), column("rfm_monetary")]),
+        "segment": column("segment").astype(object),
+        "last_purchase": column("last_purchase"),
+        "frequency": np.nan_to_num(column("frequency")).astype(np.int64),
+        "monetary": np.nan_to_num(column("monetary"))
+    }
+
+def quintiles(groups, values):
+    """
+    Score 1-5 by rank of `values` within each group (5 = highest); equal
+    values share their average rank. groups and values must be 1-D and aligned.
+    """
+    n = len(values)
+    scores = np.empty(n, dtype=np.int64)
+    if n == 0:
+        return scores
+    order = np.lexsort((values, groups))
+    sorted_groups, sorted_values = groups[order], values[order]
+    positions = np.arange(n)
+    # Start of each group and of each run of equal values inside it
+    group_start = np.r_[True, sorted_groups[1:] != sorted_groups[:-1]]
+    run_start = group_start | np.r_[True, sorted_values[1:] != sorted_values[:-1]]
+    first_of_group = np.maximum.accumulate(np.where(group_start, positions, 0))
+    first_of_run = np.maximum.accumulate(np.where(run_start, positions, 0))
+    run_id = np.cumsum(run_start) - 1
+    last_of_run = first_of_run + np.bincount(run_id)[run_id] - 1
+    group_id = np.cumsum(group_start) - 1
+    group_size = np.bincount(group_id)[group_id]
+    rank = (first_of_run + last_of_run) / 2 - first_of_group
+    # ceil((rank + 1) * 5 / size): the top of every group scores 5, even in tiny stores
+    scores[order] = np.ceil((rank + 1) * 5 / group_size).astype(np.int64)
+    return scores
+
+def label_segments(recency, frequency, monetary, purchases):
+    """Vectorised segment label from the three scores and the raw purchase count"""
+    conditions = [
+        purchases == 0,
+        (recency >= 4) & (purchases == 1),
+        (recency >= 4) & (frequency >= 4) & (monetary >= 4),
+        (recency >= 3) & (frequency >= 4),
+        (recency >= 3) & (frequency >= 2),
+        (recency <= 2) & (frequency >= 3),
+        (recency <= 2) & (frequency <= 2),
+    ]
+    choices = [INACTIVE, "new", "champions", "loyal", "potential_loyalist", "at_risk", "hibernating"]
+    return np.select(conditions, choices, default="needs_attention").astype(object)
+
+def score_customers(customers, last_purchase, frequency, monetary):
+    """RFM scores (n x 3, zeros for inactive customers) and segment labels"""
+    n = len(customers["id"])
+    scores = np.zeros((n, 3), dtype=np.int64)
+    active = frequency > 0
+    tenants = customers["tenant_id"][active]
+    # More recent = higher score, so rank by the last purchase time itself
+    scores[active, 0] = quintiles(tenants, last_purchase[active])
+    scores[active, 1] = quintiles(tenants, frequency[active].astype(float))
+    scores[active, 2] = quintiles(tenants, monetary[active])
+    segments = label_segments(scores[:, 0], scores[:, 1], scores[:, 2], frequency)
+    return scores, segments
+
+def write_segments(conn, ids, scores, segments):
+    """Bulk-write scores and labels (temporary table + one UPDATE on PostgreSQL)"""
+    now = utcnow()
+    rows = [{
+        "b_id": int(customer_id), "b_r": int(r), "b_f": int(f), "b_m": int(m), "b_segment": segment
+    } for customer_id, (r, f, m), segment in zip(ids, scores, segments)]
+
+    if conn.dialect.name == "postgresql":
+        conn.execute(text(
+            "CREATE TEMP TABLE rfm_scores (id INTEGER PRIMARY KEY, r SMALLINT, f SMALLINT, "
+            "m SMALLINT, segment VARCHAR) ON COMMIT DROP"
+        ))
+        # COPY is the fastest way to load millions of rows into PostgreSQL
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write(f"{row['b_id']}\t{row['b_r']}\t{row['b_f']}\t{row['b_m']}\t{row['b_segment']}\n")
+        buffer.seek(0)
+        with conn.connection.dbapi_connection.cursor() as cursor:
+            cursor.copy_expert("COPY rfm_scores (id, r, f, m, segment) FROM STDIN", buffer)
+        conn.execute(text(
+            "UPDATE customers SET rfm_recency = s.r, rfm_frequency = s.f, rfm_monetary = s.m, "
+            "segment = s.segment, segment_updated_at = :now FROM rfm_scores s WHERE customers.id = s.id"
+        ), {"now": now})
+        return
+
+    customers = models.Customer.__table__
+    update_scores = customers.update().where(customers.c.id == bindparam("b_id")).values(
+        rfm_recency=bindparam("b_r"),
+        rfm_frequency=bindparam("b_f"),
+        rfm_monetary=bindparam("b_m"),
+        segment=bindparam("b_segment"),
+        segment_updated_at=now
+    )
+    for start in range(0, len(rows), WRITE_BATCH_SIZE):
+        conn.execute(update_scores, rows[start:start + WRITE_BATCH_SIZE])
+
+def refresh_store(conn, customers):
+    """Score one store's customers and write the changed ones; returns (segments, updated)"""
+    scores, segments = score_customers(
+        customers, customers["last_purchase"], customers["frequency"], customers["monetary"]
+    )
+    changed = (segments != customers["segment"]) | np.any(scores != customers["scores"], axis=1)
+    if changed.any():
+        write_segments(conn, customers["id"][changed], scores[changed], segments[changed])
+    return segments, int(changed.sum())
+
+def refresh_segments(tenant_id: int = None, engine=None):
+    """Score every customer (or one tenant's) and write changed results; returns stats"""
+    engine = engine or database.engine
+    started = time.perf_counter()
+    since = utcnow() - timedelta(days=settings.SEGMENT_WINDOW_DAYS)
+    # One consistent read of every store, released before any write
+    with engine.begin() as conn:
+        batches = export_customers(conn, since, tenant_id)
+
+    counts, customers, updated = Counter(), 0, 0
+    for store_id, table in stores(batches):
+        store = store_arrays(table)
+        # One transaction per store: row locks are held briefly and a failure only loses that store
+        with engine.begin() as conn:
+            segments, store_updated = refresh_store(conn, store)
+        counts.update(segments.astype(str).tolist())
+        customers += len(store["id"])
+        updated += store_updated
+
+    return {
+        "customers": customers,
+        "updated": updated,
+        "segments": dict(sorted(counts.items())),
+        "seconds": round(time.perf_counter() - started, 2)
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recompute RFM customer segments")
+    parser.add_argument("--tenant", type=int, default=None, help="Only this tenant id")
+    args = parser.parse_args()
+
+    stats = refresh_segments(args.tenant)
+    for segment, count in sorted(stats["segments"].items()):
+        print(f"  {segment:<20} {count}")
+    print(f"\n✅ Scored {stats['customers']} customers, updated {stats['updated']} in {stats['seconds']}s")
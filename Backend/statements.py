@@ -0,0 +1,105 @@
+"""
+Prebuilt statements for the hot read paths.
+
+db.query(...).filter(...) rebuilds the whole statement on every request and
+SQLAlchemy then walks it again to derive the cache key before it can reuse
+the compiled SQL. The lookups below are built once at import with named
+bind parameters, so each call only binds values: the cache key is memoized
+on the statement object and the compiled SQL comes straight from the
+engine's cache.
+
+(Lambda statements were measured too; with ORM entities SQLAlchemy 2.1
+still clones the statement on every call, which made them slower than
+query().)
+
+Measure with:
+    python benchmark_statements.py
+"""
+from sqlalchemy import bindparam, select, tuple_
+from sqlalchemy.orm import Session, selectinload
+import models
+
+USER_BY_EMAIL = select(models.User).where(models.User.email == bindparam("email")).limit(1)
+
+PRODUCT_BY_ID = select(models.Product).where(
+    models.Product.id == bindparam("product_id"),
+    models.Product.tenant_id == bindparam("tenant_id")
+).limit(1)
+
+PRODUCT_BY_BARCODE = select(models.Product).where(
+    models.Product.barcode == bindparam("barcode"),
+    models.Product.tenant_id == bindparam("tenant_id")
+).limit(1)
+
+CUSTOMER_BY_ID = select(models.Customer).where(
+    models.Customer.id == bindparam("customer_id"),
+    models.Customer.tenant_id == bindparam("tenant_id")
+).limit(1)
+
+# Transaction history filters by name; a page statement is built once per combination used
+TRANSACTION_FILTERS = {
+    "start": models.Transaction.created_at >= bindparam("start"),
+    "end": models.Transaction.created_at < bindparam("end"),
+    "customer_id": models.Transaction.customer_id == bindparam("customer_id"),
+    "user_id": models.Transaction.user_id == bindparam("user_id"),
+    "payment_method": models.Transaction.payment_method == bindparam("payment_method"),
+    # Keyset cursor: rows strictly after the previous page's last (created_at, id).
+    # Typed binds: untyped ones inside tuple_() skip the column's DateTime processing
+    "before": tuple_(models.Transaction.created_at, models.Transaction.id) < tuple_(
+        bindparam("before_created_at", type_=models.Transaction.created_at.type),
+        bindparam("before_id", type_=models.Transaction.id.type)
+    ),
+}
+_transaction_pages = {}
+
+def transaction_page_statement(filters):
+    """(id, created_at) of a page of a store's transactions, newest first; reads only the covering index"""
+    key = tuple(sorted(filters))
+    statement = _transaction_pages.get(key)
+    if statement is None:
+        T = models.Transaction
+        statement = select(T.id, T.created_at).where(
+            T.tenant_id == bindparam("tenant_id"), *(TRANSACTION_FILTERS[name] for name in key)
+        ).order_by(T.created_at.desc(), T.id.desc()).offset(bindparam("skip")).limit(bindparam("limit"))
+        _transaction_pages[key] = statement
+    return statement
+
+def user_by_email(db: Session, email: str):
+    return db.execute(USER_BY_EMAIL, {"email": email}).scalars().first()
+
+def product_by_id(db: Session, tenant_id: int, product_id: int):
+    return db.execute(PRODUCT_BY_ID, {"product_id": product_id, "tenant_id": tenant_id}).scalars().first()
+
+def product_by_barcode(db: Session, tenant_id: int, barcode: str):
+    return db.execute(PRODUCT_BY_BARCODE, {"barcode": barcode, "tenant_id": tenant_id}).scalars().first()
+
+def customer_by_id(db: Session, tenant_id: int, customer_id: int):
+    return db.execute(CUSTOMER_BY_ID, {"customer_id": customer_id, "tenant_id": tenant_id}).scalars().first()
+
+def transaction_page(db: Session, tenant_id: int, limit: int, skip: int = 0, **filters):
+    """
+    One page of a store's transactions, newest first, with their items.
+    Filters (None skips one): start/end (created_at range), customer_id,
+    user_id, payment_method, before ((created_at, id) of the previous
+    page's last row).
+    """
+    filters = {name: value for name, value in filters.items() if value is not None}
+    params = {"tenant_id": tenant_id, "skip": skip, "limit": limit}
+    for name, value in filters.items():
+        if name == "before":
+            params["before_created_at"], params["before_id"] = value
+        else:
+            params[name] = value
+    page = db.execute(transaction_page_statement(filters), params).all()
+    if not page:
+        return []
+
+    T = models.Transaction
+    rows = db.execute(select(T).options(selectinload(T.items)).where(
+        T.id.in_([row.id for row in page]),
+        # Bounds on created_at prune monthly partitions
+        T.created_at >= page[-1].created_at,
+        T.created_at <= page[0].created_at
+    )).scalars().all()
+    by_id = {row.id: row for row in rows}
+    return [by_id[row.id] for row in page]
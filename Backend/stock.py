@@ -0,0 +1,109 @@
+"""
+Atomic stock changes.
+
+Every change to products.stock_quantity (checkout, product edits, stock
+adjustments) goes through apply_stock_changes(). Each line is a single
+conditional UPDATE ... RETURNING that checks availability (and optionally
+the product version) in its WHERE clause and bumps version/updated_at, so
+stock is never read and written back in Python and a lane holds a row lock
+only for the duration of its own statement. Lines are applied in product id
+order so concurrent baskets always lock rows in the same order.
+"""
+from sqlalchemy import update
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
+import models
+from database import utcnow
+
+class StockChange:
+    """
+    One line: add `delta` to stock or set it to `set_to`. Decrements must
+    leave stock_quantity - reserved_quantity >= 0. With expected_version the
+    line only applies if the product has not changed since it was read.
+    """
+    __slots__ = ("product_id", "delta", "set_to", "expected_version")
+
+    def __init__(self, product_id: int, delta: int = 0, set_to: int = None, expected_version: int = None):
+        self.product_id = product_id
+        self.delta = delta
+        self.set_to = set_to
+        self.expected_version = expected_version
+
+class StockConflict(Exception):
+    """One or more lines could not be applied; conflicts holds one dict per line"""
+
+    def __init__(self, conflicts):
+        self.conflicts = conflicts
+        super().__init__(" ".join(conflict["message"] for conflict in conflicts))
+
+def _describe_conflict(db, tenant_id: int, change: StockChange):
+    P = models.Product
+    row = db.query(P.name, P.stock_quantity, P.reserved_quantity, P.version).filter(
+        P.id == change.product_id,
+        P.tenant_id == tenant_id
+    ).first()
+    if row is None:
+        return {
+            "product_id": change.product_id,
+            "reason": "not_found",
+            "message": f"Product {change.product_id} not found."
+        }
+    name, stock_quantity, reserved_quantity, version = row
+    available = max(stock_quantity - reserved_quantity, 0)
+    if change.expected_version is not None and version != change.expected_version:
+        return {
+            "product_id": change.product_id,
+            "reason": "version_conflict",
+            "version": version,
+            "available": available,
+            "message": f"{name} was changed by someone else, reload and try again."
+        }
+    return {
+        "product_id": change.product_id,
+        "reason": "insufficient_stock",
+        "version": version,
+        "available": available,
+        "message": f"Not enough stock for {name}. Available: {available}"
+    }
+
+def apply_stock_changes(db, tenant_id: int, changes):
+    """
+    Apply stock changes in the caller's transaction (the caller commits).
+    At most one line per product. Returns {product_id: (stock_quantity, version)}
+    and refreshes those attributes on products already loaded in the session.
+    Raises StockConflict describing every line that failed; the caller must
+    not commit, since the lines that succeeded have already been written.
+    """
+    P = models.Product
+    now = utcnow()
+    applied, conflicts = {}, []
+    for change in sorted(changes, key=lambda change: change.product_id):
+        values = {P.version: P.version + 1, P.updated_at: now}
+        stmt = update(P).where(P.id == change.product_id, P.tenant_id == tenant_id)
+        if change.set_to is not None:
+            values[P.stock_quantity] = change.set_to
+        elif change.delta:
+            values[P.stock_quantity] = P.stock_quantity + change.delta
+            if change.delta < 0:
+                stmt = stmt.where(P.stock_quantity - P.reserved_quantity >= -change.delta)
+        if change.expected_version is not None:
+            stmt = stmt.where(P.version == change.expected_version)
+
+        row = db.execute(
+            stmt.values(values).returning(P.stock_quantity, P.version),
+            execution_options={"synchronize_session": False}
+        ).first()
+        if row is None:
+            conflicts.append(_describe_conflict(db, tenant_id, change))
+            continue
+        applied[change.product_id] = (row.stock_quantity, row.version)
+
+        product = db.identity_map.get(identity_key(P, change.product_id))
+        if product is not None:
+            set_committed_value(product, "stock_quantity", row.stock_quantity)
+            set_committed_value(product, "version", row.version)
+            set_committed_value(product, "updated_at", now)
+
+    if conflicts:
+        raise StockConflict(conflicts)
+    return applied
@@ -0,0 +1,219 @@
+"""
+In-process background task pipeline backed by a transactional outbox.
+
+Request handlers call enqueue() before their commit, so the side effect is
+recorded atomically with the change that caused it and survives restarts.
+A daemon thread in every worker process claims due tasks, runs the
+registered handler in its own session and deletes the task on success.
+Failed tasks are retried with exponential backoff and marked 'failed' after
+TASK_MAX_ATTEMPTS.
+
+Modules can also register periodic maintenance jobs with @periodic; every
+worker runs them, so they must be safe to run concurrently.
+
+Claiming is an optimistic UPDATE on available_at, so several worker
+processes can poll the same table without double-running a task; a task
+held by a crashed worker becomes claimable again once its lease expires.
+"""
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import case, update
+import database
+import models
+import receipts
+import rollups
+from config import settings
+from database import utcnow
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+PERIODIC = []  # [fn, interval_seconds, next_run (monotonic)]
+
+_wakeup = threading.Event()
+_stop = threading.Event()
+_worker = None
+
+def task(task_type: str):
+    """Register a handler: fn(db, payload). The worker commits after it returns."""
+    def register(fn):
+        HANDLERS[task_type] = fn
+        return fn
+    return register
+
+def periodic(interval_seconds: float):
+    """Register a job fn(db) run by the worker every interval_seconds (the job commits)"""
+    def register(fn):
+        PERIODIC.append([fn, interval_seconds, 0.0])
+        return fn
+    return register
+
+def enqueue(db, task_type: str, payload: dict):
+    """Add a task to the outbox in the caller's transaction (call notify() after commit)"""
+    if task_type not in HANDLERS:
+        raise ValueError(f"Unknown task type: {task_type}")
+    db.add(models.OutboxTask(
+        task_type=task_type,
+        payload=json.dumps(payload),
+        available_at=utcnow()
+    ))
+
+def notify():
+    """Wake this process's worker so freshly committed tasks run immediately"""
+    _wakeup.set()
+
+# ==========================================
+# TASK HANDLERS
+# ==========================================
+
+@task("customer_stats")
+def update_customer_stats(db, payload):
+    """Purchase total, loyalty points (1 per dollar) and last purchase date"""
+    purchased_at = datetime.fromisoformat(payload["purchased_at"])
+    Customer = models.Customer
+    db.execute(update(Customer).where(
+        Customer.id == payload["customer_id"],
+        Customer.tenant_id == payload["tenant_id"]
+    ).values(
+        total_purchases=Customer.total_purchases + payload["total_amount"],
+        loyalty_points=Customer.loyalty_points + int(payload["total_amount"]),
+        last_purchase_date=case(
+            (Customer.last_purchase_date.is_(None), purchased_at),
+            (Customer.last_purchase_date < purchased_at, purchased_at),
+            else_=Customer.last_purchase_date
+        )
+    ))
+
+@task("product_rollup")
+def update_product_rollup(db, payload):
+    rollups.record_sale(
+        db,
+        payload["tenant_id"],
+        datetime.fromisoformat(payload["day"]).date(),
+        payload["lines"]
+    )
+
+@task("render_receipt")
+def render_receipt(db, payload):
+    if not receipts.get_cached_receipt(db, payload["transaction_id"], payload["tenant_id"]):
+        receipts.render_receipt(db, payload["transaction_id"], payload["tenant_id"])
+
+# ==========================================
+# WORKER
+# ==========================================
+
+def due_tasks(db, limit: int):
+    """(id, available_at) of up to `limit` due tasks; read-only"""
+    return db.query(models.OutboxTask.id, models.OutboxTask.available_at).filter(
+        models.OutboxTask.status == "pending",
+        models.OutboxTask.available_at <= utcnow()
+    ).order_by(models.OutboxTask.available_at).limit(limit).all()
+
+def claim_batch(db, due):
+    """Claim due tasks by pushing their available_at past the lease (skips any claimed meanwhile)"""
+    lease_until = utcnow() + timedelta(seconds=settings.TASK_LEASE_SECONDS)
+    claimed = []
+    for task_id, available_at in due:
+        result = db.execute(update(models.OutboxTask).where(
+            models.OutboxTask.id == task_id,
+            models.OutboxTask.available_at == available_at
+        ).values(
+            available_at=lease_until,
+            attempts=models.OutboxTask.attempts + 1
+        ))
+        if result.rowcount == 1:
+            claimed.append(task_id)
+    db.commit()
+    return claimed
+
+def run_task(task_id: int):
+    """Run one claimed task in its own session"""
+    db = database.SessionLocal()
+    try:
+        outbox_task = db.get(models.OutboxTask, task_id)
+        if outbox_task is None:
+            return
+        try:
+            HANDLERS[outbox_task.task_type](db, json.loads(outbox_task.payload))
+            db.delete(outbox_task)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            outbox_task = db.get(models.OutboxTask, task_id)
+            outbox_task.last_error = str(e)[:500]
+            if outbox_task.attempts >= settings.TASK_MAX_ATTEMPTS:
+                outbox_task.status = "failed"
+                logger.error(f"Task {task_id} ({outbox_task.task_type}) failed permanently: {e}")
+            else:
+                outbox_task.available_at = utcnow() + timedelta(seconds=2 ** outbox_task.attempts)
+                logger.warning(f"Task {task_id} ({outbox_task.task_type}) failed, will retry: {e}")
+            db.commit()
+    finally:
+        db.close()
+
+def process_pending(limit: int = None):
+    """Claim and run one batch of due tasks; returns how many ran"""
+    # Poll through a reader so an idle worker never queues for the SQLite writer lock
+    db = database.PrimaryReadSessionLocal()
+    try:
+        due = due_tasks(db, limit or settings.TASK_BATCH_SIZE)
+    finally:
+        db.close()
+    if not due:
+        return 0
+    db = database.SessionLocal()
+    try:
+        task_ids = claim_batch(db, due)
+    finally:
+        db.close()
+    for task_id in task_ids:
+        run_task(task_id)
+    return len(task_ids)
+
+def run_periodic():
+    """Run the periodic jobs that are due"""
+    now = time.monotonic()
+    for job in PERIODIC:
+        fn, interval, next_run = job
+        if now < next_run:
+            continue
+        job[2] = now + interval
+        db = database.SessionLocal()
+        try:
+            fn(db)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Periodic job {fn.__name__} failed: {e}")
+        finally:
+            db.close()
+
+def _worker_loop():
+    while not _stop.is_set():
+        run_periodic()
+        try:
+            ran = process_pending()
+        except Exception as e:
+            logger.error(f"Task worker error: {e}")
+            ran = 0
+        if ran < settings.TASK_BATCH_SIZE:
+            # Sleep until notified or until the next poll
+            _wakeup.wait(settings.TASK_POLL_INTERVAL)
+            _wakeup.clear()
+
+def start_worker():
+    """Start the background worker thread for this process"""
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return
+    _stop.clear()
+    _worker = threading.Thread(target=_worker_loop, name="outbox-worker", daemon=True)
+    _worker.start()
+
+def stop_worker(timeout: float = 5.0):
+    _stop.set()
+    _wakeup.set()
+    if _worker is not None:
+        _worker.join(timeout)
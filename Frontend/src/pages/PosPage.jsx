@@ -40,11 +40,15 @@ const PosPage = () => {
   const fetchProducts = async () => {
     const token = localStorage.getItem('token');
     try {
-      const res = await fetch('http://127.0.0.1:8000/api/v1/products', {
+      // Store, categories and catalog in one compressed response (304 if unchanged)
+      const res = await fetch('http://127.0.0.1:8000/api/v1/pos/bootstrap', {
         headers: { 'Authorization': `Bearer ${token}` }
       });
       const data = await res.json();
-      setProducts(data);
+      // Products come as parallel arrays: { id: [...], name: [...], ... }
+      const columns = data.products;
+      const fields = Object.keys(columns);
+      setProducts(columns.id.map((_, i) => Object.fromEntries(fields.map(field => [field, columns[field][i]]))));
     } catch (err) {
       console.error("Error fetching products", err);
     }
@@ -32,9 +32,18 @@ import {
   Visibility,
 } from '@mui/icons-material';
 
+const WEEKDAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'];
+const HOURS = Array.from({ length: 24 }, (_, hour) => hour);
+
+// Store-local YYYY-MM-DD (toISOString alone would give the UTC date)
+const localDate = (date) => new Date(date.getTime() - date.getTimezoneOffset() * 60000).toISOString().slice(0, 10);
+
 const ReportsPage = () => {
   const [transactions, setTransactions] = useState([]);
   const [analytics, setAnalytics] = useState([]);
+  const [paymentMethods, setPaymentMethods] = useState([]);
+  const [cashiers, setCashiers] = useState([]);
+  const [heatmap, setHeatmap] = useState([]);
   const [dashboardStats, setDashboardStats] = useState(null);
   const [loading, setLoading] = useState(true);
   const [selectedTransaction, setSelectedTransaction] = useState(null);
@@ -51,7 +60,23 @@ const ReportsPage = () => {
     try {
       setLoading(true);
       
-      // Fetch transactions
+      // Breakdowns are aggregated by the server over the whole period (local days)
+      const end = new Date();
+      const start = new Date(end);
+      start.setDate(start.getDate() - (daysFilter - 1));
+      const range = `start_date=${localDate(start)}&end_date=${localDate(end)}&tz_offset=${-end.getTimezoneOffset()}`;
+      const [paymentRes, cashierRes, heatmapRes] = await Promise.all(
+        ['by-payment-method', 'by-cashier', 'heatmap'].map((report) =>
+          fetch(`http://127.0.0.1:8000/api/v1/analytics/sales/${report}?${range}`, {
+            headers: { 'Authorization': `Bearer ${token}` },
+          })
+        )
+      );
+      setPaymentMethods(await paymentRes.json());
+      setCashiers(await cashierRes.json());
+      setHeatmap(await heatmapRes.json());
+
+      // Most recent transactions (a list only; totals come from the reports above)
       const txnRes = await fetch('http://127.0.0.1:8000/api/v1/transactions?limit=100', {
         headers: { 'Authorization': `Bearer ${token}` },
       });
@@ -103,6 +128,12 @@ const ReportsPage = () => {
     return new Date(dateString).toLocaleString();
   };
 
+  const heatmapCells = {};
+  heatmap.forEach((cell) => {
+    heatmapCells[`${cell.weekday}-${cell.hour}`] = cell;
+  });
+  const busiestHour = Math.max(1, ...heatmap.map((cell) => cell.transaction_count));
+
   if (loading) {
     return (
       <Box sx={{ display: 'flex', justifyContent: 'center', p: 4 }}>
@@ -212,7 +243,10 @@ const ReportsPage = () => {
       <Paper sx={{ mb: 3 }}>
         <Tabs value={tabValue} onChange={(e, newValue) => setTabValue(newValue)}>
           <Tab label="Sales Chart" />
-          <Tab label="Transaction History" />
+          <Tab label="Payment Methods" />
+          <Tab label="Cashiers" />
+          <Tab label="Busiest Hours" />
+          <Tab label="Recent Transactions" />
         </Tabs>
       </Paper>
 
@@ -259,8 +293,132 @@ const ReportsPage = () => {
         </Paper>
       )}
 
-      {/* Transaction History Tab */}
+      {/* Payment Methods Tab */}
       {tabValue === 1 && (
+        <Paper sx={{ p: 3, mb: 3 }}>
+          <Typography variant="h6" gutterBottom>
+            Sales by Payment Method ({daysFilter} days)
+          </Typography>
+          {paymentMethods.length > 0 ? (
+            <TableContainer>
+              <Table>
+                <TableHead>
+                  <TableRow>
+                    <TableCell><strong>Payment Method</strong></TableCell>
+                    <TableCell align="center"><strong>Transactions</strong></TableCell>
+                    <TableCell align="right"><strong>Total Sales</strong></TableCell>
+                    <TableCell align="right"><strong>Discounts</strong></TableCell>
+                    <TableCell align="right"><strong>Average Sale</strong></TableCell>
+                  </TableRow>
+                </TableHead>
+                <TableBody>
+                  {paymentMethods.map((row) => (
+                    <TableRow key={row.payment_method || 'unknown'}>
+                      <TableCell>{(row.payment_method || 'unknown').toUpperCase()}</TableCell>
+                      <TableCell align="center">{row.transaction_count}</TableCell>
+                      <TableCell align="right" sx={{ fontWeight: 'bold', color: 'primary.main' }}>
+                        {formatCurrency(row.total_sales)}
+                      </TableCell>
+                      <TableCell align="right">{formatCurrency(row.discount_total)}</TableCell>
+                      <TableCell align="right">{formatCurrency(row.average_sale)}</TableCell>
+                    </TableRow>
+                  ))}
+                </TableBody>
+              </Table>
+            </TableContainer>
+          ) : (
+            <Alert severity="info">No sales data available for the selected period.</Alert>
+          )}
+        </Paper>
+      )}
+
+      {/* Cashiers Tab */}
+      {tabValue === 2 && (
+        <Paper sx={{ p: 3, mb: 3 }}>
+          <Typography variant="h6" gutterBottom>
+            Sales by Cashier ({daysFilter} days)
+          </Typography>
+          {cashiers.length > 0 ? (
+            <TableContainer>
+              <Table>
+                <TableHead>
+                  <TableRow>
+                    <TableCell><strong>Cashier</strong></TableCell>
+                    <TableCell align="center"><strong>Transactions</strong></TableCell>
+                    <TableCell align="right"><strong>Total Sales</strong></TableCell>
+                    <TableCell align="right"><strong>Average Sale</strong></TableCell>
+                  </TableRow>
+                </TableHead>
+                <TableBody>
+                  {cashiers.map((row) => (
+                    <TableRow key={row.user_id ?? 'unknown'}>
+                      <TableCell>{row.cashier_name}</TableCell>
+                      <TableCell align="center">{row.transaction_count}</TableCell>
+                      <TableCell align="right" sx={{ fontWeight: 'bold', color: 'primary.main' }}>
+                        {formatCurrency(row.total_sales)}
+                      </TableCell>
+                      <TableCell align="right">{formatCurrency(row.average_sale)}</TableCell>
+                    </TableRow>
+                  ))}
+                </TableBody>
+              </Table>
+            </TableContainer>
+          ) : (
+            <Alert severity="info">No sales data available for the selected period.</Alert>
+          )}
+        </Paper>
+      )}
+
+      {/* Busiest Hours Tab */}
+      {tabValue === 3 && (
+        <Paper sx={{ p: 3, mb: 3 }}>
+          <Typography variant="h6" gutterBottom>
+            Transactions by Weekday and Hour ({daysFilter} days)
+          </Typography>
+          {heatmap.length > 0 ? (
+            <TableContainer>
+              <Table size="small">
+                <TableHead>
+                  <TableRow>
+                    <TableCell />
+                    {HOURS.map((hour) => (
+                      <TableCell key={hour} align="center" sx={{ px: 0.5 }}>{hour}</TableCell>
+                    ))}
+                  </TableRow>
+                </TableHead>
+                <TableBody>
+                  {WEEKDAYS.map((weekday, index) => (
+                    <TableRow key={weekday}>
+                      <TableCell><strong>{weekday}</strong></TableCell>
+                      {HOURS.map((hour) => {
+                        const cell = heatmapCells[`${index}-${hour}`];
+                        return (
+                          <TableCell
+                            key={hour}
+                            align="center"
+                            title={cell ? formatCurrency(cell.total_sales) : undefined}
+                            sx={{
+                              px: 0.5,
+                              bgcolor: cell ? `rgba(25, 118, 210, ${0.1 + 0.9 * cell.transaction_count / busiestHour})` : undefined,
+                            }}
+                          >
+                            {cell ? cell.transaction_count : ''}
+                          </TableCell>
+                        );
+                      })}
+                    </TableRow>
+                  ))}
+                </TableBody>
+              </Table>
+            </TableContainer>
+          ) : (
+            <Alert severity="info">No sales data available for the selected period.</Alert>
+          )}
+        </Paper>
+      )}
+
+      {/* Recent Transactions Tab */}
+      {tabValue === 4 && (
         <TableContainer component={Paper}>
           <Table>
             <TableHead>
@@ -286,7 +444,7 @@ const ReportsPage = () => {
                     <TableCell>{formatDate(transaction.created_at)}</TableCell>
                     <TableCell>
                       <Chip 
-                        label={transaction.payment_method.toUpperCase()} 
+                        label={(transaction.payment_method || 'unknown').toUpperCase()} 
                         size="small"
                         color={transaction.payment_method === 'cash' ? 'success' : 'primary'}
                       />
@@ -329,7 +487,7 @@ const ReportsPage = () => {
                 <Grid item xs={6}>
                   <Typography variant="body2" color="text.secondary">Payment Method</Typography>
                   <Typography variant="body1" fontWeight="bold">
-                    {selectedTransaction.payment_method.toUpperCase()}
+                    {(selectedTransaction.payment_method || 'unknown').toUpperCase()}
                   </Typography>
                 </Grid>
               </Grid>